@@ -4,35 +4,53 @@ __version__ = '2019.10'
 __author__ = 'André Sartori'
 
 import argparse
+import atexit
 import chardet
+import csv
 from difflib import SequenceMatcher
-import docx2txt
+import glob
+import hashlib
+import itertools
+import json
 import logging
 import logging.config
 import math
 import os
 import regex
-import requests
-import shelve
 import shutil
 import statistics
 import subprocess
 import sys
 import textract
+import threading
+import time
 import xml.etree.ElementTree as ET
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
-from docx import Document
-from io import StringIO, BytesIO
+from io import StringIO, BytesIO, TextIOWrapper
 from pprint import pprint
 from PyPDF2 import PdfFileReader, utils
 from PIL import Image
 import imagehash
 from tempfile import TemporaryDirectory, mkdtemp
 
+from utils.artifact_store import ArtifactStore, file_digest
+from utils.cermine import CermineService, LazyCermineBatch, cermine_folder, copy_cermine_outputs, \
+    find_cermine_outputs
 from utils.constants import SMUR, AM, P, VOR
+from utils.doi_resolver import DOIResolver
+from utils.docx_reader import read_docx
 from utils.patterns import DOI_PATTERN, ALL_CC_LICENCES, RIGHTS_RESERVED_PATTERNS, VERSION_PATTERNS
-from utils.logos import PublisherLogo
+from utils.pdf_images import extract_images, render_header_strip
+from utils.pdf_metadata import PdfMetadataError, read_pdf_metadata
+from utils.pattern_set import DEFAULT_ERROR_RATIO, PatternSet
+from utils.logos import LOGOS_INDEX_PATH, PublisherLogo, hash_images, load_logo_index
+from utils.normalised_text import NormalisedText, split_pages
+from utils.result_cache import ResultCache
+from utils.scheduler import Scheduler, Stage
+from utils.timing import ChromeTrace, StageTimer
+from utils.TrueViz import Document as TrueVizDocument
 
 logging.config.fileConfig('logging.conf', defaults={'logfilename':'artemis.log'})
 logger = logging.getLogger(__name__)
@@ -43,6 +61,29 @@ LOGOS_DB_PATH = "utils/logos_db.shelve"
 
 NUMBER_OF_CHARACTERS_IN_ONE_PAGE = 2600
 
+# pages extracted by PdfParser.extract_front_back_text; title, DOI and licence statements are found in these
+FRONT_PAGES = 3
+BACK_PAGES = 2
+# median line spacing ratio (see utils.TrueViz.line_spacing_ratios) from which body text is considered one-and-a-half
+# or double spaced, as manuscripts often are but typeset articles never are
+MANUSCRIPT_LINE_SPACING = 1.8
+
+# number of characters of body text read from DOCX files, which is enough for all DocxParser tests; None to read all
+DOCX_MAX_CHARACTERS = 3 * NUMBER_OF_CHARACTERS_IN_ONE_PAGE
+# number of characters read from pdftotext at a time when streaming pages (see PdfParser.iter_page_texts)
+PAGE_STREAM_CHUNK_SIZE = 64 * 1024
+
+# number of leading pages searched for publisher logos when CERMINE has not extracted the images of the whole file
+LOGO_PAGES = 1
+# pages whose top strip is rendered and searched for logos drawn as vector art, which are never extracted as images
+# (negative numbers count from the last page, e.g. [1, -1] for the first and last pages); empty to disable
+HEADER_STRIP_PAGES = [1]
+
+# windowed fuzzy search: the window around the expected span grows by this factor until a match is found
+SEARCH_WINDOW_GROWTH_FACTOR = 4
+# maximum number of seconds spent on a single fuzzy search (None for no limit)
+FUZZY_SEARCH_TIMEOUT = 30
+
 PUBLISHER_PDF_METADATA_TAGS = [
     '/CrossMarkDomains#5B1#5D',
     '/CrossMarkDomains#5B2#5D',
@@ -51,23 +92,182 @@ PUBLISHER_PDF_METADATA_TAGS = [
     '/doi',
     '/ElsevierWebPDFSpecifications',
     '/Keywords',
+    # XMP fields (see utils.pdf_metadata.parse_xmp)
+    'crossmark:CrossmarkDomainExclusive',
+    'crossmark:CrossMarkDomains',
+    'crossmark:DOI',
+    'crossmark:MajorVersionDate',
 ]
 
-DOI_BASE_URL = "https://doi.org/"
+# versions of the extractors whose outputs are kept in ArtifactStore; change a version to invalidate stored artifacts
+ARTIFACT_VERSIONS = {
+    'text': 'textract-1.6.1',
+    'front_back_text': 'pdftotext',
+    'docx_text': 'docx_reader-1',
+    'file_metadata': 'pdf_metadata-1',
+    'cermine': 'cermine-1.13',
+    'image_hashes': 'ImageHash-4.0-draft',
+    'page_image_hashes': 'ImageHash-4.0-draft',
+}
+
+SUPPORTED_EXTENSIONS = [".pdf", ".docx"]
+
+# columns of a batch manifest (CSV or JSONL) that map to VersionDetector arguments; any other column is passed on as
+# citation metadata (e.g. doi, acceptance_date)
+MANIFEST_PATH_KEY = 'path'
+MANIFEST_TITLE_KEY = 'title'
+MANIFEST_VERSION_KEY = 'version'
+MANIFEST_AUTHORS_KEY = 'authors'
+
+# CermineService, ArtifactStore, ResultCache and DOIResolver shared by all files processed by a batch worker process (see
+# init_batch_worker)
+worker_cermine_service = None
+worker_artifact_store = None
+worker_result_cache = None
+worker_doi_resolver = None
 
 NUMBER_PATTERN = regex.compile("\d+")
 
+# kinds of pattern in TEXT_PATTERN_SET
+CC_PATTERN = 'cc'
+VERSION_PATTERN = 'version'
+RIGHTS_RESERVED_PATTERN = 'rights reserved'
+
+
+def build_text_pattern_set():
+    """
+    Compiles all patterns searched in extracted text into a single PatternSet. The payload of each pattern is a tuple
+    (kind, source), where source is the licence dictionary, VersionPattern instance or pattern dictionary it came from.
+    Patterns of the same kind are added in order of precedence. ADDITIONAL_CC_PATTERNS are not searched, as they are
+    not used by any test.
+    :return: PatternSet instance
+    """
+    ps = PatternSet()
+    for l in ALL_CC_LICENCES:
+        for key, error_ratio in [('url', 0), ('long name', 0.1), ('short name', 0)]:
+            ps.add("{} ({})".format(l['short name'], key), l[key], error_ratio=error_ratio, payload=(CC_PATTERN, l))
+    for vp in VERSION_PATTERNS:
+        ps.add(vp.pattern, vp.pattern, error_ratio=vp.error_ratio, payload=(VERSION_PATTERN, vp))
+    for p in RIGHTS_RESERVED_PATTERNS:
+        ps.add(p['pattern'], p['pattern'], error_ratio=p.get('error ratio', DEFAULT_ERROR_RATIO),
+               payload=(RIGHTS_RESERVED_PATTERN, p))
+    return ps
+
+
+TEXT_PATTERN_SET = build_text_pattern_set()
+
+# maximum number of stages of PdfParser.parse running at the same time (1 to run them one after another)
+PDF_STAGE_WORKERS = 4
+
+# estimated cost of each stage of PdfParser.parse, in arbitrary units; stages are run cheapest first
+PDF_STAGE_COSTS = {
+    'file_metadata': 1,
+    'title_match_file_metadata': 1,
+    'publisher_tags': 1,
+    'text': 5,
+    'more_than_three_pages': 1,
+    'title_match_extracted_text': 3,
+    'doi': 30,
+    'cc_match_extracted_text': 2,
+    'rights_reserved': 1,
+    'version_patterns': 2,
+    'cermine': 300,
+    'title_match_cermxml': 1,
+    'image_on_first_page': 5,
+    'logos': 15,
+    'layout': 10,
+}
+
+# marks stages of PdfParser.parse that only add details to test results (see PdfParser.build_stages)
+INFORMATIONAL = 'informational'
+
+# possible values of the evidence decide_pdf_verdict is based on
+PDF_EVIDENCE_VALUES = {
+    'title_match_file_metadata': [True, False, None],
+    'publisher_tags': [True, False],
+    'more_than_three_pages': [True, False, None],
+    'title_match_extracted_text': [True, False, None],
+    'cc_match_extracted_text': [True, False],
+    'title_match_cermxml': [True, False, None],
+}
+
+
+def decide_pdf_verdict(evidence, dec_version, file_name):
+    """
+    Decides whether to approve deposit of a PDF file. This is a pure function of the evidence, so that PdfParser can
+    test whether the results of tests it has not run yet could still change the verdict.
+    :param evidence: dictionary with a value for every key of PDF_EVIDENCE_VALUES
+    :param dec_version: Declared manuscript version of file
+    :param file_name: Name of file
+    :return: Tuple (approve_deposit, reason, list of versions to exclude from possible versions)
+    """
+    approve_deposit = False
+    exclude = []
+    author_versions = ['submitted version', 'accepted version', SMUR, AM]
+    declared_author_version = (dec_version or '').lower() in author_versions
+    if evidence['more_than_three_pages'] and (evidence['title_match_file_metadata'] or
+                                              evidence['title_match_extracted_text'] or
+                                              evidence['title_match_cermxml']):
+        # sanity check (this is the correct file; no mistake on upload)
+        if evidence['publisher_tags'] or evidence['cc_match_extracted_text']:
+            # file is publisher-generated
+            # TODO: Add more tests here
+            exclude = [SMUR, AM]
+            if evidence['cc_match_extracted_text']:
+                reason = 'Create Commons licence detected in extracted text'
+                approve_deposit = True  # could be proof, so additional checking is desirable
+            else:
+                reason = 'Publisher-generated version; no evidence of CC licence'
+        else:
+            if declared_author_version:
+                approve_deposit = True
+                reason = 'Could not find any evidence that this PDF is publisher-generated'
+            else:
+                reason = "This is either a submitted or accepted version, " \
+                         "but declared version is {}".format(dec_version)
+    else:
+        reason = "File {} failed automated checks. more_than_three_pages: {}, title_match_file_metadata:" \
+                 " {}, title_match_extracted_text: {}".format(file_name, evidence['more_than_three_pages'],
+                                                              evidence['title_match_file_metadata'],
+                                                              evidence['title_match_extracted_text'])
+    return approve_deposit, reason, exclude
+
+def ruleset_version():
+    """
+    Identifies the rules used to reach a verdict, so that cached results are invalidated when any of them changes
+    :return: hexadecimal digest of Artemis version, publisher metadata tags, text patterns, thresholds and evidence the
+        verdict depends on, extractor versions and logos database
+    """
+    h = hashlib.sha256()
+    text_patterns = [(e.name, e.pattern, e.max_errors, e.literal) for e in TEXT_PATTERN_SET.entries]
+    thresholds = [NUMBER_OF_CHARACTERS_IN_ONE_PAGE, FRONT_PAGES, BACK_PAGES, MANUSCRIPT_LINE_SPACING,
+                  DOCX_MAX_CHARACTERS, LOGO_PAGES, HEADER_STRIP_PAGES, PDF_EVIDENCE_VALUES]
+    rules = [__version__, PUBLISHER_PDF_METADATA_TAGS, DOI_PATTERN, ALL_CC_LICENCES, RIGHTS_RESERVED_PATTERNS,
+             [vars(p) for p in VERSION_PATTERNS], text_patterns, thresholds, ARTIFACT_VERSIONS]
+    h.update(json.dumps(rules, sort_keys=True, default=str).encode('utf-8'))
+    # shelve may store the logos database in more than one file (e.g. .dat and .dir), depending on dbm backend; only
+    # the files of the logos index are read, not temporary files left by an interrupted conversion
+    index_files = [LOGOS_INDEX_PATH + ext for ext in (".npy", ".json") if os.path.exists(LOGOS_INDEX_PATH + ext)]
+    for db_file in sorted(glob.glob(LOGOS_DB_PATH + "*")) + index_files:
+        with open(db_file, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
 class BaseParser:
     """
     Parser with common methods shared by all inheriting classes
     """
-    def __init__(self, file_path, dec_ms_title=None, dec_version=None, dec_authors=None, **kwargs):
+    def __init__(self, file_path, dec_ms_title=None, dec_version=None, dec_authors=None, artifact_store=None,
+                 doi_resolver=None, **kwargs):
         '''
 
         :param file_path: Path to file this class will evaluate
         :param dec_ms_title: Declared title of manuscript
         :param dec_version: Declared manuscript version of file
         :param dec_authors: Declared authors of manuscript (list)
+        :param artifact_store: ArtifactStore instance used to reuse outputs of previous runs on identical files
+        :param doi_resolver: DOIResolver instance used to test if DOIs resolve; if None, a new one is used per test
         :param kwargs: Dictionary of citation details and any other known metadata fields; values may include:
             acceptance_date=None, doi=None, publication_date=None, title=None
         '''
@@ -75,13 +275,22 @@ class BaseParser:
         self.file_name = os.path.basename(self.file_path)
         self.file_dirname = os.path.dirname(self.file_path)
         self.file_ext = os.path.splitext(self.file_path)[-1].lower()
-        self.file = open(self.file_path)
         self.dec_ms_title = dec_ms_title
         self.dec_version = dec_version
         self.dec_authors = dec_authors
+        self.artifact_store = artifact_store
+        self.doi_resolver = doi_resolver
+        self.file_digest = None
         self.metadata = kwargs
+        self.lock = threading.RLock()  # guards state shared by tests running concurrently (see PdfParser.parse)
+        self.timer = StageTimer()  # timing of each stage of parse, reported under 'timing'
 
         self.extracted_text = None
+        self.normalised_text = None
+        self.pattern_text = None  # text scanned by the pattern stream (see scan_patterns_in_extracted_text)
+        self.pattern_stream = None
+        self.pattern_hits = []
+        self.truncated_searches = []  # queries whose search was cut short by FUZZY_SEARCH_TIMEOUT
         self.number_of_pages = None
         self.file_metadata = None
         self.possible_versions = [SMUR, AM, P, VOR]
@@ -102,16 +311,108 @@ class BaseParser:
             logger.error("Textract failed with UnicodeDecodeError")
             return None
 
-        if isinstance(self.extracted_text, str):
-            result = chardet.detect(self.extracted_text)
-            self.extracted_text = self.extracted_text.decode(result['encoding'])
-        else:
+        if isinstance(self.extracted_text, bytes):
+            # textract encodes its output as UTF-8 by default; only guess the encoding if that fails
+            try:
+                self.extracted_text = self.extracted_text.decode('utf-8')
+            except UnicodeDecodeError:
+                result = chardet.detect(self.extracted_text)
+                self.extracted_text = self.extracted_text.decode(result['encoding'] or 'utf-8', errors='replace')
+        if not isinstance(self.extracted_text, str):
             logger.error("extracted_text is a {} instance; only strings are currently "
                          "supported".format(type(self.extracted_text)))
         return self.extracted_text
 
+    def iter_page_texts(self, first_page=1, last_page=None):
+        """
+        Yields the text of pages one at a time, so that callers can stop reading as soon as they have what they need.
+        This implementation splits self.extracted_text (extracting it first if needed); subclasses may stream pages
+        straight from the file instead.
+        :param first_page: First page to yield (starting at 1)
+        :param last_page: Last page to yield; if None, yield all pages from first_page
+        :return: generator of (page number, page text) tuples
+        """
+        if not self.extracted_text:
+            self.extract_text()
+        if not isinstance(self.extracted_text, str):
+            return
+        for number, text in split_pages([self.extracted_text]):
+            if last_page and (number > last_page):
+                return
+            if number >= first_page:
+                yield number, text
+
+    def iter_pattern_hits(self, kinds=None, first_page=1, last_page=None, pages=None):
+        """
+        Streams pages through TEXT_PATTERN_SET, one page at a time, so that the whole text is never normalised at once
+        and scanning stops as soon as the caller stops consuming hits
+        :param kinds: Kinds of patterns to report (e.g. [CC_PATTERN]); if None, report all
+        :param pages: Generator of (page number, page text) tuples to scan; if None, pages first_page to last_page are
+            read with iter_page_texts
+        :return: generator of (page number, PatternHit) tuples, in order of position
+        """
+        if pages is None:
+            pages = self.iter_page_texts(first_page=first_page, last_page=last_page)
+        try:
+            for number, hit in TEXT_PATTERN_SET.scan_pages(pages, normalise=lambda t: NormalisedText(t).text):
+                if (kinds is None) or (hit.payload[0] in kinds):
+                    yield number, hit
+        finally:
+            pages.close()
+
+    def count_characters(self, limit=None, first_page=1, last_page=None):
+        """
+        Counts the characters of pages, reading them one at a time
+        :param limit: Stop counting once this number of characters is reached
+        :return: number of characters counted
+        """
+        total = 0
+        pages = self.iter_page_texts(first_page=first_page, last_page=last_page)
+        try:
+            for _, text in pages:
+                total += len(text)
+                if limit and (total >= limit):
+                    break
+        finally:
+            pages.close()
+        return total
+
+    def get_file_digest(self):
+        if not self.file_digest:
+            self.file_digest = file_digest(self.file_path)
+        return self.file_digest
+
+    def load_artifact(self, name):
+        """
+        Retrieves an artifact previously stored for an identical file
+        :param name: key of ARTIFACT_VERSIONS
+        :return: stored value, or None if there is no artifact store or the artifact is not in it
+        """
+        if not self.artifact_store:
+            return None
+        return self.artifact_store.get(self.get_file_digest(), name, ARTIFACT_VERSIONS[name])
+
+    def store_artifact(self, name, value):
+        if self.artifact_store and (value is not None):
+            self.artifact_store.put(self.get_file_digest(), name, ARTIFACT_VERSIONS[name], value)
+
+    def get_normalised_text(self):
+        """
+        Builds a normalised view of extracted text (see NormalisedText) once per document; it is rebuilt, and pattern
+        hits discarded, only if self.extracted_text is replaced
+        :return: NormalisedText instance or None if extracted text is not a string
+        """
+        if not self.extracted_text:
+            self.extract_text()
+        if not isinstance(self.extracted_text, str):
+            return None
+        with self.lock:
+            if (self.normalised_text is None) or (self.normalised_text.raw is not self.extracted_text):
+                self.normalised_text = NormalisedText(self.extracted_text)
+            return self.normalised_text
+
     def find_match_in_extracted_text(self, query=None, escape_char=True, expected_span=(0, 2600),
-                                     allowed_error_ratio=.1):
+                                     allowed_error_ratio=.1, windowed=True, timeout=FUZZY_SEARCH_TIMEOUT):
         """
         Fuzzy search extracted text.
         :param query: Search string; manuscript title by default
@@ -122,6 +423,10 @@ class BaseParser:
             2600 characters. This is the arbitrarily set default, but we could obtain a median empirically
         :param allowed_error_ratio: By default, a number of errors equal to 20% the length of the search string is
             allowed
+        :param windowed: If True, search expected_span first and only then widen the search window in steps (see
+            search_windows); otherwise, search the whole text at once
+        :param timeout: Maximum number of seconds to spend on this search (None for no limit); if the search is cut
+            short, query is added to self.truncated_searches
         :return:
         """
         if not query:
@@ -132,37 +437,137 @@ class BaseParser:
             pattern = query
         else:
             pattern = "{}{{e<{}}}".format(query, int(allowed_error_ratio*len(query)))
-        if not self.extracted_text:
-            self.extract_text()
-        # remove all line breaks from extracted text; otherwise match will often fail
-        continuous_text = self.extracted_text.replace('\n', ' ').replace('  ', ' ')
-        try:
-            logger.debug("pattern: {}".format(pattern))
-            m = regex.search(pattern, continuous_text, flags=regex.IGNORECASE)
+        # line breaks, hyphenation and ligatures are removed from normalised text; otherwise match will often fail
+        nt = self.get_normalised_text()
+        if nt is None:
+            logger.error("Attempt to find match in extracted_text failed because it is not a string.")
+            return None
+        logger.debug("pattern: {}".format(pattern))
+        pattern = regex.compile(pattern, flags=regex.IGNORECASE)
+        if windowed:
+            # matches can be longer than query by the number of allowed insertions
+            overlap = len(query) + int(allowed_error_ratio * len(query))
+            windows = self.search_windows(len(nt), expected_span, overlap=overlap)
+        else:
+            windows = [(0, len(nt))]
+        deadline = (time.monotonic() + timeout) if timeout else None
+        for pos, endpos in windows:
+            try:
+                remaining = (deadline - time.monotonic()) if deadline else None
+                if (remaining is not None) and (remaining <= 0):
+                    raise TimeoutError
+                m = nt.search(pattern, pos=pos, endpos=endpos, timeout=remaining)
+                if m and (m.end() == endpos < len(nt)):
+                    # match may have been cut short by the end of the window (e.g. a DOI, whose length is unbounded);
+                    # match again from the same start over the rest of the text
+                    remaining = (deadline - time.monotonic()) if deadline else None
+                    m = nt.search(pattern, pos=m.start(), timeout=remaining) or m
+            except TimeoutError:
+                logger.warning("Search for {} timed out after {} seconds; characters {} to {} of extracted text were "
+                               "not searched".format(query, timeout, pos, endpos))
+                self.truncated_searches.append(query)
+                return None
             if m:
                 logger.debug("Match object: {}".format(m))
                 match_in_expected_position = False
                 if (m.start() >= expected_span[0]) and (m.end() <= expected_span[1]):
                     match_in_expected_position = True
                 return {'match': m.group(), 'match in expected position': match_in_expected_position}
-        except TypeError:
-            logger.error("Attempt to find match in extracted_text failed because it is not a string.")
         return None
 
+    @staticmethod
+    def search_windows(text_length, expected_span, overlap=0, growth_factor=SEARCH_WINDOW_GROWTH_FACTOR):
+        """
+        Splits a text into the slices searched, in order, by a windowed search: first expected_span, then slices added
+        on both sides as the window grows by growth_factor, until the whole text is covered. Fuzzy regex cost grows with
+        the length of the searched text, so matches found where expected (the usual case) cost a fraction of a search
+        over the whole document.
+        :param text_length: Length of text
+        :param expected_span: Tuple indicating start and end characters of sector we expect to find string
+        :param overlap: Number of characters each new slice overlaps its neighbour, so that matches crossing a slice
+            boundary are not missed (should be at least the length of the longest possible match)
+        :return: list of (start, end) tuples
+        """
+        start = max(min(expected_span[0], text_length), 0)
+        end = max(min(expected_span[1], text_length), start)
+        windows = [(start, end)]
+        width = max(end - start, 1)
+        while (start > 0) or (end < text_length):
+            width *= growth_factor
+            new_start = max(start - width, 0)
+            new_end = min(end + width, text_length)
+            if new_start < start:
+                windows.append((new_start, min(start + overlap, text_length)))
+            if new_end > end:
+                windows.append((max(end - overlap, 0), new_end))
+            start, end = new_start, new_end
+        return windows
+
     def find_doi_in_extracted_text(self):
         return self.find_match_in_extracted_text(query=DOI_PATTERN, escape_char=False, allowed_error_ratio=0)
 
-    def find_cc_statement_in_extracted_text(self):
-        for l in ALL_CC_LICENCES:
-            for key, error_ratio in [('url', 0), ('long name', 0.1), ('short name', 0)]:
-                m = self.find_match_in_extracted_text(query=l[key], escape_char=False,
-                                                      allowed_error_ratio=error_ratio)
-                if m:
-                    logger.debug("Found Creative Commons statement in extracted text: {}".format(m['match']))
-                    return m
+    def scan_patterns_in_extracted_text(self):
+        """
+        Searches extracted text for all patterns in TEXT_PATTERN_SET, page by page (see iter_pattern_hits). The scan
+        is shared by all tests, so the text is only scanned once; it starts again if self.extracted_text changes
+        :return: list of PatternHit instances, in order of position
+        """
+        if not self.extracted_text:
+            self.extract_text()
+        if not isinstance(self.extracted_text, str):
+            logger.error("Attempt to scan extracted_text failed because it is not a string.")
+            return []
+        with self.lock:
+            if self.pattern_text is not self.extracted_text:
+                if self.pattern_stream is not None:
+                    self.pattern_stream.close()
+                self.pattern_text = self.extracted_text
+                self.pattern_hits = []
+                self.pattern_stream = self.iter_pattern_hits(pages=split_pages([self.extracted_text]))
+            while self.pattern_stream is not None:
+                try:
+                    self.pattern_hits.append(next(self.pattern_stream)[1])
+                except StopIteration:
+                    self.pattern_stream = None
+                    logger.debug("Patterns found in extracted text: {}".format(self.pattern_hits))
+            return list(self.pattern_hits)
+
+    def find_pattern_hits(self, kind):
+        """
+        :param kind: CC_PATTERN, VERSION_PATTERN or RIGHTS_RESERVED_PATTERN
+        :return: hits of patterns of this kind, in order of precedence of the patterns
+        """
+        hits = [h for h in self.scan_patterns_in_extracted_text() if h.payload[0] == kind]
+        return sorted(hits, key=lambda h: (h.priority, h.start))
+
+    def find_cc_statement_in_extracted_text(self, expected_span=(0, NUMBER_OF_CHARACTERS_IN_ONE_PAGE)):
+        hits = self.find_pattern_hits(CC_PATTERN)
+        if hits:
+            h = hits[0]
+            logger.debug("Found Creative Commons statement in extracted text: {}".format(h.match))
+            match_in_expected_position = (h.start >= expected_span[0]) and (h.end <= expected_span[1])
+            return {'match': h.match, 'match in expected position': match_in_expected_position}
         logger.debug("Could not find a Creative Commons statement in extracted text")
         return None
 
+    def find_version_patterns_in_extracted_text(self):
+        """
+        :return: list of VersionPattern instances found in extracted text
+        """
+        version_patterns = []
+        for h in self.find_pattern_hits(VERSION_PATTERN):
+            if h.payload[1] not in version_patterns:
+                logger.debug("Found version pattern in extracted text: {}".format(h.match))
+                version_patterns.append(h.payload[1])
+        return version_patterns
+
+    def find_rights_reserved_statement_in_extracted_text(self):
+        hits = self.find_pattern_hits(RIGHTS_RESERVED_PATTERN)
+        if hits:
+            logger.debug("Found rights reserved statement in extracted text: {}".format(hits[0].match))
+            return {'match': hits[0].match}
+        return None
+
     def convert_to_pdf(self):
         '''
         Converts file to PDF using pandoc (https://pandoc.org/)
@@ -180,9 +585,10 @@ class BaseParser:
         :param e_list: List of versions to exclude
         :return: filtered self.possible_versions
         """
-        for v in e_list:
-            if v in self.possible_versions:
-                self.possible_versions.remove(v)
+        with self.lock:
+            for v in e_list:
+                if v in self.possible_versions:
+                    self.possible_versions.remove(v)
         return self.possible_versions
 
     def test_title_match_in_file_metadata(self, title_key, min_similarity=0.9):
@@ -243,7 +649,7 @@ class BaseParser:
         """
         Test if DOI resolves; if not DOI given, attempt to use declared DOI in self.metadata
         :param doi: DOI to check
-        :return:
+        :return: True if DOI resolves; False if it does not; None if this could not be determined
         """
         if not doi:
             try:
@@ -251,48 +657,48 @@ class BaseParser:
             except KeyError:
                 logger.debug("DOI not known; KeyError for self.metadata['doi']")
                 return None
-        r = requests.get(DOI_BASE_URL + doi, headers={'User-Agent': 'Mozilla/5.0'})
-        # r = requests.get("https://www.sciencedirect.com/science/article/pii/S1568786419302216?via%3Dihub", headers={'User-Agent': 'Mozilla/5.0'})
-        logger.debug("r.status_code = {}; r.text = {}".format(r.status_code, r.text))
-        if r.ok:
-            return True
-        else:
-            return False
+        if self.doi_resolver:
+            return self.doi_resolver.resolve(doi)
+        with DOIResolver() as resolver:
+            return resolver.resolve(doi)
 
 class DocxParser(BaseParser):
     """
     Parser for .docx files
     """
+    def read_package(self, max_chars=DOCX_MAX_CHARACTERS):
+        '''
+        Reads core properties and body text in a single pass over the DOCX package (see utils.docx_reader), stopping
+        once max_chars characters of text have been read; if the text is in the artifact store, only core properties
+        are read
+        :return:
+        '''
+        cached = self.load_artifact('docx_text')
+        if cached and (cached['max_chars'] == max_chars):
+            self.file_metadata = read_docx(self.file_path, text=False)['core_properties']
+            self.extracted_text = cached['text']
+            return
+        docx = read_docx(self.file_path, max_chars=max_chars)
+        self.file_metadata = docx['core_properties']
+        self.extracted_text = docx['text']
+        if docx['truncated']:
+            logger.debug("Read first {} characters of text of {}".format(len(self.extracted_text), self.file_name))
+        self.store_artifact('docx_text', {'max_chars': max_chars, 'text': self.extracted_text})
+
     def extract_file_metadata(self):
         '''
-        Extracts the metadata of a .docx file
+        Extracts the metadata of a .docx file (core properties, with the same keys as python-docx's CoreProperties)
         :return:
         '''
-        docx = Document(docx=self.file_path)
-        self.file_metadata = {
-            'author': docx.core_properties.author,
-            'created': docx.core_properties.created,
-            'last_modified_by': docx.core_properties.last_modified_by,
-            'last_printed': docx.core_properties.last_printed,
-            'modified': docx.core_properties.modified,
-            'revision': docx.core_properties.revision,
-            'title': docx.core_properties.title,
-            'category': docx.core_properties.category,
-            'comments': docx.core_properties.comments,
-            'identifier': docx.core_properties.identifier,
-            'keywords': docx.core_properties.keywords,
-            'language': docx.core_properties.language,
-            'subject': docx.core_properties.subject,
-            'version': docx.core_properties.version,
-            'keywords': docx.core_properties.keywords,
-            'content_status': docx.core_properties.content_status,
-        }
+        if self.file_metadata is None:
+            self.read_package()
 
     def extract_text(self, method=None):
         """
-        Overwrites extract_text function of BaseParser to use docx2txt instead
+        Overwrites extract_text function of BaseParser to read the text of the main document part (see read_package)
         """
-        self.extracted_text = docx2txt.process(self.file_path)
+        if self.extracted_text is None:
+            self.read_package()
         return self.extracted_text
 
     def parse(self):
@@ -306,16 +712,23 @@ class DocxParser(BaseParser):
         approve_deposit = False
         reason = ""
 
-        self.extract_file_metadata()
-        title_match_file_metadata = self.test_title_match_in_file_metadata('title')
+        with self.timer.measure('file_metadata'):
+            self.extract_file_metadata()
+        with self.timer.measure('title_match_file_metadata'):
+            title_match_file_metadata = self.test_title_match_in_file_metadata('title')
         self.test_results["title_match_file_metadata"] = title_match_file_metadata
 
-        self.extract_text()
-        more_than_three_pages = self.test_length_of_extracted_text()
+        with self.timer.measure('text'):
+            self.extract_text()
+        with self.timer.measure('more_than_three_pages'):
+            more_than_three_pages = self.test_length_of_extracted_text()
         self.test_results["more_than_three_pages"] = more_than_three_pages
 
-        title_match_extracted_text = self.test_title_match_in_extracted_text()
+        with self.timer.measure('title_match_extracted_text'):
+            title_match_extracted_text = self.test_title_match_in_extracted_text()
         self.test_results["title_match_extracted_text"] = title_match_extracted_text
+        if self.truncated_searches:
+            self.test_results["truncated_searches"] = self.truncated_searches
 
         if more_than_three_pages and (title_match_file_metadata or title_match_extracted_text):
             if self.dec_version.lower() in plausible_versions:
@@ -328,7 +741,7 @@ class DocxParser(BaseParser):
             reason = "File {} failed automated checks".format(self.file_name)
 
         return {'input file': self.file_name, 'approved': approve_deposit, 'reason': reason,
-                **self.test_results}
+                **self.test_results, 'timing': self.timer.summary()}
 
 
 class PdfParser(BaseParser):
@@ -337,29 +750,72 @@ class PdfParser(BaseParser):
     """
     Parser for .pdf files
     """
-    def __init__(self, file_path, dec_ms_title=None, dec_version=None, dec_authors=None, **kwargs):
+    def __init__(self, file_path, dec_ms_title=None, dec_version=None, dec_authors=None, artifact_store=None,
+                 doi_resolver=None, cermine_service=None, cermine_batch=None, exhaustive=False, **kwargs):
+        '''
+
+        :param cermine_service: CermineService instance used to run CERMINE; if None, a new JVM is launched instead
+        :param cermine_batch: LazyCermineBatch instance through which CERMINE is run together with other files, if
+            the file reaches the point where CERMINE is needed
+        :param exhaustive: If True, run all tests; otherwise, stop as soon as the verdict and possible versions are
+            settled (see parse)
+        '''
+        self.cermine_service = cermine_service
+        self.cermine_batch = cermine_batch
+        self.exhaustive = exhaustive
+        self.evidence = {}  # results of tests decide_pdf_verdict is based on
+        self.cermine_lock = threading.Lock()
+        self.images_lock = threading.Lock()  # serialises extract_page_images between concurrent tests
+        self.text_is_partial = False  # True if self.extracted_text only contains some pages (see extract_front_back_text)
+        self.extracted_pages = None  # (number of front pages, number of back pages) in partial text
         self.cerm_ran_and_parsed = False
         self.cerm_doi = None
         self.cerm_title = None
         self.cerm_journal_title = None
-        super(PdfParser, self).__init__(file_path, dec_ms_title=dec_ms_title,
-                                        dec_version=dec_version, dec_authors=dec_authors, **kwargs)
+        super(PdfParser, self).__init__(file_path, dec_ms_title=dec_ms_title, dec_version=dec_version,
+                                        dec_authors=dec_authors, artifact_store=artifact_store,
+                                        doi_resolver=doi_resolver, **kwargs)
 
     def extract_file_metadata(self):
         '''
-        Extracts the metadata of a PDF file. For more information on PDF metadata tags, see
+        Extracts the metadata of a PDF file: the document information dictionary and XMP fields, keyed as in
+        utils.pdf_metadata.parse_xmp (e.g. 'crossmark:DOI'). For more information on PDF metadata tags, see
         https://www.sno.phy.queensu.ca/~phil/exiftool/TagNames/PDF.html
+        The file is read with utils.pdf_metadata, which only parses the few objects holding metadata; PyPDF2 is used
+        if that fails (e.g. for encrypted files).
         :return:
         '''
-        with open(self.file_path, 'rb') as f:
-            pdf = PdfFileReader(f, strict=False)
-            info = pdf.getDocumentInfo()
-            # pprint(pdf.getPage(0).extractText())
-            logger.debug("output of pdf.getDocumentInfo(): {}".format(info))
-            self.number_of_pages = pdf.getNumPages()
-            self.file_metadata = info
+        cached = self.load_artifact('file_metadata')
+        if cached:
+            self.number_of_pages = cached['number_of_pages']
+            self.file_metadata = cached['info']
+            return
+        try:
+            metadata = read_pdf_metadata(self.file_path)
+            logger.debug("PDF metadata: {}".format(metadata))
+            self.number_of_pages = metadata['number_of_pages']
+            self.file_metadata = dict(metadata['info'], **metadata['xmp'])
+        except PdfMetadataError as e:
+            logger.debug("Could not scan metadata of {} ({}); using PyPDF2 instead".format(self.file_name, e))
+            self.number_of_pages = None
+        if self.number_of_pages is None:
+            with open(self.file_path, 'rb') as f:
+                pdf = PdfFileReader(f, strict=False)
+                info = pdf.getDocumentInfo()
+                logger.debug("output of pdf.getDocumentInfo(): {}".format(info))
+                self.number_of_pages = pdf.getNumPages()
+                self.file_metadata = info
+        if self.artifact_store:
+            self.store_artifact('file_metadata', {
+                'number_of_pages': self.number_of_pages,
+                'info': {str(k): str(v) for k, v in (self.file_metadata or {}).items()},
+            })
 
     def extract_text(self):
+        self.text_is_partial = False
+        self.extracted_text = self.load_artifact('text')
+        if self.extracted_text is not None:
+            return
         try:
             super(PdfParser, self).extract_text()
         except TypeError:
@@ -380,23 +836,132 @@ class PdfParser(BaseParser):
                 txt_path = self.file_path.replace(self.file_ext, ".txt")
                 with open(txt_path) as f:
                     self.extracted_text = f.read()
+        if isinstance(self.extracted_text, str):
+            self.store_artifact('text', self.extracted_text)
+
+    def extract_front_back_text(self, front_pages=FRONT_PAGES, back_pages=BACK_PAGES):
+        '''
+        Extracts text from the first and last pages only, using pdftotext, which is enough for title, DOI and licence
+        searches; the full text is extracted (see extract_text) if the file is not longer than those pages, if it has
+        already been extracted for an identical file or if pdftotext fails. When self.extracted_text only holds some
+        pages, self.text_is_partial is True.
+        :return:
+        '''
+        if self.extracted_text is not None:
+            return
+        full_text = self.load_artifact('text')
+        if full_text is not None:
+            self.extracted_text = full_text
+            return
+        if self.number_of_pages is None:
+            self.extract_file_metadata()
+        if not self.number_of_pages or (self.number_of_pages <= front_pages + back_pages):
+            return self.extract_text()
+        cached = self.load_artifact('front_back_text')
+        if cached and (cached['front_pages'], cached['back_pages']) == (front_pages, back_pages):
+            texts = cached['texts']
+        else:
+            texts = []
+            for first, last in [(1, front_pages), (self.number_of_pages - back_pages + 1, self.number_of_pages)]:
+                try:
+                    r = subprocess.run(["pdftotext", "-f", str(first), "-l", str(last), "-enc", "UTF-8",
+                                        self.file_path, "-"], check=True, stdout=subprocess.PIPE,
+                                       stderr=subprocess.DEVNULL)
+                except (OSError, subprocess.CalledProcessError) as e:
+                    logger.warning("pdftotext failed to extract pages {} to {} ({}); extracting full "
+                                   "text instead".format(first, last, e))
+                    return self.extract_text()
+                texts.append(r.stdout.decode('utf-8', errors='replace'))
+            self.store_artifact('front_back_text', {'front_pages': front_pages, 'back_pages': back_pages,
+                                                    'texts': texts})
+        logger.debug("Extracted text of first {} and last {} of {} pages".format(front_pages, back_pages,
+                                                                                 self.number_of_pages))
+        # pdftotext ends every page with a form feed, so page breaks are preserved
+        self.extracted_text = ''.join(texts)
+        self.text_is_partial = True
+        self.extracted_pages = (front_pages, back_pages)
 
-    def cermine_file(self):
+    def test_length_of_extracted_text(self, min_length=3*NUMBER_OF_CHARACTERS_IN_ONE_PAGE):
+        """
+        Test if the text of the file has at least min_length characters. If only some pages have been extracted, the
+        length of the full text is estimated from their average length and the number of pages; the full text is only
+        extracted if the estimate is inconclusive.
+        """
+        if self.text_is_partial:
+            if len(self.extracted_text) >= min_length:
+                logger.debug("Text of first and last pages is longer than {} characters".format(min_length))
+                return True
+            estimate = len(self.extracted_text) / sum(self.extracted_pages) * self.number_of_pages
+            logger.debug("Estimated length of text is {} characters".format(int(estimate)))
+            if estimate >= 2 * min_length:
+                return True
+            logger.debug("Estimate is inconclusive; counting characters of remaining pages")
+            front_pages, back_pages = self.extracted_pages
+            length = len(self.extracted_text) + self.count_characters(
+                limit=min_length - len(self.extracted_text), first_page=front_pages + 1,
+                last_page=self.number_of_pages - back_pages)
+            logger.debug("Text has at least {} characters".format(length))
+            return length >= min_length
+        return super(PdfParser, self).test_length_of_extracted_text(min_length=min_length)
+
+    def iter_page_texts(self, first_page=1, last_page=None):
+        """
+        Streams the text of pages from pdftotext, holding one page at a time; once the full text has been extracted,
+        it is split instead (see BaseParser.iter_page_texts). Closing the generator early stops pdftotext.
+        """
+        if (self.extracted_text is not None) and not self.text_is_partial:
+            yield from super(PdfParser, self).iter_page_texts(first_page=first_page, last_page=last_page)
+            return
+        command = ["pdftotext", "-enc", "UTF-8", "-f", str(first_page)]
+        if last_page:
+            if last_page < first_page:
+                return
+            command += ["-l", str(last_page)]
+        try:
+            process = subprocess.Popen(command + [self.file_path, "-"], stdout=subprocess.PIPE,
+                                       stderr=subprocess.DEVNULL)
+        except OSError as e:
+            logger.warning("Could not run pdftotext ({}); extracting full text instead".format(e))
+            self.extract_text()
+            yield from super(PdfParser, self).iter_page_texts(first_page=first_page, last_page=last_page)
+            return
+        try:
+            stream = TextIOWrapper(process.stdout, encoding='utf-8', errors='replace')
+            yield from split_pages(iter(lambda: stream.read(PAGE_STREAM_CHUNK_SIZE), ''), first_page=first_page)
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+
+    def cermine_file(self, force=False):
         '''
         Runs CERMINE (https://github.com/CeON/CERMINE) on pdf file. Useful presentation:
         https://www.slideshare.net/dtkaczyk/tkaczyk-grotoap2slides
+        :param force: If True, run CERMINE even if its outputs for this file already exist
         :return:
         '''
-        try:
-            subprocess.run(["java", "-cp", "cermine-impl-1.13-jar-with-dependencies.jar",
-                        "pl.edu.icm.cermine.ContentExtractor", "-path", self.file_dirname, "-outputs",
-                        # '"jats,text"'
-                        # '"trueviz"'
-                        '"jats,text,zones,trueviz,images"'
-                        ],
-                       check=True)
-        except subprocess.CalledProcessError as e:
-            logger.error("return code: {}; output: {}".format(e.returncode, e.output))
+        # stages of parse may run concurrently; CERMINE must not run twice on the same folder at once
+        with self.cermine_lock:
+            cermxml_path = self.file_path.replace(self.file_ext, ".cermxml")
+            if os.path.exists(cermxml_path) and not force:
+                logger.debug("CERMINE outputs already exist for {}; skipping CERMINE".format(self.file_name))
+                return
+            if self.artifact_store and not force:
+                if self.artifact_store.get_files(self.get_file_digest(), 'cermine', ARTIFACT_VERSIONS['cermine'],
+                                                 os.path.splitext(self.file_path)[0]):
+                    logger.debug("Reusing stored CERMINE outputs for {}".format(self.file_name))
+                    return
+            batch_outputs = self.cermine_batch.request(self.file_path) if self.cermine_batch else None
+            if batch_outputs is not None:
+                copy_cermine_outputs(batch_outputs, self.file_path)
+            elif self.cermine_service:
+                self.cermine_service.process_folder(self.file_dirname)
+            else:
+                cermine_folder(self.file_dirname)
+            outputs = find_cermine_outputs(self.file_path)
+            if self.artifact_store and (".cermxml" in outputs):
+                self.artifact_store.put_files(self.get_file_digest(), 'cermine', ARTIFACT_VERSIONS['cermine'], outputs)
 
     def parse_cermxml(self):
         cermxml_path = self.file_path.replace(self.file_ext, ".cermxml")
@@ -430,37 +995,125 @@ class PdfParser(BaseParser):
             return self.cerm_doi, self.cerm_title, self.cerm_journal_title
         return None
 
-    def detect_publisher_logos(self, max_hash_difference=5, stop_at_first_match=False):
+    def detect_layout_features(self):
+        """
+        Computes line spacing, column layout and line numbering of all pages from the TrueViz (.cermstr) output of
+        CERMINE (see utils.TrueViz.layout_features)
+        :return: dictionary of features, or None if CERMINE has not produced a .cermstr file
+        """
+        cermstr_path = self.file_path.replace(self.file_ext, ".cermstr")
+        if not os.path.exists(cermstr_path):
+            logger.debug("No TrueViz file for {}, so cannot detect layout features".format(self.file_name))
+            return None
+        features = TrueVizDocument(cermstr_path).layout_features()
+        logger.debug("Layout features: {}".format(features))
+        return features
+
+    def layout_can_exclude(self):
+        """
+        Layout features are only worth computing once CERMINE has run for other reasons (or in exhaustive mode), as
+        running CERMINE just for them would cost far more than the tests they could spare
+        """
+        return bool({P, VOR}.intersection(self.possible_versions)) and (
+            self.exhaustive or os.path.exists(self.file_path.replace(self.file_ext, ".cermstr")))
+
+    def cermine_images_folder(self):
+        """
+        :return: path to folder of images extracted by CERMINE, or None if CERMINE has not run or is still running
+        """
+        if not self.cermine_lock.acquire(blocking=False):
+            return None
+        try:
+            images_folder = self.file_path.replace(self.file_ext, ".images")
+            return images_folder if os.path.exists(images_folder) else None
+        finally:
+            self.cermine_lock.release()
+
+    def extract_page_images(self, first_page=1, last_page=1):
+        """
+        Extracts images from a range of pages directly (see utils.pdf_images), which is much cheaper than running CERMINE
+        :return: path to folder containing extracted images, named as in CERMINE .images folders
+        """
+        images_folder = "{}.p{}-{}.images".format(os.path.splitext(self.file_path)[0], first_page, last_page)
+        with self.images_lock:
+            if not os.path.exists(images_folder):
+                # images are extracted into a temporary folder first, so that the folder is never seen half filled
+                partial_folder = mkdtemp(prefix=os.path.basename(images_folder) + ".", dir=self.file_dirname)
+                try:
+                    extract_images(self.file_path, partial_folder, first_page=first_page, last_page=last_page)
+                    os.replace(partial_folder, images_folder)
+                finally:
+                    if os.path.exists(partial_folder):
+                        shutil.rmtree(partial_folder, ignore_errors=True)
+        return images_folder
+
+    def detect_publisher_logos(self, max_hash_difference=5, stop_at_first_match=False, pages=LOGO_PAGES,
+                               strip_pages=HEADER_STRIP_PAGES):
         """
         Detects publisher logos in file
         :param max_hash_difference: max_hash_difference to be passed to PublisherLogo.test_hash_match
         :param stop_at_first_match: if True, stop trying additional matches if one is found
+        :param pages: Number of leading pages searched for logos if CERMINE outputs are not available; in that case,
+            images are extracted directly from those pages instead of running CERMINE
+        :param strip_pages: Pages whose header strip is rendered and searched for logos (see HEADER_STRIP_PAGES)
         :return: list of detected logos (as PublisherLogo instances)
         """
         detected_logos = []
-        images_folder = self.file_path.replace(self.file_ext, ".images")
-        if not os.path.exists(images_folder):
-            self.cermine_file()
-        for i in os.listdir(images_folder):
-            i_path = os.path.join(images_folder, i)
-            pl = PublisherLogo(i, path=i_path)
-            with shelve.open(LOGOS_DB_PATH) as db:
-                for key in db:
-                    logo = db[key]
-                    logo.test_hash_match(pl, max_hash_difference=max_hash_difference, method="perception")
-                    if logo.test_hash_match(pl, max_hash_difference=max_hash_difference):
-                        logger.debug("Extracted image {} matched logo {}".format(i_path, logo.name))
-                        detected_logos.append(logo)
-                        if stop_at_first_match:
-                            break
-            if detected_logos and stop_at_first_match:
-                break
+        images_folder = self.cermine_images_folder()
+        if images_folder:
+            hashes_artifact = 'image_hashes'
+        else:
+            images_folder = self.extract_page_images(1, pages)
+            hashes_artifact = 'page_image_hashes'
+        image_hashes = self.load_artifact(hashes_artifact) or {}
+        logo_index = load_logo_index(db_path=LOGOS_DB_PATH)
+        names = sorted(os.listdir(images_folder))
+        new_image_hashes = {}
+        computed = hash_images([os.path.join(images_folder, i) for i in names if i not in image_hashes],
+                               size_filter=logo_index.plausible_size)
+        images = []
+        for i in names:
+            pl = PublisherLogo(i, path=os.path.join(images_folder, i))
+            if i in image_hashes:
+                pl.average_hash = imagehash.hex_to_hash(image_hashes[i]['average_hash'])
+                pl.perception_hash = imagehash.hex_to_hash(image_hashes[i]['perception_hash'])
+            else:
+                h = computed[pl.path]
+                if not h:
+                    continue
+                pl.average_hash = h['average_hash']
+                pl.perception_hash = h['perception_hash']
+                new_image_hashes[i] = {'average_hash': str(pl.average_hash),
+                                       'perception_hash': str(pl.perception_hash)}
+            images.append(pl)
+        if new_image_hashes:
+            self.store_artifact(hashes_artifact, {**image_hashes, **new_image_hashes})
+        matches = logo_index.match([pl.average_hash for pl in images], [pl.perception_hash for pl in images],
+                                   max_hash_difference=max_hash_difference)
+        for pl, logos in zip(images, matches):
+            for logo in logos:
+                logger.debug("Extracted image {} matched logo {}".format(pl.path, logo.name))
+                detected_logos.append(logo)
+                if stop_at_first_match:
+                    return detected_logos
+        for page in strip_pages:
+            strip_path = render_header_strip(self.file_path, "{}.strip-p{}".format(os.path.splitext(self.file_path)[0],
+                                                                                 page), page=page)
+            if not strip_path:
+                continue
+            for logo in logo_index.match_strip(strip_path, max_hash_difference=max_hash_difference):
+                if logo.name not in [dl.name for dl in detected_logos]:
+                    logger.debug("Header strip of page {} matched logo {}".format(page, logo.name))
+                    detected_logos.append(logo)
+                    if stop_at_first_match:
+                        return detected_logos
         return detected_logos
 
     def test_file_has_image_on_first_page(self):
-        images_folder = self.file_path.replace(self.file_ext, ".images")
-        if not os.path.exists(images_folder):
-            self.cermine_file()
+        images_folder = self.cermine_images_folder()
+        if not images_folder:
+            # CERMINE has not run; extracting images from the first page is much cheaper than running it
+            images_folder = self.extract_page_images(1, 1)
         for i in os.listdir(images_folder):
             if "img_1_" in i:
                 return True
@@ -505,115 +1158,182 @@ class PdfParser(BaseParser):
         logger.debug("Could not find DOI in extracted text")
         return False
 
-    def parse(self):
-        '''
-        Workflow for PDF files
-        :return: Tuple where: first element is string "success" or "fail" to indicate outcome; second element is
-            string containing details
-        '''
-
-        approve_deposit = False
-
-        # self.test_doi_resolves()
-
-        # region file metadata tests
-        self.extract_file_metadata()
-        title_match_file_metadata = self.test_title_match_in_file_metadata('/Title')
-        self.test_results['title_match_file_metadata'] = title_match_file_metadata
-        file_metadata_contains_publisher_tags = self.test_file_metadata_contains_publisher_tags()
-        self.test_results['number_of_publisher_tags_in_file_metadata'] = file_metadata_contains_publisher_tags
-        if file_metadata_contains_publisher_tags:
-            self.possible_versions.remove(SMUR)
-            self.possible_versions.remove(AM)
-        # endregion
-
-        # region extracted text tests
-        self.extract_text()
-        more_than_three_pages = self.test_length_of_extracted_text()
-        self.test_results['more_than_three_pages'] = more_than_three_pages
-        title_match_extracted_text = self.test_title_match_in_extracted_text()
-        self.test_results['title_match_extracted_text'] = title_match_extracted_text
-
-        doi_in_extracted_text = self.find_doi_in_extracted_text()
-        if doi_in_extracted_text:
-            doi_match = doi_in_extracted_text['match']
-            self.test_doi_resolves(doi=doi_match)
-
-        doi_match_extracted_text = self.test_doi_match()
-        self.test_results['doi_match_extracted_text'] = doi_match_extracted_text
-        cc_match_extracted_text = self.find_cc_statement_in_extracted_text()
-        self.test_results['cc_match_extracted_text'] = cc_match_extracted_text
-        # endregion
-
-        # region cermine tests
-        self.cermine_file()
-        self.parse_cermxml()
-        if self.cerm_doi:
-            logger.debug("Cermine identified DOI {} in this file".format(self.cerm_doi))
-            doi_found_in_cermxml = True
-            self.test_results['doi_found_in_cermxml'] = doi_found_in_cermxml
-        title_match_cermxml = self.test_title_match_cermxml()
-        self.test_results['title_match_cermxml'] = title_match_cermxml
-        # endregion
-
-        # region logo tests
-        image_on_first_page = self.test_file_has_image_on_first_page()
-        self.test_results['image_on_first_page'] = image_on_first_page
-        detected_logos = self.detect_publisher_logos()
-        self.test_results['detected_logos'] = detected_logos
-
-        # exclude self.possible_versions that are not corroborated by detected logos
-        if detected_logos:
-            logger.debug("self.possible_versions before considering logos: {}".format(self.possible_versions))
-            suggested_versions = []
-            for dl in detected_logos:
-                for version in dl.metadata["indicate_ms_versions"]:
-                    if version not in suggested_versions:
-                        suggested_versions.append(version)
-            logger.debug("Versions suggested by logos: {}".format(suggested_versions))
-            for v in reversed(self.possible_versions): # https://stackoverflow.com/a/14283447
-                if v not in suggested_versions:
-                    self.possible_versions.remove(v)
-            logger.debug("self.possible_versions after considering logos: {}".format(self.possible_versions))
-
+    def evidence_matters(self, key):
+        """
+        Tests if the verdict could still depend on the value of evidence key, given the evidence gathered so far
+        """
+        unknown = [k for k in PDF_EVIDENCE_VALUES if k not in self.evidence]
+        if key not in unknown:
+            return False
+        others = [k for k in unknown if k != key]
+        for values in itertools.product(*[PDF_EVIDENCE_VALUES[k] for k in others]):
+            evidence = {**self.evidence, **dict(zip(others, values))}
+            verdicts = set()
+            for v in PDF_EVIDENCE_VALUES[key]:
+                approve_deposit, reason, exclude = decide_pdf_verdict({**evidence, key: v}, self.dec_version,
+                                                                      self.file_name)
+                verdicts.add((approve_deposit, reason, tuple(exclude)))
+            if len(verdicts) > 1:
+                return True
+        return False
 
+    def version_patterns_can_exclude(self):
+        excludable = set()
+        for vp in VERSION_PATTERNS:
+            excludable.update(vp.not_found_on)
+        return bool(excludable.intersection(self.possible_versions))
 
+    def logos_can_exclude(self):
+        for record in load_logo_index(db_path=LOGOS_DB_PATH).records:
+            if not set(self.possible_versions).issubset(record.get('indicate_ms_versions', [])):
+                return True
+        return False
 
+    def build_stages(self):
+        """
+        Declares the tests run by parse, in the order they were run before scheduling was introduced (which is the
+        order used in exhaustive mode)
+        :return: list of Stage instances
+        """
+        def run_title_match_file_metadata():
+            self.evidence['title_match_file_metadata'] = self.test_title_match_in_file_metadata('/Title')
+            self.test_results['title_match_file_metadata'] = self.evidence['title_match_file_metadata']
+
+        def run_publisher_tags():
+            file_metadata_contains_publisher_tags = self.test_file_metadata_contains_publisher_tags()
+            self.test_results['number_of_publisher_tags_in_file_metadata'] = file_metadata_contains_publisher_tags
+            self.evidence['publisher_tags'] = bool(file_metadata_contains_publisher_tags)
+            if file_metadata_contains_publisher_tags:
+                self.exclude_versions([SMUR, AM])
 
-        # endregion
+        def run_more_than_three_pages():
+            self.evidence['more_than_three_pages'] = self.test_length_of_extracted_text()
+            self.test_results['more_than_three_pages'] = self.evidence['more_than_three_pages']
+
+        def run_title_match_extracted_text():
+            self.evidence['title_match_extracted_text'] = self.test_title_match_in_extracted_text()
+            self.test_results['title_match_extracted_text'] = self.evidence['title_match_extracted_text']
+            if self.truncated_searches:
+                self.test_results['truncated_searches'] = self.truncated_searches
+
+        def run_doi():
+            doi_in_extracted_text = self.find_doi_in_extracted_text()
+            if doi_in_extracted_text:
+                self.test_doi_resolves(doi=doi_in_extracted_text['match'])
+            self.test_results['doi_match_extracted_text'] = self.test_doi_match()
+
+        def run_cc_match_extracted_text():
+            cc_match_extracted_text = self.find_cc_statement_in_extracted_text()
+            self.test_results['cc_match_extracted_text'] = cc_match_extracted_text
+            self.evidence['cc_match_extracted_text'] = bool(cc_match_extracted_text)
+
+        def run_rights_reserved():
+            self.test_results['rights_reserved_match_extracted_text'] = \
+                self.find_rights_reserved_statement_in_extracted_text()
+
+        def run_version_patterns():
+            # exclude self.possible_versions on which detected version patterns are never found
+            version_patterns = self.find_version_patterns_in_extracted_text()
+            self.test_results['version_patterns_in_extracted_text'] = [vp.pattern for vp in version_patterns]
+            for vp in version_patterns:
+                self.exclude_versions(vp.not_found_on)
+
+        def run_cermine():
+            self.cermine_file()
+            self.parse_cermxml()
+            if self.cerm_doi:
+                logger.debug("Cermine identified DOI {} in this file".format(self.cerm_doi))
+                self.test_results['doi_found_in_cermxml'] = True
+
+        def run_title_match_cermxml():
+            self.evidence['title_match_cermxml'] = self.test_title_match_cermxml()
+            self.test_results['title_match_cermxml'] = self.evidence['title_match_cermxml']
+
+        def run_image_on_first_page():
+            self.test_results['image_on_first_page'] = self.test_file_has_image_on_first_page()
+
+        def run_logos():
+            detected_logos = self.detect_publisher_logos()
+            self.test_results['detected_logos'] = detected_logos
+            # exclude self.possible_versions that are not corroborated by detected logos
+            if detected_logos:
+                logger.debug("self.possible_versions before considering logos: {}".format(self.possible_versions))
+                suggested_versions = []
+                for dl in detected_logos:
+                    for version in dl.metadata["indicate_ms_versions"]:
+                        if version not in suggested_versions:
+                            suggested_versions.append(version)
+                logger.debug("Versions suggested by logos: {}".format(suggested_versions))
+                self.exclude_versions([v for v in self.possible_versions if v not in suggested_versions])
+                logger.debug("self.possible_versions after considering logos: {}".format(self.possible_versions))
+
+        def run_layout():
+            features = self.detect_layout_features()
+            self.test_results['layout_features'] = features
+            if features:
+                # line numbers and wide line spacing are added for reviewers; typeset articles do not have them
+                if features['numbered_lines']:
+                    self.exclude_versions([VOR])
+                if features['line_spacing'] and (features['line_spacing'] >= MANUSCRIPT_LINE_SPACING):
+                    self.exclude_versions([P, VOR])
+
+        # stages with can_change INFORMATIONAL only add details to self.test_results; they run whenever the stages they
+        # require have run (see Stage.informational)
+        stages = [
+            ('file_metadata', self.extract_file_metadata, None, []),
+            ('title_match_file_metadata', run_title_match_file_metadata,
+             lambda: self.evidence_matters('title_match_file_metadata'), ['file_metadata']),
+            ('publisher_tags', run_publisher_tags,
+             lambda: self.evidence_matters('publisher_tags') or bool({SMUR, AM}.intersection(self.possible_versions)),
+             ['file_metadata']),
+            # exhaustive runs search the full text, as before page-limited extraction was introduced
+            ('text', self.extract_text if self.exhaustive else self.extract_front_back_text, None, ['file_metadata']),
+            ('more_than_three_pages', run_more_than_three_pages,
+             lambda: self.evidence_matters('more_than_three_pages'), ['text']),
+            ('title_match_extracted_text', run_title_match_extracted_text,
+             lambda: self.evidence_matters('title_match_extracted_text'), ['text']),
+            ('doi', run_doi, INFORMATIONAL, ['text']),
+            ('cc_match_extracted_text', run_cc_match_extracted_text,
+             lambda: self.evidence_matters('cc_match_extracted_text'), ['text']),
+            ('rights_reserved', run_rights_reserved, INFORMATIONAL, ['text']),
+            ('version_patterns', run_version_patterns, self.version_patterns_can_exclude, ['text']),
+            ('cermine', run_cermine, None, []),
+            ('title_match_cermxml', run_title_match_cermxml, lambda: self.evidence_matters('title_match_cermxml'),
+             ['cermine']),
+            # in exhaustive mode, images are always taken from CERMINE's outputs, as before early exit was introduced
+            ('image_on_first_page', run_image_on_first_page, INFORMATIONAL, ['cermine'] if self.exhaustive else []),
+            ('logos', run_logos, self.logos_can_exclude, ['cermine'] if self.exhaustive else []),
+            ('layout', run_layout, self.layout_can_exclude, ['cermine']),
+        ]
+        return [Stage(name, PDF_STAGE_COSTS[name], self.timer.wrap(name, run),
+                      can_change=None if can_change is INFORMATIONAL else can_change, requires=requires,
+                      informational=can_change is INFORMATIONAL) for name, run, can_change, requires in stages]
 
-        if more_than_three_pages and (title_match_file_metadata or title_match_extracted_text or title_match_cermxml):
-            # sanity check (this is the correct file; no mistake on upload)
-            if file_metadata_contains_publisher_tags or cc_match_extracted_text:
-                # file is publisher-generated
-                # TODO: Add more tests here
-                self.exclude_versions([SMUR, AM])
-                if self.dec_version.lower() in ['submitted version', 'accepted version', SMUR, AM]:
-                    reason = 'PDF metadata contains publisher tags, but declared version is author-generated'
-                if cc_match_extracted_text:
-                    reason = 'Create Commons licence detected in extracted text'
-                    approve_deposit = True # could be proof, so additional checking is desirable
-                else:
-                    reason = 'Publisher-generated version; no evidence of CC licence'
-            else:
-                if self.dec_version.lower() in ['submitted version', 'accepted version', SMUR, AM]:
-                    approve_deposit = True
-                    reason = 'Could not find any evidence that this PDF is publisher-generated'
-                else:
-                    reason = "This is either a submitted or accepted version, " \
-                                   "but declared version is {}".format(self.dec_version)
-        else:
-            reason = "File {} failed automated checks. more_than_three_pages: {}, title_match_file_metadata:" \
-                           " {}, title_match_extracted_text: {}".format(self.file_name,
-                                                                        more_than_three_pages,
-                                                                        title_match_file_metadata,
-                                                                        title_match_extracted_text)
-        return {'input file': self.file_name, 'approved': approve_deposit, 'reason': reason, **self.test_results}
+    def parse(self):
+        '''
+        Workflow for PDF files. Tests are run cheapest first and, unless self.exhaustive is True, no more tests are run
+        once the verdict and self.possible_versions can no longer change (e.g. publisher tags in file metadata plus a
+        CC licence in extracted text settle most versions of record without running CERMINE). Skipped tests are listed
+        under 'skipped_tests'; the wall time, CPU time and peak RSS of each test that ran are reported under 'timing'
+        (see utils.timing.StageTimer).
+        :return: dictionary containing verdict and test results
+        '''
+        self.evidence = {}
+        skipped = Scheduler(self.build_stages(), exhaustive=self.exhaustive, max_workers=PDF_STAGE_WORKERS).run()
+        if skipped:
+            self.test_results['skipped_tests'] = skipped
+        # skipped tests cannot change the verdict, so any value will do for their evidence
+        evidence = {k: self.evidence.get(k) for k in PDF_EVIDENCE_VALUES}
+        approve_deposit, reason, exclude = decide_pdf_verdict(evidence, self.dec_version, self.file_name)
+        self.exclude_versions(exclude)
+        return {'input file': self.file_name, 'approved': approve_deposit, 'reason': reason, **self.test_results,
+                'timing': self.timer.summary()}
 
 
 class VersionDetector:
     def __init__(self, file_path, keep_temp_files=False,
-                 dec_ms_title=None, dec_version=None, dec_authors=None, **kwargs):
+                 dec_ms_title=None, dec_version=None, dec_authors=None, cermine_service=None, cermine_batch=None,
+                 artifact_store=None, result_cache=None, doi_resolver=None, exhaustive=False, **kwargs):
         '''
 
         :param file_path: Path to file this class will evaluate
@@ -621,6 +1341,13 @@ class VersionDetector:
         :param dec_ms_title: Declared title of manuscript
         :param dec_version: Declared manuscript version of file
         :param dec_authors: Declared authors of manuscript (list)
+        :param cermine_service: CermineService instance used to run CERMINE on PDF files
+        :param cermine_batch: LazyCermineBatch instance used to run CERMINE on PDF files together with other files
+        :param artifact_store: ArtifactStore instance used to reuse outputs of previous runs on identical files
+        :param result_cache: ResultCache instance used to reuse verdicts of previous runs on identical files with
+            identical declared metadata
+        :param doi_resolver: DOIResolver instance used to test if DOIs resolve
+        :param exhaustive: If True, run all tests on PDF files even after the verdict is settled
         :param **kwargs: Dictionary of citation details and any other known metadata fields; values may include:
             acceptance_date=None, doi=None, publication_date=None, title=None
         '''
@@ -631,6 +1358,12 @@ class VersionDetector:
         self.dec_ms_title = dec_ms_title
         self.dec_version = dec_version
         self.dec_authors = dec_authors
+        self.cermine_service = cermine_service
+        self.cermine_batch = cermine_batch
+        self.artifact_store = artifact_store
+        self.result_cache = result_cache
+        self.doi_resolver = doi_resolver
+        self.exhaustive = exhaustive
         self.metadata = kwargs
         logger.info("----- Working on file {}".format(file_path))
 
@@ -647,19 +1380,48 @@ class VersionDetector:
             return self.file_ext
 
     def detect(self):
+        """
+        Detect version of file using appropriate parser, or retrieve a previous verdict from self.result_cache
+        :return:
+        """
+        if self.result_cache:
+            # exhaustive runs report more test results, so they are cached separately
+            metadata = {**self.metadata, 'exhaustive': True} if self.exhaustive else self.metadata
+            key = ResultCache.key(file_digest(self.file_path), self.result_cache.ruleset, self.dec_ms_title,
+                                  self.dec_version, self.dec_authors, metadata)
+            timer = StageTimer()
+            with timer.measure('result_cache'):
+                result = self.result_cache.get(key)
+            if result is not None:
+                logger.info("Returning cached result for {}".format(self.file_name))
+                # timing of the run that produced result is not stored; report that of the lookup
+                return {**result, 'input file': self.file_name, 'timing': timer.summary()}
+            result = self.detect_version()
+            if isinstance(result, dict):
+                self.result_cache.put(key, {k: v for k, v in result.items() if k != 'timing'})
+            return result
+        return self.detect_version()
+
+    def detect_version(self):
         """
         Detect version of file using appropriate parser
         :return:
         """
         ext = self.check_extension()
         if ext == "docx":
-            p = DocxParser(self.file_path, self.dec_ms_title, self.dec_version, self.dec_authors, **self.metadata)
+            p = DocxParser(self.file_path, self.dec_ms_title, self.dec_version, self.dec_authors,
+                           artifact_store=self.artifact_store, doi_resolver=self.doi_resolver, **self.metadata)
             result = p.parse()
         elif ext == "pdf":
             def pdf_routine(detector_instance, temp_file):
                 shutil.copy2(detector_instance.file_path, temp_file)
                 pdfparser = PdfParser(temp_file, detector_instance.dec_ms_title,
                                       detector_instance.dec_version, detector_instance.dec_authors,
+                                      artifact_store=detector_instance.artifact_store,
+                                      doi_resolver=detector_instance.doi_resolver,
+                                      cermine_service=detector_instance.cermine_service,
+                                      cermine_batch=detector_instance.cermine_batch,
+                                      exhaustive=detector_instance.exhaustive,
                                       **detector_instance.metadata)
                 return pdfparser.parse()
             if not self.keep_temp_files:
@@ -679,6 +1441,232 @@ class VersionDetector:
         return result
 
 
+def read_manifest(manifest_path):
+    """
+    Reads a batch manifest. Manifests may be CSV files (with a header row) or JSONL files (one JSON object per line);
+    in both cases each record must contain a 'path' field and may contain 'title', 'version', 'authors' and any other
+    citation metadata (e.g. 'doi'). Relative paths are resolved against the folder containing the manifest.
+    :param manifest_path: Path to .csv or .jsonl manifest
+    :return: list of job dictionaries
+    """
+    manifest_dirname = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, newline='') as f:
+        if manifest_path.lower().endswith(".csv"):
+            records = list(csv.DictReader(f))
+        else:
+            records = [json.loads(line) for line in f if line.strip()]
+    jobs = []
+    for r in records:
+        if not r.get(MANIFEST_PATH_KEY):
+            logger.error("Skipping manifest record without a {} field: {}".format(MANIFEST_PATH_KEY, r))
+            continue
+        job = {k: v for k, v in r.items() if v not in [None, ""]}
+        job[MANIFEST_PATH_KEY] = os.path.join(manifest_dirname, os.path.expanduser(r[MANIFEST_PATH_KEY]))
+        authors = job.get(MANIFEST_AUTHORS_KEY)
+        if isinstance(authors, str):
+            job[MANIFEST_AUTHORS_KEY] = [a.strip() for a in authors.split(";") if a.strip()]
+        jobs.append(job)
+    return jobs
+
+
+def init_batch_worker(cermine_jvms=0, cache_dir=None, cache_size=None, result_cache_path=None, result_ttl=None,
+                      doi_cache_path=None):
+    """
+    Initialises a BatchDetector worker process
+    :param cermine_jvms: Number of long-lived CERMINE workers (JVMs) to start in this process; if 0, CERMINE is
+        launched in a new JVM for every PDF
+    :param cache_dir: Folder of the ArtifactStore shared by all worker processes; if None, nothing is cached
+    :param cache_size: Maximum size of the ArtifactStore in bytes
+    :param result_cache_path: Path to the SQLite database of the ResultCache; if None, verdicts are not cached
+    :param result_ttl: Number of seconds after which cached verdicts expire
+    :param doi_cache_path: Path to the SQLite database where DOIResolver caches outcomes; if None, they are not cached
+    """
+    global worker_cermine_service, worker_artifact_store, worker_result_cache, worker_doi_resolver
+    worker_doi_resolver = DOIResolver(cache_path=doi_cache_path)
+    atexit.register(worker_doi_resolver.close)
+    if result_cache_path:
+        worker_result_cache = ResultCache(result_cache_path, ruleset_version(), ttl=result_ttl)
+    if cache_dir:
+        worker_artifact_store = ArtifactStore(cache_dir, **({'max_size': cache_size} if cache_size else {}))
+    if cermine_jvms and CermineService.available():
+        worker_cermine_service = CermineService(jvms=cermine_jvms)
+        worker_cermine_service.start()
+        atexit.register(worker_cermine_service.stop)
+
+
+def detect_job(job, keep_temp_files=False, exhaustive=False, cermine_batch=None):
+    """
+    Runs VersionDetector on a single batch job. This is the function executed by worker processes of BatchDetector, so
+    it never raises; failures are reported in the returned dictionary instead.
+    :param job: dictionary containing 'path' and, optionally, 'title', 'version', 'authors' and citation metadata
+    :param keep_temp_files: passed on to VersionDetector
+    :param exhaustive: passed on to VersionDetector
+    :param cermine_batch: passed on to VersionDetector
+    :return: result dictionary of VersionDetector.detect, with the additional key 'input path'
+    """
+    job = dict(job)
+    file_path = job.pop(MANIFEST_PATH_KEY)
+    dec_ms_title = job.pop(MANIFEST_TITLE_KEY, None)
+    dec_version = job.pop(MANIFEST_VERSION_KEY, None)
+    dec_authors = job.pop(MANIFEST_AUTHORS_KEY, None)
+    try:
+        detector = VersionDetector(file_path, keep_temp_files=keep_temp_files, dec_ms_title=dec_ms_title,
+                                   dec_version=dec_version, dec_authors=dec_authors,
+                                   cermine_service=worker_cermine_service, cermine_batch=cermine_batch,
+                                   artifact_store=worker_artifact_store, result_cache=worker_result_cache,
+                                   doi_resolver=worker_doi_resolver, exhaustive=exhaustive, **job)
+        result = detector.detect()
+        if not isinstance(result, dict):
+            # detect returns a ("fail", error_msg) tuple for unsupported files
+            result = {'input file': os.path.basename(file_path), 'approved': False, 'reason': result[1]}
+    except Exception as e:
+        logger.exception("Detection failed for {}".format(file_path))
+        result = {'input file': os.path.basename(file_path), 'approved': False,
+                  'reason': "Detection failed with {}: {}".format(type(e).__name__, e)}
+    return {'input path': file_path, **result}
+
+
+def detect_job_group(jobs, keep_temp_files=False, exhaustive=False):
+    """
+    Runs detect_job on all jobs at once, on threads, sharing a LazyCermineBatch: CERMINE runs once over the PDF files
+    that reach the CERMINE test, when all other jobs have either reached it too or finished, so that files answered by
+    the result cache or settled by cheaper tests are never staged
+    :param jobs: list of job dictionaries (see detect_job)
+    :param keep_temp_files: passed on to VersionDetector
+    :param exhaustive: passed on to VersionDetector
+    :return: list of result dictionaries
+    """
+    with TemporaryDirectory(prefix="artemis-batch-") as work_dir:
+        cermine_batch = LazyCermineBatch(work_dir, cermine_service=worker_cermine_service)
+        # every job is registered before any starts, so that CERMINE does not run before all jobs have had a chance
+        # to request it
+        for _ in jobs:
+            cermine_batch.register()
+
+        def run(job):
+            try:
+                return detect_job(job, keep_temp_files=keep_temp_files, exhaustive=exhaustive,
+                                  cermine_batch=cermine_batch)
+            finally:
+                cermine_batch.finish()
+
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            return list(executor.map(run, jobs))
+
+
+class BatchDetector:
+    """
+    Detects the version of many files, spreading VersionDetector.detect calls across a pool of worker processes
+    """
+    def __init__(self, source, workers=None, keep_temp_files=False, dec_ms_title=None, dec_version=None,
+                 cermine_jvms=0, cermine_batch_size=1, cache_dir=None, cache_size=None, result_cache_path=None,
+                 result_ttl=None, doi_cache_path=None, exhaustive=False, trace_path=None):
+        '''
+
+        :param source: Directory, glob pattern or manifest (.csv or .jsonl) listing the files to evaluate
+        :param workers: Number of worker processes; defaults to the number of CPUs
+        :param cermine_jvms: Number of long-lived CERMINE workers (JVMs) started by each worker process; if 0,
+            CERMINE is launched in a new JVM for every PDF
+        :param cermine_batch_size: Number of PDF files staged together for a single CERMINE run; results of files in
+            the same group are yielded together, once the whole group has been processed
+        :param cache_dir: Folder of the ArtifactStore shared by all worker processes; if None, nothing is cached
+        :param cache_size: Maximum size of the ArtifactStore in bytes
+        :param result_cache_path: Path to the SQLite database of the ResultCache shared by all worker processes
+        :param result_ttl: Number of seconds after which cached verdicts expire
+        :param doi_cache_path: Path to the SQLite database where outcomes of DOI checks are cached; if given, declared
+            DOIs of all files are checked concurrently before files are dispatched to worker processes
+        :param exhaustive: If True, run all tests on PDF files even after the verdict is settled
+        :param trace_path: Path to a JSON file where the timing of every stage of every file is written as Chrome
+            trace events once the batch finishes (see utils.timing.ChromeTrace); if None, no trace is written
+        :param keep_temp_files: If true, temp directories containing files extracted by CERMINE are not deleted
+        :param dec_ms_title: Declared title used for files whose manifest record does not declare one
+        :param dec_version: Declared version used for files whose manifest record does not declare one
+        '''
+        self.source = source
+        self.workers = workers
+        self.keep_temp_files = keep_temp_files
+        self.dec_ms_title = dec_ms_title
+        self.dec_version = dec_version
+        self.cermine_jvms = cermine_jvms
+        self.cermine_batch_size = cermine_batch_size
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.result_cache_path = result_cache_path
+        self.result_ttl = result_ttl
+        self.doi_cache_path = doi_cache_path
+        self.exhaustive = exhaustive
+        self.trace_path = trace_path
+
+    def resolve_declared_dois(self, jobs):
+        """
+        Checks the declared DOIs of all jobs in one concurrent batch, so that worker processes find the outcomes in
+        the DOI cache
+        """
+        dois = [job['doi'] for job in jobs if job.get('doi')]
+        if dois and self.doi_cache_path:
+            with DOIResolver(cache_path=self.doi_cache_path) as resolver:
+                outcomes = resolver.resolve_many(dois)
+            logger.info("Checked {} declared DOIs; {} resolve".format(
+                len(outcomes), sum(bool(o) for o in outcomes.values())))
+
+    def collect_jobs(self):
+        """
+        Lists the files in self.source as batch jobs
+        :return: list of job dictionaries
+        """
+        if os.path.isdir(self.source):
+            paths = [os.path.join(self.source, f) for f in sorted(os.listdir(self.source))
+                     if os.path.splitext(f)[-1].lower() in SUPPORTED_EXTENSIONS]
+            jobs = [{MANIFEST_PATH_KEY: p} for p in paths]
+        elif os.path.splitext(self.source)[-1].lower() in [".csv", ".jsonl"]:
+            jobs = read_manifest(self.source)
+        else:
+            jobs = [{MANIFEST_PATH_KEY: p} for p in sorted(glob.glob(self.source, recursive=True))
+                    if os.path.isfile(p)]
+        for job in jobs:
+            if self.dec_ms_title:
+                job.setdefault(MANIFEST_TITLE_KEY, self.dec_ms_title)
+            if self.dec_version:
+                job.setdefault(MANIFEST_VERSION_KEY, self.dec_version)
+        logger.info("Collected {} files from {}".format(len(jobs), self.source))
+        return jobs
+
+    def detect(self):
+        """
+        Detect version of all files in self.source
+        :return: generator yielding one result dictionary per file, in the order in which they finish
+        """
+        trace = ChromeTrace(self.trace_path) if self.trace_path else None
+        try:
+            for result in self.detect_all():
+                if trace:
+                    trace.add(result.get('timing'), result['input path'])
+                yield result
+        finally:
+            if trace:
+                trace.write()
+
+    def detect_all(self):
+        jobs = self.collect_jobs()
+        if not jobs:
+            return
+        self.resolve_declared_dois(jobs)
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=init_batch_worker,
+                                 initargs=(self.cermine_jvms, self.cache_dir, self.cache_size,
+                                           self.result_cache_path, self.result_ttl,
+                                           self.doi_cache_path)) as executor:
+            if self.cermine_batch_size > 1:
+                groups = [jobs[i:i + self.cermine_batch_size] for i in range(0, len(jobs), self.cermine_batch_size)]
+                futures = [executor.submit(detect_job_group, group, self.keep_temp_files, self.exhaustive)
+                           for group in groups]
+                for future in as_completed(futures):
+                    for result in future.result():
+                        yield result
+            else:
+                futures = [executor.submit(detect_job, job, self.keep_temp_files, exhaustive=self.exhaustive)
+                           for job in jobs]
+                for future in as_completed(futures):
+                    yield future.result()
 
 
 if __name__ == "__main__":
@@ -699,7 +1687,40 @@ https://opensource.org/licenses/MIT
     parser = argparse.ArgumentParser(description=description_text, epilog=sign_off, prog='Artemis',
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('path', type=str, metavar='<path>',
-                        help='Path to input file (journal article file to be analysed)')
+                        help='Path to input file (journal article file to be analysed); in batch mode, path to a '
+                             'directory, glob pattern or manifest (.csv or .jsonl)')
+    parser.add_argument('-b', '--batch', dest='batch', action="store_true",
+                        help='Batch mode: analyse all files in <path> and print one JSON result per line as each '
+                             'file finishes')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, metavar='N',
+                        help='Number of worker processes used in batch mode (default: number of CPUs)')
+    parser.add_argument('-j', '--cermine-jvms', dest='cermine_jvms', type=int, default=0, metavar='N',
+                        help='Number of long-lived CERMINE workers (JVMs) to run per process, instead of launching '
+                             'a new JVM for every PDF; requires utils/CermineServer.class (see README)')
+    parser.add_argument('-g', '--cermine-batch-size', dest='cermine_batch_size', type=int, default=1, metavar='N',
+                        help='Number of PDF files processed together by a single CERMINE run in batch mode '
+                             '(default: 1)')
+    parser.add_argument('-c', '--cache-dir', dest='cache_dir', type=str, metavar='<folder>',
+                        help='Folder where text, CERMINE outputs and other artifacts extracted from input files are '
+                             'stored, so that they are reused when an identical file is analysed again')
+    parser.add_argument('-s', '--cache-size', dest='cache_size', type=int, default=2048, metavar='MB',
+                        help='Maximum size of the cache folder in megabytes; least recently used artifacts are '
+                             'deleted when it is exceeded (default: 2048)')
+    parser.add_argument('-r', '--result-cache', dest='result_cache', type=str, metavar='<path>',
+                        help='SQLite database where verdicts are stored, so that they are returned immediately when '
+                             'an identical file is analysed again with identical declared metadata')
+    parser.add_argument('--result-ttl', dest='result_ttl', type=float, metavar='HOURS',
+                        help='Number of hours after which stored verdicts expire (default: never)')
+    parser.add_argument('--invalidate-result-cache', dest='invalidate_result_cache', action="store_true",
+                        help='Delete all stored verdicts before analysing <path>')
+    parser.add_argument('--doi-cache', dest='doi_cache', type=str, metavar='<path>',
+                        help='SQLite database where outcomes of DOI checks are stored, so that DOIs are not looked '
+                             'up again until the stored outcome expires')
+    parser.add_argument('-e', '--exhaustive', dest='exhaustive', action="store_true",
+                        help='Run every test on PDF files, even after earlier tests have settled the verdict')
+    parser.add_argument('--trace', dest='trace', type=str, metavar='<path>',
+                        help='Write the wall time, CPU time and peak memory of every stage of every file to <path> '
+                             'as Chrome trace events (open in chrome://tracing or https://ui.perfetto.dev)')
     parser.add_argument('-k', '--keep', dest='keep', action="store_true",
                         help='Keep temporary files')
     parser.add_argument('-t', '--title', dest='title', type=str, metavar='"Expected title of journal article"',
@@ -708,10 +1729,38 @@ https://opensource.org/licenses/MIT
                         metavar='"{}", "{}", "{}" or "{}"'.format(SMUR, AM, P, VOR),
                         help='Expected/declared version of journal article')
     arguments = parser.parse_args()
-
-    detector = VersionDetector(arguments.path, keep_temp_files=arguments.keep,
-                               dec_ms_title=arguments.title, dec_version=arguments.version)
-    print(detector.detect())
+    result_ttl = arguments.result_ttl * 3600 if arguments.result_ttl else None
+
+    if arguments.result_cache and arguments.invalidate_result_cache:
+        cache = ResultCache(arguments.result_cache, ruleset_version())
+        logger.info("Deleted {} stored verdicts".format(cache.invalidate()))
+        cache.close()
+
+    if arguments.batch:
+        batch_detector = BatchDetector(arguments.path, workers=arguments.workers, keep_temp_files=arguments.keep,
+                                       dec_ms_title=arguments.title, dec_version=arguments.version,
+                                       cermine_jvms=arguments.cermine_jvms,
+                                       cermine_batch_size=arguments.cermine_batch_size,
+                                       cache_dir=arguments.cache_dir, cache_size=arguments.cache_size * 1024 ** 2,
+                                       result_cache_path=arguments.result_cache, result_ttl=result_ttl,
+                                       doi_cache_path=arguments.doi_cache, exhaustive=arguments.exhaustive,
+                                       trace_path=arguments.trace)
+        for batch_result in batch_detector.detect():
+            print(json.dumps(batch_result, default=str), flush=True)
+    else:
+        init_batch_worker(arguments.cermine_jvms, arguments.cache_dir, arguments.cache_size * 1024 ** 2,
+                          arguments.result_cache, result_ttl, arguments.doi_cache)
+        detector = VersionDetector(arguments.path, keep_temp_files=arguments.keep,
+                                   dec_ms_title=arguments.title, dec_version=arguments.version,
+                                   cermine_service=worker_cermine_service, artifact_store=worker_artifact_store,
+                                   result_cache=worker_result_cache, doi_resolver=worker_doi_resolver,
+                                   exhaustive=arguments.exhaustive)
+        trace = ChromeTrace(arguments.trace) if arguments.trace else None
+        result = detector.detect()
+        if trace and isinstance(result, dict):
+            trace.add(result.get('timing'), arguments.path)
+            trace.write()
+        print(result)
 
     # TODO: This project has some useful functions: https://github.com/Phyks/libbmc/blob/master/libbmc/doi.py
 
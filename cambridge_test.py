@@ -10,11 +10,12 @@ from urllib.parse import unquote
 from zenpy import Zenpy
 
 from dspace_client import Dspace5Client
-from artemis import VersionDetector
+from artemis import VersionDetector, ruleset_version
 from secrets_local import zd_creds, downloads_folder, working_folder
 from zd_fields import ZdFields
 
 from utils.logos import PublisherLogo
+from utils.result_cache import ResultCache
 
 logging.config.fileConfig('logging.conf', defaults={'logfilename':'cambridge_test.log'})
 logger = logging.getLogger(__name__)
@@ -85,6 +86,7 @@ def extract_list_of_authors_from_ds_metadata(metadata_list):
 
 
 OUTPUT_CSV = os.path.join(working_folder, "apollo_analysis.csv")
+RESULT_CACHE_PATH = os.path.join(working_folder, "artemis_results.sqlite")
 
 DSPACE_ID_TAG = "DSpace ID"
 
@@ -179,6 +181,7 @@ def main():
     os.chdir(downloads_folder)
 
     logger.info("Working on test cases")
+    result_cache = ResultCache(RESULT_CACHE_PATH, ruleset_version())
     with open(OUTPUT_CSV, "w") as f:
         header = ["bitstream", "Apollo version", "outcome", "version/details"]
         csv_writer = csv.DictWriter(f, fieldnames=header, extrasaction='ignore')
@@ -193,6 +196,7 @@ def main():
                                          dec_version=bs['description'],
                                          dec_authors=extract_list_of_authors_from_ds_metadata(client.get_item_metadata(
                                              tc.dspace_id)),
+                                         result_cache=result_cache,
                                          # **{'doi': 'foo'}
                                          )
 
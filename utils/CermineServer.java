@@ -0,0 +1,42 @@
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+
+import pl.edu.icm.cermine.ContentExtractor;
+
+/**
+ * Long-lived CERMINE worker used by utils/cermine.py.
+ *
+ * Reads one command per line from stdin and writes one reply per line to stdout:
+ *   PING          -> PONG
+ *   <folder path> -> OK, or ERROR <message>, after running CERMINE on all PDFs in folder
+ *
+ * Anything CERMINE itself prints to stdout is redirected to stderr, so that it cannot corrupt the protocol.
+ *
+ * Compile with (from the root of the artemis folder):
+ *   javac -cp cermine-impl-1.13-jar-with-dependencies.jar -d utils utils/CermineServer.java
+ */
+public class CermineServer {
+    public static void main(String[] args) throws Exception {
+        String outputs = args.length > 0 ? args[0] : "jats,text,zones,trueviz,images";
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+        PrintStream out = new PrintStream(System.out, true, "UTF-8");
+        System.setOut(System.err);
+        String line;
+        while ((line = in.readLine()) != null) {
+            if (line.isEmpty()) {
+                continue;
+            }
+            if (line.equals("PING")) {
+                out.println("PONG");
+                continue;
+            }
+            try {
+                ContentExtractor.main(new String[]{"-path", line, "-outputs", outputs});
+                out.println("OK");
+            } catch (Throwable t) {
+                out.println("ERROR " + String.valueOf(t).replace('\n', ' '));
+            }
+        }
+    }
+}
@@ -1,53 +1,214 @@
 import logging
 import logging.config
 import math
+import numpy as np
 import os
+import re
 import regex
-import requests
-import statistics
 import xml.etree.ElementTree as ET
-from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+from xml.sax.saxutils import unescape
 
-logging.config.fileConfig('logging.conf', defaults={'logfilename':'TrueViz.log'})
+PARENT_FOLDER = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+logging.config.fileConfig(os.path.join(PARENT_FOLDER, 'logging.conf'), defaults={'logfilename': 'TrueViz.log'})
 logger = logging.getLogger(__name__)
 
 # https://www.slideshare.net/dtkaczyk/tkaczyk-grotoap2slides
 
+# number of bytes read at a time when indexing the pages of a .cermstr file
+INDEX_CHUNK_SIZE = 1024 ** 2
+PAGE_START_PATTERN = regex.compile(rb'<Page[\s>]')
+PAGE_END = b'</Page>'
+PAGE_ID_PATTERN = regex.compile(rb'<PageID\s+Value="([^"]*)"')
+
+# zone categories assigned by CERMINE; Layout.categories starts with these and grows if others are found
+ZONE_CATEGORIES = [
+    'UNKNOWN', 'BODY_CONTENT', 'BODY_HEADING', 'BODY_TABLE', 'BODY_FIGURE', 'BODY_EQUATION', 'BODY_EQUATION_LABEL',
+    'BODY_ACKNOWLEDGMENT', 'BODY_CONFLICT_STMT', 'BODY_ATTACHMENT', 'BODY_GLOSSARY', 'BODY_CONTRIBUTION',
+    'MET_TITLE', 'MET_AUTHOR', 'MET_AFFILIATION', 'MET_ABSTRACT', 'MET_BIB_INFO', 'MET_CORRESPONDENCE', 'MET_DATES',
+    'MET_EDITOR', 'MET_KEYWORDS', 'MET_TITLE_AUTHOR', 'MET_TYPE', 'MET_COPYRIGHT', 'MET_ACCESS_DATA', 'REFERENCES',
+    'OTHER', 'GEN_METADATA', 'GEN_BODY', 'GEN_REFERENCES', 'GEN_OTHER',
+]
+# columns of the arrays of Layout; boxes are (left, top, right, bottom) in points, parent is the row of the parent
+# element in the level above
+BOX_FIELDS = [('x0', 'f4'), ('y0', 'f4'), ('x1', 'f4'), ('y1', 'f4'), ('id', 'i4')]
+DTYPES = {
+    'Zone': np.dtype(BOX_FIELDS + [('page', 'i4'), ('category', 'u1')]),
+    'Line': np.dtype(BOX_FIELDS + [('parent', 'i4')]),
+    'Word': np.dtype(BOX_FIELDS + [('parent', 'i4')]),
+    'Character': np.dtype(BOX_FIELDS + [('parent', 'i4'), ('codepoint', 'u4')]),
+}
+LEVELS = {'Zone': 'zones', 'Line': 'lines', 'Word': 'words', 'Character': 'characters'}
+LEVEL_NAMES = list(LEVELS)
+CHILD_LEVELS = {'Zone': 'Line', 'Line': 'Word', 'Word': 'Character'}
+PARENT_LEVELS = {child: parent for parent, child in CHILD_LEVELS.items()}
+
+# patterns used by Layout.from_page_bytes to read the geometry of a page without building an element tree; elements
+# are written by CERMINE as <XID Value=".."/> followed by <XCorners> with four vertices. These simple patterns are
+# compiled with re, which scans bytes about twice as fast as regex.
+VERTEX = rb'\s*<Vertex\s+x="([^"]*)"\s+y="([^"]*)"\s*/>'
+ELEMENT_PATTERN = re.compile(rb'<(Zone|Line|Word|Character)ID\s+Value="([^"]*)"\s*/>\s*<\1Corners>' + VERTEX * 4)
+CATEGORY_PATTERN = re.compile(rb'<Category\s+Value="([^"]*)"')
+GT_TEXT_PATTERN = re.compile(rb'<GT_Text\s+Value="([^"]*)"')
+ENTITIES = {'&quot;': '"', '&apos;': "'"}
+
+# TikZ drawings of pages (see write_tikz_picture)
+TIKZ_PREAMBLE = "\\documentclass[a4paper,8pt]{extarticle}\n\\usepackage{geometry, tikz}\n\\geometry{margin=0pt}\n" \
+                "\\renewcommand{\\familydefault}{\\ttdefault}\n\\begin{document}\n\\pagestyle{empty}\n"
+TIKZ_RECTANGLE = "\\draw[draw={}] ({:.2f},{:.2f}) rectangle ({:.2f},{:.2f});\n"
+TIKZ_NODE = "\\draw ({:.2f},{:.2f}) node {{{}}};\n"
+TIKZ_COLOURS = {'Zone': 'red', 'Line': 'blue', 'Word': 'green', 'Character': 'yellow'}
+# Adapted from https://stackoverflow.com/a/25875504
+TEX_ESCAPES = {
+    '&': r'\&',
+    '%': r'\%',
+    '$': r'\$',
+    '#': r'\#',
+    '_': r'\_',
+    '{': r'\{',
+    '}': r'\}',
+    '~': r'\textasciitilde{}',
+    '^': r'\^{}',
+    '\\': r'\textbackslash{}',
+    '<': r'\textless{}',
+    '>': r'\textgreater{}',
+}
+TEX_ESCAPE_PATTERN = regex.compile('|'.join(regex.escape(key) for key in sorted(TEX_ESCAPES, key=lambda k: -len(k))))
+
+# thresholds of layout_features
+MIN_WORDS_PER_ZONE = 50  # body content zones with fewer words are ignored when detecting columns
+MAX_COLUMN_WIDTH = 312  # width of a column of a two-column layout (c. 110 mm), in points
+MIN_NUMBERED_LINES = 5  # fewer line numbers may be chance (e.g. numbered section headings)
+MIN_NUMBERED_LINES_PER_PAGE = 10  # average on pages with line numbers
+MAX_LINE_NUMBER_OFFSET = 10  # horizontal misalignment of successive line numbers, in points
+MAX_LINE_NUMBER_EXCEPTIONS = 0.1  # fraction of line numbers that may be out of order or misaligned
+MAX_LINE_NUMBER_DIGITS = 4
+
 
 class Document:
+    """
+    TrueViz (.cermstr) file produced by CERMINE. These files hold one element per character, so they are never parsed
+    as a whole: the byte range of each page is indexed when the document is opened, and pages are then parsed one at a
+    time, only when asked for (see get_page and iter_pages).
+    """
     def __init__(self, cermstr_path):
         self.path = cermstr_path
-        with open(cermstr_path) as f:
-            tree = ET.parse(f)
-        self.root = tree.getroot()
-        self.pages = {}
-        children = self.root.findall("Page")
-        for c in children:
-            page = Page(self, c)
-            self.pages[page.id] = page
-        self.number_of_pages = len(self.pages)
+        self.page_offsets = self.index_pages()
+        self.number_of_pages = len(self.page_offsets)
         self.middle_page = math.floor(self.number_of_pages / 2)
         self.line_spacing = None
 
+    def index_pages(self):
+        """
+        Finds the byte range of each Page element in a single pass over the file, without parsing XML
+        :return: dictionary where keys are page IDs (strings) and values are tuples (start, end) of byte offsets, in
+            document order
+        """
+        offsets = {}
+        overlap = len(PAGE_END)
+        position = 0  # offset of buffer in file
+        buffer = b''
+        start = None
+        with open(self.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(INDEX_CHUNK_SIZE), b''):
+                buffer += chunk
+                searched = 0
+                while True:
+                    if start is None:
+                        m = PAGE_START_PATTERN.search(buffer, searched)
+                        if not m:
+                            break
+                        start = position + m.start()
+                        searched = m.end()
+                    else:
+                        end = buffer.find(PAGE_END, searched)
+                        if end == -1:
+                            break
+                        searched = end + len(PAGE_END)
+                        page_range = (start, position + searched)
+                        start = None
+                        page_id = self.read_page_id(f, page_range)
+                        offsets[page_id if page_id is not None else str(len(offsets))] = page_range
+                keep = len(buffer) - max(searched, len(buffer) - overlap)
+                position += len(buffer) - keep
+                buffer = buffer[len(buffer) - keep:]
+        if start is not None:
+            logger.warning("Last page of {} is incomplete".format(self.path))
+        return offsets
+
+    @staticmethod
+    def read_page_id(f, page_range, head_size=256):
+        """
+        :param f: .cermstr file open in binary mode
+        :param page_range: byte range of a Page element
+        :return: value of PageID element of page, or None if it is not found in the first head_size bytes of page
+        """
+        position = f.tell()
+        f.seek(page_range[0])
+        head = f.read(min(head_size, page_range[1] - page_range[0]))
+        f.seek(position)
+        m = PAGE_ID_PATTERN.search(head)
+        return m.group(1).decode('utf-8') if m else None
+
+    def get_page(self, page_id):
+        """
+        Parses a single page, reading only its byte range
+        :param page_id: ID of page (as in self.page_offsets)
+        :return: Page instance
+        """
+        start, end = self.page_offsets[str(page_id)]
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            return Page(self, ET.fromstring(f.read(end - start)))
+
+    def iter_pages(self, page_ids=None):
+        """
+        Yields pages one at a time. Each page is discarded once the caller moves on to the next, so memory use does
+        not grow with the length of the document.
+        :param page_ids: IDs of pages to yield; if None, all pages are parsed with iterparse in a single pass
+        :return: generator of Page instances
+        """
+        if page_ids is not None:
+            for page_id in page_ids:
+                if str(page_id) in self.page_offsets:
+                    yield self.get_page(page_id)
+            return
+        context = ET.iterparse(self.path, events=('start', 'end'))
+        _, root = next(context)
+        for event, element in context:
+            if (event == 'end') and (element.tag == 'Page'):
+                page = Page(self, element)
+                root.remove(element)  # the page's geometry has been read into page.layout
+                yield page
+
+    def layout(self, page_ids=None):
+        """
+        Reads the geometry of many pages into a single Layout, one page at a time (see Layout.from_page_bytes)
+        :param page_ids: IDs of pages to read; if None, read all pages
+        :return: Layout instance
+        """
+        if page_ids is None:
+            page_ids = list(self.page_offsets)
+        return Layout.concatenate([self.page_layout(p) for p in page_ids if str(p) in self.page_offsets])
+
+    def layout_features(self):
+        """
+        Computes layout features of all pages (see layout_features)
+        """
+        return layout_features(self.layout())
+
     def detect_line_spacing(self, sample_size=5):
         """
-        Detect line spacing by calculating the median of spaces between lines in sample_size pages.
+        Detect line spacing by calculating the median of spaces between lines in sample_size pages (see
+        layout_features).
         :param sample_size: Number of pages to sample. Pages are sampled from the middle of the document
         :return:
         """
-        spacing_of_body_content_zones = []
-        for k, page in self.pages.items():
-            if (int(k) >= (self.middle_page - 2)) and (int(k) <= (self.middle_page + 2)):
-                logger.debug("Working on page {}".format(int(k) + 1))
-                page.get_children()
-                if page.children:
-                    for zone in page.children:
-                        if zone.category == "BODY_CONTENT":
-                            if zone.detect_line_spacing():
-                                spacing_of_body_content_zones.append(zone.line_spacing)
-        if spacing_of_body_content_zones:
-            self.line_spacing = statistics.median(spacing_of_body_content_zones)
-        else:
+        half_sample = sample_size // 2
+        sample = range(self.middle_page - half_sample, self.middle_page - half_sample + sample_size)
+        self.line_spacing = layout_features(self.layout(page_ids=sample))['line_spacing']
+        if self.line_spacing is None:
             logger.warning("Could not detect spacing of body content zones")
         return self.line_spacing
 
@@ -57,473 +218,502 @@ class Document:
         :param page_number:
         :return:
         """
-        if not output_filename:
-            output_filename = self.path.replace(".cermstr", "_tikz.tex")
         if not page_number:
             page_number = self.middle_page
-        with open(output_filename, "w") as f:
-            s = "\\documentclass[a4paper,8pt]{extarticle}\n\\usepackage{geometry, tikz}\n\\geometry{margin=0pt}\n" \
-                "\\renewcommand{\\familydefault}{\\ttdefault}\n\\begin{document}\n\\pagestyle{empty}\n"
-            s += self.pages[str(page_number)].tikz_picture()
-            s += "\\end{document}"
-            f.write(s)
+        self.write_tikz(output_filename, page_ids=[page_number])
+
+    def page_layout(self, page_id):
+        """
+        :return: Layout of a single page (see layout)
+        """
+        start, end = self.page_offsets[str(page_id)]
+        return read_page_layout(self.path, start, end, page_id)
+
+    def write_tikz(self, output=None, page_ids=None, workers=1):
+        """
+        Draws pages in tikz format, one page of the output per page of the document, writing each page as soon as it
+        is rendered
+        :param output: Path to output .tex file, or an open text stream; if None, output is written next to the
+            .cermstr file, with suffix _tikz.tex
+        :param page_ids: IDs of pages to draw (e.g. range(3, 6)); if None, draw all pages
+        :param workers: Number of processes rendering pages; with more than one, pages are rendered in parallel and
+            still written in order
+        :return:
+        """
+        if output is None:
+            output = self.path.replace(".cermstr", "_tikz.tex")
+        if page_ids is None:
+            page_ids = list(self.page_offsets)
+        ranges = [(self.path,) + self.page_offsets[str(p)] + (p,) for p in page_ids if str(p) in self.page_offsets]
+        if isinstance(output, str):
+            with open(output, "w") as f:
+                return self.write_tikz(f, page_ids=page_ids, workers=workers)
+        output.write(TIKZ_PREAMBLE)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pictures = executor.map(render_page_tikz, *zip(*ranges)) if ranges else []
+                for i, picture in enumerate(pictures):
+                    output.write("\\clearpage\n" if i else "")
+                    output.write(picture)
+        else:
+            for i, page_range in enumerate(ranges):
+                output.write("\\clearpage\n" if i else "")
+                write_tikz_picture(read_page_layout(*page_range), output)
+        output.write("\\end{document}")
+
+
+class Layout:
+    """
+    Columnar store of the geometry of one or more pages: one structured NumPy array per level (zones, lines, words
+    and characters) holding bounding boxes, the index of each element's parent in the level above, zone categories
+    (as codes in self.categories) and character codepoints. Rows are in document order, so the children of an element
+    are a contiguous slice of the level below. TrueVizElement subclasses are views over rows of these arrays.
+    """
+    def __init__(self, zones, lines, words, characters, categories=None, character_texts=None):
+        '''
+
+        :param zones: array of ZONE_DTYPE
+        :param lines: array of LINE_DTYPE
+        :param words: array of WORD_DTYPE
+        :param characters: array of CHARACTER_DTYPE
+        :param categories: list of zone category names, indexed by code
+        :param character_texts: dictionary of GT_Text values longer than one character, keyed by character index
+        '''
+        self.zones = zones
+        self.lines = lines
+        self.words = words
+        self.characters = characters
+        self.categories = categories if categories is not None else list(ZONE_CATEGORIES)
+        self.character_texts = character_texts or {}
+
+    def level(self, name):
+        return getattr(self, LEVELS[name])
+
+    def children(self, name, index):
+        """
+        :param name: Name of level of parent element (e.g. 'Zone')
+        :param index: Row of parent element
+        :return: range of rows of children of element in the level below
+        """
+        child_level = CHILD_LEVELS[name]
+        parents = self.level(child_level)['parent']
+        return range(*np.searchsorted(parents, [index, index + 1]))
+
+    def category_code(self, category):
+        if category not in self.categories:
+            self.categories.append(category)
+        return self.categories.index(category)
+
+    @classmethod
+    def from_page_element(cls, element, page=0):
+        """
+        Reads the geometry of a Page element of a TrueViz file
+        :param element: Page element
+        :param page: Index of page, stored with each zone
+        :return: Layout instance
+        """
+        layout = cls(None, None, None, None)
+        rows = {name: [] for name in LEVELS}
+        character_texts = {}
+
+        def box(e, name):
+            vertices = e.find("{}Corners".format(name))
+            xs = [float(v.get('x')) for v in vertices] if vertices is not None else [0]
+            ys = [float(v.get('y')) for v in vertices] if vertices is not None else [0]
+            return min(xs), min(ys), max(xs), max(ys)
+
+        def element_id(e, name):
+            value = e.find("{}ID".format(name))
+            try:
+                return int(value.get('Value'))
+            except (AttributeError, TypeError, ValueError):
+                return -1
+
+        for zone in element.iterfind('Zone'):
+            category = zone.find('Classification/Category')
+            rows['Zone'].append(box(zone, 'Zone') + (element_id(zone, 'Zone'), page, layout.category_code(
+                category.get('Value') if category is not None else 'UNKNOWN')))
+            for line in zone.iterfind('Line'):
+                rows['Line'].append(box(line, 'Line') + (element_id(line, 'Line'), len(rows['Zone']) - 1))
+                for word in line.iterfind('Word'):
+                    rows['Word'].append(box(word, 'Word') + (element_id(word, 'Word'), len(rows['Line']) - 1))
+                    for character in word.iterfind('Character'):
+                        text = character.find('GT_Text')
+                        text = text.get('Value', '') if text is not None else ''
+                        if len(text) > 1:
+                            character_texts[len(rows['Character'])] = text
+                        rows['Character'].append(box(character, 'Character') + (
+                            element_id(character, 'Character'), len(rows['Word']) - 1, ord(text[0]) if text else 0))
+        for name, attribute in LEVELS.items():
+            setattr(layout, attribute, np.array(rows[name], dtype=DTYPES[name]))
+        layout.character_texts = character_texts
+        return layout
+
+    @classmethod
+    def from_page_bytes(cls, data, page=0):
+        """
+        Reads the geometry of a page from the bytes of its Page element with a few regex scans and vectorised
+        conversions, which is much faster than walking an element tree one character at a time
+        :param data: Bytes of Page element, as written by CERMINE
+        :param page: Index of page, stored with each zone
+        :return: Layout instance, or None if the page is not laid out as expected (use from_page_element instead)
+        """
+        matches = ELEMENT_PATTERN.findall(data)
+        categories = CATEGORY_PATTERN.findall(data)
+        texts = GT_TEXT_PATTERN.findall(data)
+        counts = [data.count('<{}>'.format(name).encode('ascii')) for name in LEVEL_NAMES]
+        fields = np.array(matches, dtype=object).reshape(-1, 10)
+        kinds = np.array([LEVEL_NAMES.index(k.decode('ascii')) for k in fields[:, 0]], dtype=np.int8)
+        if [int(np.count_nonzero(kinds == i)) for i in range(len(LEVEL_NAMES))] != counts or \
+                (len(categories) != counts[0]) or (len(texts) != counts[3]):
+            return None
+        try:
+            ids = fields[:, 1].astype(np.int32) if len(fields) else np.zeros(0, dtype=np.int32)
+            coordinates = fields[:, 2:].astype(np.float32) if len(fields) else np.zeros((0, 8), dtype=np.float32)
+        except ValueError:
+            return None
+        xs = coordinates[:, 0::2]
+        ys = coordinates[:, 1::2]
+        layout = cls(None, None, None, None)
+        for level, name in enumerate(LEVEL_NAMES):
+            mask = kinds == level
+            array = np.zeros(int(np.count_nonzero(mask)), dtype=DTYPES[name])
+            array['x0'] = xs[mask].min(axis=1, initial=np.inf) if len(array) else 0
+            array['x1'] = xs[mask].max(axis=1, initial=-np.inf) if len(array) else 0
+            array['y0'] = ys[mask].min(axis=1, initial=np.inf) if len(array) else 0
+            array['y1'] = ys[mask].max(axis=1, initial=-np.inf) if len(array) else 0
+            array['id'] = ids[mask]
+            if level:
+                # elements are in document order, so the parent of an element is the last element of the level above
+                # that precedes it
+                array['parent'] = np.cumsum(kinds == level - 1)[mask] - 1
+            setattr(layout, LEVELS[name], array)
+        layout.zones['page'] = page
+        layout.zones['category'] = [layout.category_code(c.decode('utf-8')) for c in categories]
+        texts = [t.decode('utf-8') for t in texts]
+        texts = [unescape(t, ENTITIES) if '&' in t else t for t in texts]
+        layout.characters['codepoint'] = [ord(t[0]) if t else 0 for t in texts]
+        layout.character_texts = {i: t for i, t in enumerate(texts) if len(t) > 1}
+        return layout
+
+    @classmethod
+    def concatenate(cls, layouts):
+        """
+        Joins the layouts of several pages, renumbering parent indices and category codes
+        :param layouts: list of Layout instances
+        :return: Layout instance
+        """
+        result = cls(None, None, None, None)
+        arrays = {name: [] for name in LEVELS}
+        offsets = {name: 0 for name in LEVELS}
+        for layout in layouts:
+            codes = np.array([result.category_code(c) for c in layout.categories], dtype=np.uint8)
+            for name, attribute in LEVELS.items():
+                array = getattr(layout, attribute).copy()
+                if name == 'Zone':
+                    array['category'] = codes[array['category']] if len(array) else array['category']
+                else:
+                    array['parent'] += offsets[PARENT_LEVELS[name]]
+                arrays[name].append(array)
+            for index, text in layout.character_texts.items():
+                result.character_texts[index + offsets['Character']] = text
+            for name, attribute in LEVELS.items():
+                offsets[name] += len(getattr(layout, attribute))
+        for name, attribute in LEVELS.items():
+            setattr(result, attribute, np.concatenate(arrays[name]) if arrays[name]
+                    else np.zeros(0, dtype=DTYPES[name]))
+        return result
 
 
 class TrueVizElement:
-    def __init__(self, name, parent, xml_element, child_class=None):
-        self.name = name
+    """
+    View over one row of a Layout level
+    """
+    __slots__ = ('layout', 'index', 'parent')
+    level_name = None
+    child_class = None
+
+    def __init__(self, layout, index, parent=None):
+        self.layout = layout
+        self.index = index
         self.parent = parent
-        self.id_string = "{}ID".format(name)
-        self.element = xml_element
-        self.id = self.element.find(self.id_string).get('Value')
-        self.child_class = child_class
-        self.children = []
+
+    @classmethod
+    def name(cls):
+        return cls.level_name
+
+    @property
+    def row(self):
+        return self.layout.level(self.level_name)[self.index]
+
+    @property
+    def id(self):
+        return str(self.row['id'])
 
     def get_children(self):
-        children = self.element.findall(self.child_class.name())
-        for c in children:
-            child = self.child_class(self, c)
-            self.children.append(child)
-        return self.children
+        """
+        :return: list of views of children of this element (a new list on each call)
+        """
+        return [self.child_class(self.layout, i, self) for i in self.layout.children(self.level_name, self.index)]
+
+    @property
+    def children(self):
+        return self.get_children()
+
+
+class Page:
+    """
+    A page of a TrueViz document, read into a Layout as soon as it is parsed; the XML element is not kept
+    """
+    __slots__ = ('parent', 'id', 'layout')
 
+    def __init__(self, parent, xml_element, page_index=None):
+        self.parent = parent
+        self.id = xml_element.find("PageID").get('Value')
+        if page_index is None:
+            try:
+                page_index = int(self.id)
+            except ValueError:
+                page_index = -1
+        self.layout = Layout.from_page_element(xml_element, page=page_index)
 
-class Page(TrueVizElement):
-    def __init__(self, parent, xml_element):
-        super(Page, self).__init__("Page", parent, xml_element, Zone)
+    @staticmethod
+    def name():
+        return "Page"
+
+    def get_children(self):
+        return [Zone(self.layout, i, self) for i in range(len(self.layout.zones))]
+
+    @property
+    def children(self):
+        return self.get_children()
 
     def tikz_picture(self):
-        def children_check(element):
-            if not element.children:
-                element.get_children()
-        s = "\\begin{tikzpicture}[x=1pt,y=1pt]\n"
-        children_check(self)
-        for zone in self.children:
-            children_check(zone)
-            for line in zone.children:
-                children_check(line)
-                for word in line.children:
-                    children_check(word)
-                    for character in word.children:
-                        s += character.tikz_node()
-                    s += word.tikz_rectangle(colour="green")
-                s += line.tikz_rectangle(colour="blue")
-            s += zone.tikz_rectangle(colour="red")
-        s += r"\end{tikzpicture}"
-        return s
+        f = StringIO()
+        write_tikz_picture(self.layout, f)
+        return f.getvalue()
 
 
 class GeometricElement(TrueVizElement):
-    def __init__(self, name, parent, xml_element, child_class=None):
-        super(GeometricElement, self).__init__(name, parent, xml_element, child_class=child_class)
-        self.corners = self.element.find("{}Corners".format(name))
+    __slots__ = ()
+
+    @property
+    def box(self):
+        """
+        :return: tuple (left, top, right, bottom) of bounding box, in points (y grows downwards)
+        """
+        row = self.row
+        return float(row['x0']), float(row['y0']), float(row['x1']), float(row['y1'])
 
     def tikz_rectangle(self, colour="black"):
-        return "\\draw[draw={}] ({},{}) rectangle ({},{});\n".format(colour,
-                                                                    self.corners[0].get('x'),
-                                                                    self.corners[0].get('y'),
-                                                                    self.corners[2].get('x'),
-                                                                    self.corners[2].get('y')
-                                                                    )
+        return TIKZ_RECTANGLE.format(colour, *self.box)
 
 
 class Zone(GeometricElement):
-    def __init__(self, parent, xml_element):
-        super(Zone, self).__init__("Zone", parent, xml_element, Line)
-        self.category = self.element.find('Classification').find('Category').attrib['Value']
+    __slots__ = ('line_spacing',)
+    level_name = "Zone"
+
+    def __init__(self, layout, index, parent=None):
+        super(Zone, self).__init__(layout, index, parent)
         self.line_spacing = None
 
-    @staticmethod
-    def name():
-        return "Zone"
+    @property
+    def category(self):
+        return self.layout.categories[self.row['category']]
 
     def detect_line_spacing(self):
-        self.get_children()
-        baseline_of_previous_line = None
-        for line in self.children:
-            top_of_line = float(line.corners[0].get('y'))
-            baseline = float(line.corners[2].get('y'))
-            line_height = baseline - top_of_line
-            logger.debug('Line height: {}'.format(line_height))
-            if not baseline_of_previous_line:
-                baseline_of_previous_line = baseline
-                continue  # this is the first line in this body content zone
-            line_spacing = baseline - baseline_of_previous_line
-            if line_height:  # avoid division by zero
-                line_spacing_ratio = line_spacing / line_height
-                logger.debug("Line spacing: {}; Line spacing ratio: {}".format(line_spacing, line_spacing_ratio))
-                self.line_spacing = line_spacing_ratio
-            baseline_of_previous_line = baseline
+        """
+        :return: median line spacing ratio of the lines of this zone (see line_spacing_ratios), or None if the zone
+            has fewer than two lines
+        """
+        lines = self.layout.lines[self.layout.children(self.level_name, self.index)]
+        ratios = line_spacing_ratios(lines)
+        self.line_spacing = float(np.median(ratios)) if len(ratios) else None
         return self.line_spacing
 
 
 class Line(GeometricElement):
-    def __init__(self, parent, xml_element):
-        super(Line, self).__init__("Line", parent, xml_element, Word)
-
-    @staticmethod
-    def name():
-        return "Line"
+    __slots__ = ()
+    level_name = "Line"
 
 
 class Word(GeometricElement):
-    def __init__(self, parent, xml_element):
-        super(Word, self).__init__("Word", parent, xml_element, Character)
-
-    @staticmethod
-    def name():
-        return "Word"
+    __slots__ = ()
+    level_name = "Word"
 
 
 class Character(GeometricElement):
-    def __init__(self, parent, xml_element):
-        super(Character, self).__init__("Character", parent, xml_element)
-        self.value = self.element.find('GT_Text').attrib['Value']
+    __slots__ = ()
+    level_name = "Character"
 
-    @staticmethod
-    def name():
-        return "Character"
+    @property
+    def value(self):
+        text = self.layout.character_texts.get(self.index)
+        if text is not None:
+            return text
+        codepoint = int(self.row['codepoint'])
+        return chr(codepoint) if codepoint else ''
 
     def tikz_node(self):
-        def tex_escape(text):
-            """
-                Adapted from https://stackoverflow.com/a/25875504
-                :param text: a plain text message
-                :return: the message escaped to appear correctly in LaTeX
-            """
-            conv = {
-                '&': r'\&',
-                '%': r'\%',
-                '$': r'\$',
-                '#': r'\#',
-                '_': r'\_',
-                '{': r'\{',
-                '}': r'\}',
-                '~': r'\textasciitilde{}',
-                '^': r'\^{}',
-                '\\': r'\textbackslash{}',
-                '<': r'\textless{}',
-                '>': r'\textgreater{}',
-            }
-            t = regex.compile(
-                '|'.join(regex.escape(key) for key in sorted(conv.keys(), key=lambda item: - len(item))))
-            return t.sub(lambda match: conv[match.group()], text)
-
-        s = super(Character, self).tikz_rectangle(colour="yellow")
-        x_center = (float(self.corners[0].get('x')) + float(self.corners[2].get('x'))) / 2
-        y_center = (float(self.corners[0].get('y')) + float(self.corners[2].get('y'))) / 2
-        s += "\\draw ({},{}) node {{{}}};\n".format(x_center, y_center, tex_escape(self.value))
-        return s
-#
-#     left_limit_of_body_content_zones = []
-#     first_words_that_are_integers = []
-#     wide_body_content_zone_counter = 0
-#     narrow_body_content_zone_counter = 0
-#     min_words_per_zone = 50
-#     for page in root.iter('Page'):
-#         page_id = page.find('PageID').get('Value')
-#         if int(page_id) in [(middle_page - 1), middle_page, (middle_page + 1)]:
-#             logger.debug("Working on page {}".format(int(page_id) + 1))
-#             zones = page.findall('Zone')
-#             if zones:
-#                 for zone in page.findall('Zone'):
-#                     zone_id = zone.find('ZoneID').get('Value')
-#                     category = zone.find('Classification').find('Category').attrib['Value']
-#                     logger.debug("Zone {} is of category {}".format(zone_id, category))
-#                     if category == "BODY_CONTENT":
-#                         words = zone.findall('Word')
-#
-#                         if len(words) < min_words_per_zone:
-#                             logger.debug(
-#                                 "Skipped zone {}; it has less than {} words".format(zone_id, min_words_per_zone))
-#                             continue
-#
-#                         # logger.debug("Analysing body_content zone on page {}".format(page_id))
-#                         # region columns
-#                         corners = zone.find('ZoneCorners').findall('Vertex')
-#                         left_limit = float(corners[0].get('x'))
-#                         right_limit = float(corners[1].get('x'))
-#                         zone_width = right_limit - left_limit
-#                         if zone_width > 312:  # c. 110 mm in pt
-#                             wide_body_content_zone_counter += 1
-#                         else:
-#                             narrow_body_content_zone_counter += 1
-#                         left_limit_of_body_content_zones.append(left_limit)
-#                         # endregion
-#
-#                         # region line spacing and line numbering
-#                         baseline_of_previous_line = None
-#                         for line in zone.findall('Line'):
-#                             line_id = line.find('LineID').attrib['Value']
-#                             # logger.debug("LineID: {}".format(line_id))
-#                             # region line numbering
-#                             first_word = line.find('Word')
-#                             first_word_value = ""
-#                             first_word_characters = first_word.findall('Character')
-#                             for c in first_word_characters:
-#                                 first_word_value += c.find('GT_Text').attrib['Value']
-#                             # logger.debug("First word: {}".format(first_word_value))
-#                             m = NUMBER_PATTERN.match(first_word_value)
-#                             if m:
-#                                 w_corners = first_word.find('WordCorners').findall('Vertex')
-#                                 w_left_margin = float(w_corners[3].get('x'))
-#                                 w_right_margin = float(w_corners[2].get('x'))
-#                                 first_words_that_are_integers.append({
-#                                     "number": m.group(),
-#                                     "line_id": line_id,
-#                                     "page_id": page_id,
-#                                     "left_margin": w_left_margin,
-#                                     "right_margin": w_right_margin
-#                                 }
-#                                 )
-#                             # endregion
-#
-#                             l_corners = line.find('LineCorners').findall('Vertex')
-#                             top_of_line = float(l_corners[0].get('y'))
-#                             baseline = float(l_corners[2].get('y'))
-#                             line_height = baseline - top_of_line
-#                             # logger.debug('Line height: {}'.format(line_height))
-#                             if not baseline_of_previous_line:
-#                                 baseline_of_previous_line = baseline
-#                                 continue  # this is the first line in this body content zone
-#                             line_spacing = baseline - baseline_of_previous_line
-#                             if line_height:  # avoid division by zero
-#                                 line_spacing_ratio = line_spacing / line_height
-#                                 # logger.debug("Line spacing: {}; Line spacing ratio: {}".format(line_spacing, line_spacing_ratio))
-#                                 spacing_of_body_content_zones.append(line_spacing_ratio)
-#                             baseline_of_previous_line = baseline
-#                             # for l_corner in l_corners:
-#                             #     if l_corners.index(l_corner) in [0, 2]:
-#                             #         logger.debug("LineCorner:", l_corner.get('x'), l_corner.get('y'))
-#                         # endregion
-#             else:
-#                 logger.warning("Page {} does not have any zones".format(page_id))
-#
-#     logger.debug("lenght of first_words_that_are_integers: {}; first_words_that_are_integers: {}".format(
-#         len(first_words_that_are_integers), first_words_that_are_integers))
-#     if not first_words_that_are_integers:
-#         numbered_lines = False
-#     elif len(first_words_that_are_integers) < 5:
-#         # we would have to be very unlucky to fail to find 5 numbered lines in 3 pages in a PDF where lines
-#         # are truly numbered (though pages with large images or numbered only every 5 lines can truly have
-#         # only few numbered lines
-#         numbered_lines = False
-#     else:
-#         previous_number = None
-#         exceptions_count = 0
-#         for n in first_words_that_are_integers:
-#             if not previous_number:
-#                 previous_number = n
-#                 continue
-#             else:
-#                 if n['page_id'] == previous_number['page_id']:
-#                     if not int(n['number']) > int(previous_number['number']):  # line numbers on the same
-#                         # page should be incremental
-#                         exceptions_count += 1
-#
-#                 left_margin_offset = abs(n['left_margin'] - previous_number['left_margin'])
-#                 right_margin_offset = abs(n['right_margin'] - previous_number['right_margin'])
-#                 logger.debug("left_margin_offset: {}; right_margin_offset: {}".format(left_margin_offset,
-#                                                                                       right_margin_offset))
-#                 max_offset = 10
-#                 if (left_margin_offset > max_offset) or (right_margin_offset > max_offset):
-#                     # line numbers should be aligned
-#                     exceptions_count += 1
-#                 previous_number = n
-#         logger.debug("exception_count: {}".format(exceptions_count))
-#         if exceptions_count > 3:
-#             numbered_lines = False
-#         else:
-#             numbered_lines = True
-#
-#     logger.debug("left_limit_of_body_content_zones: {}".format(left_limit_of_body_content_zones))
-#     if left_limit_of_body_content_zones:
-#         putative_columns = Counter(left_limit_of_body_content_zones).most_common(2)
-#         # logger.debug("putative_columns: {}".format(putative_columns))
-#         # if (abs(putative_columns[1][0] - putative_columns[0][0]) > 100  # putative columns separated by at least 100pt
-#         #     ) and (
-#         #         (putative_columns[1][1] / putative_columns[0][1]) > 0.5):  # number of columns on one side matched by at least 50% of columns on the opposite side
-#         #     two_columns = True
-#         # else:
-#         #     two_columns = False
-#     else:
-#         logger.warning("Could not detect left limit of body content zones")
-#
-#     logger.debug("wide_body_content_zone_counter: {}; narrow_body_content_zone_counter: {}".format(
-#         wide_body_content_zone_counter, narrow_body_content_zone_counter))
-#     if wide_body_content_zone_counter > narrow_body_content_zone_counter:
-#         two_columns = False
-#     else:
-#         two_columns = True
-#
-#     if spacing_of_body_content_zones:
-#         spacing_median = statistics.median(spacing_of_body_content_zones)
-#     else:
-#         logger.warning("Could not detect spacing of body content zones")
-#
-#     return spacing_median, two_columns, numbered_lines
-#
-#
-# def parse_cerm_trueviz(self):
-#     """
-#     Parses Trueviz (.cermstr) file generated by CERMINE to detect line spacing, column layout and numbers along
-#     the left margin
-#     :return:
-#     """
-#     two_columns = None
-#     spacing_median = None
-#     numbered_lines = None
-#     cermstr_path = self.file_path.replace(self.file_ext, ".cermstr")
-#     if not self.number_of_pages:
-#         self.extract_file_metadata()
-#     middle_page = int(math.floor((int(self.number_of_pages) / 2)))
-#     with open(cermstr_path) as f:
-#         tree = ET.parse(f)
-#     root = tree.getroot()
-#     spacing_of_body_content_zones = []
-#     left_limit_of_body_content_zones = []
-#     first_words_that_are_integers = []
-#     wide_body_content_zone_counter = 0
-#     narrow_body_content_zone_counter = 0
-#     min_words_per_zone = 50
-#     for page in root.iter('Page'):
-#         page_id = page.find('PageID').get('Value')
-#         if int(page_id) in [(middle_page - 1), middle_page, (middle_page + 1)]:
-#             logger.debug("Working on page {}".format(int(page_id) + 1))
-#             zones = page.findall('Zone')
-#             if zones:
-#                 for zone in page.findall('Zone'):
-#                     zone_id = zone.find('ZoneID').get('Value')
-#                     category = zone.find('Classification').find('Category').attrib['Value']
-#                     logger.debug("Zone {} is of category {}".format(zone_id, category))
-#                     if category == "BODY_CONTENT":
-#                         words = zone.findall('Word')
-#
-#                         if len(words) < min_words_per_zone:
-#                             logger.debug(
-#                                 "Skipped zone {}; it has less than {} words".format(zone_id, min_words_per_zone))
-#                             continue
-#
-#                         # logger.debug("Analysing body_content zone on page {}".format(page_id))
-#                         # region columns
-#                         corners = zone.find('ZoneCorners').findall('Vertex')
-#                         left_limit = float(corners[0].get('x'))
-#                         right_limit = float(corners[1].get('x'))
-#                         zone_width = right_limit - left_limit
-#                         if zone_width > 312:  # c. 110 mm in pt
-#                             wide_body_content_zone_counter += 1
-#                         else:
-#                             narrow_body_content_zone_counter += 1
-#                         left_limit_of_body_content_zones.append(left_limit)
-#                         # endregion
-#
-#                         # region line spacing and line numbering
-#                         baseline_of_previous_line = None
-#                         for line in zone.findall('Line'):
-#                             line_id = line.find('LineID').attrib['Value']
-#                             # logger.debug("LineID: {}".format(line_id))
-#                             # region line numbering
-#                             first_word = line.find('Word')
-#                             first_word_value = ""
-#                             first_word_characters = first_word.findall('Character')
-#                             for c in first_word_characters:
-#                                 first_word_value += c.find('GT_Text').attrib['Value']
-#                             # logger.debug("First word: {}".format(first_word_value))
-#                             m = NUMBER_PATTERN.match(first_word_value)
-#                             if m:
-#                                 w_corners = first_word.find('WordCorners').findall('Vertex')
-#                                 w_left_margin = float(w_corners[3].get('x'))
-#                                 w_right_margin = float(w_corners[2].get('x'))
-#                                 first_words_that_are_integers.append({
-#                                     "number": m.group(),
-#                                     "line_id": line_id,
-#                                     "page_id": page_id,
-#                                     "left_margin": w_left_margin,
-#                                     "right_margin": w_right_margin
-#                                 }
-#                                 )
-#                             # endregion
-#
-#                             l_corners = line.find('LineCorners').findall('Vertex')
-#                             top_of_line = float(l_corners[0].get('y'))
-#                             baseline = float(l_corners[2].get('y'))
-#                             line_height = baseline - top_of_line
-#                             # logger.debug('Line height: {}'.format(line_height))
-#                             if not baseline_of_previous_line:
-#                                 baseline_of_previous_line = baseline
-#                                 continue  # this is the first line in this body content zone
-#                             line_spacing = baseline - baseline_of_previous_line
-#                             if line_height:  # avoid division by zero
-#                                 line_spacing_ratio = line_spacing / line_height
-#                                 # logger.debug("Line spacing: {}; Line spacing ratio: {}".format(line_spacing, line_spacing_ratio))
-#                                 spacing_of_body_content_zones.append(line_spacing_ratio)
-#                             baseline_of_previous_line = baseline
-#                             # for l_corner in l_corners:
-#                             #     if l_corners.index(l_corner) in [0, 2]:
-#                             #         logger.debug("LineCorner:", l_corner.get('x'), l_corner.get('y'))
-#                         # endregion
-#             else:
-#                 logger.warning("Page {} does not have any zones".format(page_id))
-#
-#     logger.debug("lenght of first_words_that_are_integers: {}; first_words_that_are_integers: {}".format(
-#         len(first_words_that_are_integers), first_words_that_are_integers))
-#     if not first_words_that_are_integers:
-#         numbered_lines = False
-#     elif len(first_words_that_are_integers) < 5:
-#         # we would have to be very unlucky to fail to find 5 numbered lines in 3 pages in a PDF where lines
-#         # are truly numbered (though pages with large images or numbered only every 5 lines can truly have
-#         # only few numbered lines
-#         numbered_lines = False
-#     else:
-#         previous_number = None
-#         exceptions_count = 0
-#         for n in first_words_that_are_integers:
-#             if not previous_number:
-#                 previous_number = n
-#                 continue
-#             else:
-#                 if n['page_id'] == previous_number['page_id']:
-#                     if not int(n['number']) > int(previous_number['number']):  # line numbers on the same
-#                         # page should be incremental
-#                         exceptions_count += 1
-#
-#                 left_margin_offset = abs(n['left_margin'] - previous_number['left_margin'])
-#                 right_margin_offset = abs(n['right_margin'] - previous_number['right_margin'])
-#                 logger.debug("left_margin_offset: {}; right_margin_offset: {}".format(left_margin_offset,
-#                                                                                       right_margin_offset))
-#                 max_offset = 10
-#                 if (left_margin_offset > max_offset) or (right_margin_offset > max_offset):
-#                     # line numbers should be aligned
-#                     exceptions_count += 1
-#                 previous_number = n
-#         logger.debug("exception_count: {}".format(exceptions_count))
-#         if exceptions_count > 3:
-#             numbered_lines = False
-#         else:
-#             numbered_lines = True
-#
-#     logger.debug("left_limit_of_body_content_zones: {}".format(left_limit_of_body_content_zones))
-#     if left_limit_of_body_content_zones:
-#         putative_columns = Counter(left_limit_of_body_content_zones).most_common(2)
-#         # logger.debug("putative_columns: {}".format(putative_columns))
-#         # if (abs(putative_columns[1][0] - putative_columns[0][0]) > 100  # putative columns separated by at least 100pt
-#         #     ) and (
-#         #         (putative_columns[1][1] / putative_columns[0][1]) > 0.5):  # number of columns on one side matched by at least 50% of columns on the opposite side
-#         #     two_columns = True
-#         # else:
-#         #     two_columns = False
-#     else:
-#         logger.warning("Could not detect left limit of body content zones")
-#
-#     logger.debug("wide_body_content_zone_counter: {}; narrow_body_content_zone_counter: {}".format(
-#         wide_body_content_zone_counter, narrow_body_content_zone_counter))
-#     if wide_body_content_zone_counter > narrow_body_content_zone_counter:
-#         two_columns = False
-#     else:
-#         two_columns = True
-#
-#     if spacing_of_body_content_zones:
-#         spacing_median = statistics.median(spacing_of_body_content_zones)
-#     else:
-#         logger.warning("Could not detect spacing of body content zones")
-#
-#     return spacing_median, two_columns, numbered_lines
+        x0, y0, x1, y1 = self.box
+        return self.tikz_rectangle(colour=TIKZ_COLOURS['Character']) + TIKZ_NODE.format(
+            (x0 + x1) / 2, (y0 + y1) / 2, tex_escape(self.value))
+
+Zone.child_class = Line
+Line.child_class = Word
+Word.child_class = Character
+def tex_escape(text):
+    """
+    :param text: a plain text message
+    :return: the message escaped to appear correctly in LaTeX
+    """
+    return TEX_ESCAPE_PATTERN.sub(lambda match: TEX_ESCAPES[match.group()], text)
+
+
+def read_page_layout(cermstr_path, start, end, page_id):
+    """
+    Reads the Layout of the page found between byte offsets start and end of a .cermstr file (see Document.index_pages)
+    """
+    with open(cermstr_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    try:
+        page_index = int(page_id)
+    except ValueError:
+        page_index = -1
+    layout = Layout.from_page_bytes(data, page=page_index)
+    if layout is None:
+        logger.debug("Page {} of {} has an unexpected layout; parsing its XML".format(page_id, cermstr_path))
+        layout = Layout.from_page_element(ET.fromstring(data), page=page_index)
+    return layout
+
+
+def write_tikz_picture(layout, f):
+    """
+    Writes a tikzpicture of a page to f, drawing every character, then the box of its word, line and zone, in
+    document order
+    :param layout: Layout of a single page
+    :param f: Text stream
+    """
+    boxes = {name: np.stack([layout.level(name)[c] for c in ('x0', 'y0', 'x1', 'y1')], axis=1).tolist()
+             for name in LEVEL_NAMES}
+    # children of element i of a level are rows bounds[i]:bounds[i + 1] of the level below
+    bounds = {name: np.searchsorted(layout.level(CHILD_LEVELS[name])['parent'],
+                                    np.arange(len(layout.level(name)) + 1)).tolist()
+              for name in CHILD_LEVELS}
+    codepoints = layout.characters['codepoint'].tolist()
+    f.write("\\begin{tikzpicture}[x=1pt,y=1pt]\n")
+    for z in range(len(boxes['Zone'])):
+        for l in range(bounds['Zone'][z], bounds['Zone'][z + 1]):
+            for w in range(bounds['Line'][l], bounds['Line'][l + 1]):
+                pieces = []
+                for c in range(bounds['Word'][w], bounds['Word'][w + 1]):
+                    x0, y0, x1, y1 = boxes['Character'][c]
+                    text = layout.character_texts.get(c)
+                    if text is None:
+                        text = chr(codepoints[c]) if codepoints[c] else ''
+                    pieces.append(TIKZ_RECTANGLE.format(TIKZ_COLOURS['Character'], x0, y0, x1, y1))
+                    pieces.append(TIKZ_NODE.format((x0 + x1) / 2, (y0 + y1) / 2, tex_escape(text)))
+                pieces.append(TIKZ_RECTANGLE.format(TIKZ_COLOURS['Word'], *boxes['Word'][w]))
+                f.write(''.join(pieces))
+            f.write(TIKZ_RECTANGLE.format(TIKZ_COLOURS['Line'], *boxes['Line'][l]))
+        f.write(TIKZ_RECTANGLE.format(TIKZ_COLOURS['Zone'], *boxes['Zone'][z]))
+    f.write(r"\end{tikzpicture}")
+
+
+def render_page_tikz(cermstr_path, start, end, page_id):
+    """
+    Renders a tikzpicture of one page of a .cermstr file, in a worker process (see Document.write_tikz)
+    :return: string
+    """
+    f = StringIO()
+    write_tikz_picture(read_page_layout(cermstr_path, start, end, page_id), f)
+    return f.getvalue()
+
+
+def line_spacing_ratios(lines):
+    """
+    Ratios of the distance between the baselines of consecutive lines of the same zone to the height of the second
+    line (about 1.2 for single-spaced text and 2.4 for double-spaced text)
+    :param lines: array of DTYPES['Line'], in document order
+    :return: array of ratios
+    """
+    heights = lines['y1'][1:] - lines['y0'][1:]
+    spacing = np.diff(lines['y1'])
+    # lines of different zones, or in a new column, are not consecutive
+    valid = (lines['parent'][1:] == lines['parent'][:-1]) & (heights > 0) & (spacing > 0)
+    return spacing[valid] / heights[valid]
+
+
+def number_values(layout):
+    """
+    Reads the words of a layout that are made of digits only as integers
+    :return: tuple (boolean array, True for words that are numbers; array of values of words)
+    """
+    characters = layout.characters
+    n_words = len(layout.words)
+    word = characters['parent']
+    codepoints = characters['codepoint'].astype(np.int64)
+    digits = (codepoints >= ord('0')) & (codepoints <= ord('9'))
+    length = np.bincount(word, minlength=n_words)
+    number_of_digits = np.bincount(word, weights=digits, minlength=n_words)
+    position = np.arange(len(characters)) - np.searchsorted(word, word)
+    place = 10.0 ** (length[word] - 1 - position)
+    values = np.bincount(word, weights=(codepoints - ord('0')) * digits * place, minlength=n_words)
+    is_number = (length > 0) & (number_of_digits == length) & (length <= MAX_LINE_NUMBER_DIGITS)
+    return is_number, values
+
+
+def layout_features(layout, min_words_per_zone=MIN_WORDS_PER_ZONE):
+    """
+    Computes layout features that distinguish manuscripts from typeset articles, with array operations over all
+    pages of a layout at once:
+    - line_spacing: median line spacing ratio of body content zones (see line_spacing_ratios)
+    - two_columns: True if most body content zones with at least min_words_per_zone words are no wider than a column
+      of a two-column layout
+    - numbered_lines: True if lines start with numbers that increase down each page and are aligned with each other,
+      as line numbers in the margin of a manuscript are
+    :param layout: Layout instance
+    :return: dictionary of features; features that could not be computed are None
+    """
+    zones, lines, words = layout.zones, layout.lines, layout.words
+    features = {'line_spacing': None, 'two_columns': None, 'numbered_lines': None}
+    if not len(lines):
+        return features
+    body = np.zeros(len(zones), dtype=bool)
+    if 'BODY_CONTENT' in layout.categories:
+        body = zones['category'] == layout.categories.index('BODY_CONTENT')
+
+    ratios = line_spacing_ratios(lines[body[lines['parent']]])
+    if len(ratios):
+        features['line_spacing'] = round(float(np.median(ratios)), 2)
+
+    words_per_zone = np.bincount(lines['parent'][words['parent']], minlength=len(zones))
+    large_body_zones = body & (words_per_zone >= min_words_per_zone)
+    if large_body_zones.any():
+        wide = np.count_nonzero((zones['x1'] - zones['x0'])[large_body_zones] > MAX_COLUMN_WIDTH)
+        features['two_columns'] = bool(np.count_nonzero(large_body_zones) - wide >= wide)
+
+    # first word of each line
+    line_numbers = np.arange(len(lines))
+    first_word = np.minimum(np.searchsorted(words['parent'], line_numbers), max(len(words) - 1, 0))
+    has_words = len(words) > 0 and (words['parent'][first_word] == line_numbers)
+    is_number, values = number_values(layout)
+    numbered = first_word[has_words & is_number[first_word]] if len(words) else first_word[:0]
+    if len(numbered) < MIN_NUMBERED_LINES:
+        features['numbered_lines'] = False
+        return features
+    numbers = values[numbered]
+    pages = zones['page'][lines['parent'][words['parent'][numbered]]]
+    left = words['x0'][numbered]
+    right = words['x1'][numbered]
+    # line numbers on the same page should increase, and all line numbers should be aligned
+    out_of_order = (pages[1:] == pages[:-1]) & (numbers[1:] <= numbers[:-1])
+    misaligned = (np.abs(np.diff(left)) > MAX_LINE_NUMBER_OFFSET) | (np.abs(np.diff(right)) > MAX_LINE_NUMBER_OFFSET)
+    exceptions = np.count_nonzero(out_of_order | misaligned)
+    per_page = len(numbered) / len(np.unique(pages))
+    logger.debug("{} lines start with a number ({} per page); {} out of order or misaligned".format(
+        len(numbered), per_page, exceptions))
+    features['numbered_lines'] = bool((exceptions <= max(3, MAX_LINE_NUMBER_EXCEPTIONS * len(numbered))) and
+                                      (per_page >= MIN_NUMBERED_LINES_PER_PAGE))
+    return features
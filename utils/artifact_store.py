@@ -0,0 +1,182 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3  # bytes
+# the store is shared by worker processes, each of which only sees the size of the artifacts it commits; the whole store
+# is measured again at least this often (in seconds), so that artifacts committed by other processes are counted
+SIZE_RESCAN_INTERVAL = 300
+# eviction shrinks the store to this fraction of its maximum size, so that it is not measured again on every commit
+EVICTION_TARGET = 0.9
+
+
+def folder_size(path):
+    """
+    :return: total size in bytes of the files in folder path and its subfolders
+    """
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        size += sum(os.path.getsize(os.path.join(dirpath, f)) for f in filenames)
+    return size
+
+
+def file_digest(file_path, chunk_size=1024 ** 2):
+    """
+    Calculates the SHA-256 digest of a file
+    :param file_path: Path to file
+    :param chunk_size: Number of bytes read at a time
+    :return: hexadecimal digest
+    """
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ArtifactStore:
+    """
+    On-disk store of artifacts extracted from input files (e.g. extracted text, CERMINE outputs, image hashes), keyed by
+    the SHA-256 digest of the input file plus the name and version of the extractor that produced them. Least recently
+    used artifacts are evicted when the store grows beyond max_size. The size of the store is kept as a running total,
+    so that storing an artifact only measures that artifact; the whole store is measured when the total exceeds max_size
+    or SIZE_RESCAN_INTERVAL has elapsed.
+
+    Layout: <cache_dir>/<digest[:2]>/<digest>/<name>-<version>/ holds one artifact, which is either a single file named
+    'value' (text or JSON) or a copy of the files produced by the extractor.
+    """
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        '''
+
+        :param cache_dir: Folder where artifacts are stored; created if it does not exist
+        :param max_size: Maximum total size of the store in bytes
+        '''
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.size = None  # running total of the size of the store in bytes; None until the store is first measured
+        self.last_scan = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def entry_path(self, digest, name, version):
+        return os.path.join(self.cache_dir, digest[:2], digest, "{}-{}".format(name, version))
+
+    def lookup(self, digest, name, version):
+        """
+        :return: Path to stored artifact folder, or None if artifact is not in store
+        """
+        path = self.entry_path(digest, name, version)
+        if not os.path.isdir(path):
+            return None
+        os.utime(path)  # mark as recently used
+        logger.debug("Artifact store hit for {} {}-{}".format(digest, name, version))
+        return path
+
+    def commit(self, staging_dir, digest, name, version):
+        """
+        Atomically moves a fully written staging folder into the store, then evicts old artifacts if necessary
+        """
+        path = self.entry_path(digest, name, version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = folder_size(staging_dir)
+        try:
+            os.rename(staging_dir, path)
+        except OSError:
+            # another process stored the same artifact first
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            size = 0
+        if self.size is not None:
+            self.size += size
+        if (self.size is None) or (self.size > self.max_size) or \
+                (time.time() - self.last_scan > SIZE_RESCAN_INTERVAL):
+            self.evict()
+
+    def new_staging_dir(self):
+        return tempfile.mkdtemp(prefix=".staging-", dir=self.cache_dir)
+
+    def get(self, digest, name, version):
+        """
+        Retrieves a text or JSON artifact
+        :return: Stored value, or None if artifact is not in store
+        """
+        path = self.lookup(digest, name, version)
+        if not path:
+            return None
+        try:
+            with open(os.path.join(path, 'value'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read artifact {}: {}".format(path, e))
+            return None
+
+    def put(self, digest, name, version, value):
+        """
+        Stores a text or JSON-serialisable artifact
+        """
+        staging_dir = self.new_staging_dir()
+        with open(os.path.join(staging_dir, 'value'), 'w', encoding='utf-8') as f:
+            json.dump(value, f, default=str)
+        self.commit(staging_dir, digest, name, version)
+
+    def get_files(self, digest, name, version, destination_stem):
+        """
+        Copies stored files to destination_stem + <extension of each stored file>
+        :return: True if artifact was found and copied; False otherwise
+        """
+        path = self.lookup(digest, name, version)
+        if not path:
+            return False
+        for entry in os.listdir(path):
+            src = os.path.join(path, entry)
+            if os.path.isdir(src):
+                shutil.copytree(src, destination_stem + entry)
+            else:
+                shutil.copy2(src, destination_stem + entry)
+        return True
+
+    def put_files(self, digest, name, version, paths):
+        """
+        Stores files (or folders) produced by an extractor
+        :param paths: dictionary where keys are extensions (e.g. '.cermxml') and values are paths to files or folders
+        """
+        staging_dir = self.new_staging_dir()
+        for ext, src in paths.items():
+            if os.path.isdir(src):
+                shutil.copytree(src, os.path.join(staging_dir, ext))
+            else:
+                shutil.copy2(src, os.path.join(staging_dir, ext))
+        self.commit(staging_dir, digest, name, version)
+
+    def evict(self):
+        """
+        Measures the whole store and, if it is larger than self.max_size, removes least recently used artifacts until it
+        is no larger than EVICTION_TARGET * self.max_size
+        :return: Number of artifacts removed
+        """
+        entries = []
+        total_size = 0
+        for prefix in os.scandir(self.cache_dir):
+            if not prefix.is_dir() or prefix.name.startswith('.'):
+                continue
+            for digest in os.scandir(prefix.path):
+                for entry in os.scandir(digest.path):
+                    size = folder_size(entry.path)
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                    total_size += size
+        removed = 0
+        target = self.max_size * EVICTION_TARGET if total_size > self.max_size else self.max_size
+        for mtime, size, path in sorted(entries):
+            if total_size <= target:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total_size -= size
+            removed += 1
+            logger.debug("Evicted artifact {} (last used {})".format(path, time.ctime(mtime)))
+        self.size = total_size
+        self.last_scan = time.time()
+        return removed
@@ -0,0 +1,413 @@
+import logging
+import os
+import queue
+import select
+import shutil
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+UTILS_FOLDER = os.path.dirname(os.path.realpath(__file__))
+
+CERMINE_JAR = "cermine-impl-1.13-jar-with-dependencies.jar"
+CERMINE_MAIN_CLASS = "pl.edu.icm.cermine.ContentExtractor"
+CERMINE_OUTPUTS = "jats,text,zones,trueviz,images"
+# file extensions of the outputs CERMINE writes next to each input PDF (.images is a folder)
+CERMINE_OUTPUT_EXTENSIONS = [".cermxml", ".cermtxt", ".cermzones", ".cermstr", ".images"]
+
+# long-lived worker (see CermineServer.java for instructions on how to compile it)
+CERMINE_SERVER_CLASS = "CermineServer"
+CERMINE_SERVER_CLASS_FILE = os.path.join(UTILS_FOLDER, CERMINE_SERVER_CLASS + ".class")
+# workers idle for longer than this (in seconds) are pinged before they are given a folder, so that a wedged JVM is
+# restarted straight away rather than after a full CERMINE timeout
+WORKER_MAX_IDLE_TIME = 60
+WORKER_PING_TIMEOUT = 30
+
+
+def cermine_folder(folder, jar=CERMINE_JAR):
+    """
+    Runs CERMINE once, in a new JVM, on all PDF files in folder
+    :param folder: Path to folder containing PDF files
+    :param jar: Path to CERMINE standalone JAR file
+    :return: True if CERMINE exited successfully; False otherwise
+    """
+    try:
+        subprocess.run(["java", "-cp", jar, CERMINE_MAIN_CLASS, "-path", folder, "-outputs",
+                        '"{}"'.format(CERMINE_OUTPUTS)],
+                       check=True)
+    except subprocess.CalledProcessError as e:
+        logger.error("return code: {}; output: {}".format(e.returncode, e.output))
+        return False
+    return True
+
+
+def find_cermine_outputs(pdf_path):
+    """
+    Lists the outputs CERMINE wrote for a PDF file
+    :param pdf_path: Path to PDF file
+    :return: dictionary where keys are extensions in CERMINE_OUTPUT_EXTENSIONS and values are paths to existing outputs
+    """
+    stem = os.path.splitext(pdf_path)[0]
+    outputs = {}
+    for ext in CERMINE_OUTPUT_EXTENSIONS:
+        if os.path.exists(stem + ext):
+            outputs[ext] = stem + ext
+    return outputs
+
+
+def copy_cermine_outputs(outputs, pdf_path):
+    """
+    Copies CERMINE outputs found by find_cermine_outputs so that they sit next to (and are named after) pdf_path, as if
+    CERMINE had been run on pdf_path itself
+    :param outputs: dictionary returned by find_cermine_outputs
+    :param pdf_path: Path to PDF file
+    """
+    stem = os.path.splitext(pdf_path)[0]
+    for ext, path in outputs.items():
+        if os.path.isdir(path):
+            shutil.copytree(path, stem + ext)
+        else:
+            shutil.copy2(path, stem + ext)
+
+
+class CermineBatch:
+    """
+    Runs CERMINE once over many PDF files staged into a single work folder, so that JVM startup is paid once per batch
+    rather than once per file
+    """
+    def __init__(self, pdf_paths, cermine_service=None, jar=CERMINE_JAR):
+        '''
+
+        :param pdf_paths: Paths to PDF files
+        :param cermine_service: CermineService instance used to run CERMINE; if None, a new JVM is launched per run
+        :param jar: Path to CERMINE standalone JAR file
+        '''
+        self.pdf_paths = pdf_paths
+        self.cermine_service = cermine_service
+        self.jar = jar
+        self.outputs = {}
+
+    def run_cermine(self, folder):
+        if self.cermine_service:
+            return self.cermine_service.process_folder(folder)
+        return cermine_folder(folder, jar=self.jar)
+
+    def run(self, work_dir):
+        """
+        Stages all PDF files into work_dir and runs CERMINE on them. If CERMINE fails to produce outputs for some files
+        (e.g. because one malformed PDF made it crash), the files without outputs are split in halves and retried
+        until each failing file has been isolated, so that a bad PDF never costs the rest of the batch its outputs.
+        :param work_dir: Folder where PDF files and CERMINE outputs are stored; it should be empty
+        :return: dictionary where keys are paths in self.pdf_paths and values are the dictionaries returned by
+            find_cermine_outputs (empty for files that CERMINE could not process)
+        """
+        staged = {}
+        for n, pdf_path in enumerate(self.pdf_paths):
+            # prefix avoids name clashes between files with the same name in different folders
+            staged_path = os.path.join(work_dir, "{:05d}-{}".format(n, os.path.basename(pdf_path)))
+            try:
+                os.link(pdf_path, staged_path)
+            except OSError:
+                shutil.copy2(pdf_path, staged_path)
+            staged[pdf_path] = staged_path
+        self.cermine_group(work_dir, list(staged.items()))
+        for pdf_path, staged_path in staged.items():
+            self.outputs[pdf_path] = find_cermine_outputs(staged_path)
+            if ".cermxml" not in self.outputs[pdf_path]:
+                logger.error("CERMINE failed to process {}".format(pdf_path))
+        return self.outputs
+
+    def cermine_group(self, folder, group):
+        """
+        Runs CERMINE on folder, then recursively retries the files in group that did not get outputs
+        :param folder: Folder containing the staged files in group (and nothing else CERMINE has not processed)
+        :param group: list of (original path, staged path) tuples
+        """
+        self.run_cermine(folder)
+        missing = [(p, s) for p, s in group if ".cermxml" not in find_cermine_outputs(s)]
+        if not missing or (len(missing) == 1 and len(group) == 1):
+            return
+        logger.warning("CERMINE produced no outputs for {} of {} files in {}; "
+                       "retrying them in smaller groups".format(len(missing), len(group), folder))
+        halves = [missing[:len(missing) // 2], missing[len(missing) // 2:]] if len(missing) > 1 else [missing]
+        for h, half in enumerate(halves):
+            subfolder = os.path.join(folder, "retry-{}".format(h))
+            os.mkdir(subfolder)
+            moved = []
+            for pdf_path, staged_path in half:
+                retry_path = os.path.join(subfolder, os.path.basename(staged_path))
+                os.replace(staged_path, retry_path)
+                moved.append((pdf_path, retry_path))
+            self.cermine_group(subfolder, moved)
+            # move files back so callers find outputs where they staged the input
+            for (pdf_path, staged_path), (_, retry_path) in zip(half, moved):
+                os.replace(retry_path, staged_path)
+                for ext, path in find_cermine_outputs(retry_path).items():
+                    os.replace(path, os.path.splitext(staged_path)[0] + ext)
+
+
+class LazyCermineBatch:
+    """
+    Runs CERMINE once over the files requested by detections running concurrently on threads, as soon as every
+    detection still running has either requested CERMINE or finished. Files whose verdict is settled without CERMINE
+    (e.g. by the result cache or by early exit) are never staged.
+    """
+    def __init__(self, work_dir, cermine_service=None, jar=CERMINE_JAR):
+        '''
+
+        :param work_dir: Folder where files are staged for CERMINE; each run uses a new subfolder
+        :param cermine_service: CermineService instance used to run CERMINE; if None, a new JVM is launched per run
+        :param jar: Path to CERMINE standalone JAR file
+        '''
+        self.work_dir = work_dir
+        self.cermine_service = cermine_service
+        self.jar = jar
+        self.condition = threading.Condition()
+        self.active = 0  # detections running that are not waiting for CERMINE
+        self.requested = []
+        self.outputs = {}
+        self.runs = 0
+
+    def register(self):
+        """
+        Declares a detection that may request CERMINE; it must call finish once done
+        """
+        with self.condition:
+            self.active += 1
+
+    def finish(self):
+        with self.condition:
+            self.active -= 1
+            self.run_if_ready()
+
+    def request(self, pdf_path):
+        """
+        Waits until CERMINE has run on pdf_path, together with the files requested by other detections
+        :return: dictionary returned by find_cermine_outputs (empty if CERMINE could not process the file), or None if
+            the run failed altogether
+        """
+        with self.condition:
+            if pdf_path in self.outputs:
+                return self.outputs[pdf_path]
+            self.requested.append(pdf_path)
+            self.active -= 1
+            self.run_if_ready()
+            while pdf_path not in self.outputs:
+                self.condition.wait()
+            self.active += 1
+            return self.outputs[pdf_path]
+
+    def run_if_ready(self):
+        # called with self.condition held; no detection is running when active is 0, so holding it blocks nothing
+        if self.active or not self.requested:
+            return
+        pdf_paths, self.requested = self.requested, []
+        folder = os.path.join(self.work_dir, "run-{}".format(self.runs))
+        self.runs += 1
+        os.mkdir(folder)
+        logger.debug("Running CERMINE on {} requested files".format(len(pdf_paths)))
+        try:
+            outputs = CermineBatch(pdf_paths, cermine_service=self.cermine_service, jar=self.jar).run(folder)
+        except Exception:
+            logger.exception("CERMINE run over {} files failed".format(len(pdf_paths)))
+            outputs = dict.fromkeys(pdf_paths)
+        for pdf_path in pdf_paths:
+            self.outputs[pdf_path] = outputs.get(pdf_path, {})
+        self.condition.notify_all()
+
+
+class CermineWorker:
+    """
+    A single JVM running CermineServer, which receives folder paths on stdin and runs CERMINE on them without
+    paying JVM startup and model loading costs for every PDF
+    """
+    def __init__(self, jar=CERMINE_JAR, timeout=600):
+        '''
+
+        :param jar: Path to CERMINE standalone JAR file
+        :param timeout: Maximum number of seconds to wait for CERMINE to process a folder
+        '''
+        self.jar = jar
+        self.timeout = timeout
+        self.process = None
+        self.last_reply = None  # time.monotonic() of the last reply from the worker (or of its start)
+
+    def start(self):
+        classpath = os.pathsep.join([self.jar, UTILS_FOLDER])
+        self.process = subprocess.Popen(["java", "-cp", classpath, CERMINE_SERVER_CLASS, CERMINE_OUTPUTS],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True,
+                                        bufsize=1)
+        self.last_reply = time.monotonic()
+        logger.debug("Started CERMINE worker with pid {}".format(self.process.pid))
+
+    def stop(self):
+        if self.process:
+            if self.is_alive():
+                self.process.stdin.close()
+                try:
+                    self.process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                    self.process.wait()
+            self.process = None
+
+    def restart(self):
+        logger.warning("Restarting CERMINE worker")
+        self.stop()
+        self.start()
+
+    def is_alive(self):
+        return bool(self.process) and self.process.poll() is None
+
+    def send(self, command, timeout):
+        """
+        Sends a command to the worker and waits for its reply
+        :param command: Line to write to the worker's stdin
+        :param timeout: Maximum number of seconds to wait for a reply
+        :return: Reply (string) or None if the worker died or timed out
+        """
+        try:
+            self.process.stdin.write(command + "\n")
+            self.process.stdin.flush()
+            ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+            if not ready:
+                logger.error("CERMINE worker did not reply to '{}' within {} seconds".format(command, timeout))
+                self.process.kill()
+                return None
+            reply = self.process.stdout.readline()
+        except (BrokenPipeError, OSError, ValueError) as e:
+            logger.error("Communication with CERMINE worker failed: {}".format(e))
+            return None
+        if not reply:
+            logger.error("CERMINE worker exited with return code {}".format(self.process.poll()))
+            return None
+        self.last_reply = time.monotonic()
+        return reply.strip()
+
+    def idle_time(self):
+        """
+        :return: number of seconds since the worker last replied
+        """
+        return time.monotonic() - self.last_reply if self.last_reply is not None else float('inf')
+
+    def health_check(self, timeout=WORKER_PING_TIMEOUT):
+        """
+        Tests if worker is alive and responsive
+        :return: True if worker replied to PING; False otherwise
+        """
+        return self.is_alive() and (self.send("PING", timeout) == "PONG")
+
+    def process_folder(self, folder):
+        """
+        Runs CERMINE on all PDF files in folder
+        :param folder: Path to folder containing PDF files
+        :return: True if CERMINE succeeded, False if it reported an error, None if the worker crashed
+        """
+        reply = self.send(os.path.abspath(folder), self.timeout)
+        if reply is None:
+            return None
+        if reply == "OK":
+            return True
+        logger.error("CERMINE worker failed to process {}: {}".format(folder, reply))
+        return False
+
+
+class CermineService:
+    """
+    Pool of long-lived CERMINE workers, restarted automatically when they crash or stop responding
+    """
+    def __init__(self, jvms=1, jar=CERMINE_JAR, timeout=600):
+        '''
+
+        :param jvms: Number of CERMINE workers (JVMs) to keep running
+        :param jar: Path to CERMINE standalone JAR file
+        :param timeout: Maximum number of seconds to wait for CERMINE to process a folder
+        '''
+        self.jvms = jvms
+        self.jar = jar
+        self.timeout = timeout
+        self.workers = []
+        self.idle_workers = queue.Queue()
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @staticmethod
+    def available():
+        """
+        Tests if CermineServer has been compiled
+        """
+        if not os.path.exists(CERMINE_SERVER_CLASS_FILE):
+            logger.warning("{} not found; CERMINE workers unavailable".format(CERMINE_SERVER_CLASS_FILE))
+            return False
+        return True
+
+    def start(self):
+        with self.lock:
+            for _ in range(self.jvms - len(self.workers)):
+                worker = CermineWorker(jar=self.jar, timeout=self.timeout)
+                worker.start()
+                self.workers.append(worker)
+                self.idle_workers.put(worker)
+        logger.info("Started {} CERMINE worker(s)".format(self.jvms))
+
+    def stop(self):
+        with self.lock:
+            for worker in self.workers:
+                worker.stop()
+            self.workers = []
+            self.idle_workers = queue.Queue()
+
+    def health_check(self):
+        """
+        Checks all idle workers, restarting any that do not respond
+        :return: Number of healthy workers
+        """
+        checked = []
+        healthy = 0
+        while True:
+            try:
+                worker = self.idle_workers.get_nowait()
+            except queue.Empty:
+                break
+            if worker.health_check():
+                healthy += 1
+            else:
+                worker.restart()
+            checked.append(worker)
+        for worker in checked:
+            self.idle_workers.put(worker)
+        return healthy
+
+    def process_folder(self, folder):
+        """
+        Runs CERMINE on all PDF files in folder using the next idle worker; if the worker crashes, it is restarted and
+        the folder is submitted once more. Workers that have been idle for longer than WORKER_MAX_IDLE_TIME are pinged
+        first, and restarted if they do not reply.
+        :param folder: Path to folder containing PDF files
+        :return: True if CERMINE succeeded; False otherwise
+        """
+        worker = self.idle_workers.get()
+        try:
+            for attempt in range(2):
+                if not worker.is_alive():
+                    worker.restart()
+                elif worker.idle_time() > WORKER_MAX_IDLE_TIME:
+                    idle_time = worker.idle_time()
+                    if not worker.health_check():
+                        logger.warning("CERMINE worker did not reply to ping after {:.0f} seconds idle".format(
+                            idle_time))
+                        worker.restart()
+                outcome = worker.process_folder(folder)
+                if outcome is not None:
+                    return outcome
+            return False
+        finally:
+            self.idle_workers.put(worker)
@@ -0,0 +1,162 @@
+import datetime
+import logging
+import posixpath
+import xml.etree.ElementTree as ET
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+W_NAMESPACE = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+RELATIONSHIPS_NAMESPACE = 'http://schemas.openxmlformats.org/package/2006/relationships'
+OFFICE_DOCUMENT_RELATIONSHIP = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+CORE_PROPERTIES_RELATIONSHIP = \
+    'http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties'
+DEFAULT_DOCUMENT_PART = 'word/document.xml'
+DEFAULT_CORE_PROPERTIES_PART = 'docProps/core.xml'
+
+# core properties, keyed as by python-docx, and their elements in the core properties part
+CORE_PROPERTIES = {
+    'author': '{http://purl.org/dc/elements/1.1/}creator',
+    'created': '{http://purl.org/dc/terms/}created',
+    'last_modified_by': '{http://schemas.openxmlformats.org/package/2006/metadata/core-properties}lastModifiedBy',
+    'last_printed': '{http://schemas.openxmlformats.org/package/2006/metadata/core-properties}lastPrinted',
+    'modified': '{http://purl.org/dc/terms/}modified',
+    'revision': '{http://schemas.openxmlformats.org/package/2006/metadata/core-properties}revision',
+    'title': '{http://purl.org/dc/elements/1.1/}title',
+    'category': '{http://schemas.openxmlformats.org/package/2006/metadata/core-properties}category',
+    'comments': '{http://purl.org/dc/elements/1.1/}description',
+    'identifier': '{http://purl.org/dc/elements/1.1/}identifier',
+    'keywords': '{http://schemas.openxmlformats.org/package/2006/metadata/core-properties}keywords',
+    'language': '{http://purl.org/dc/elements/1.1/}language',
+    'subject': '{http://purl.org/dc/elements/1.1/}subject',
+    'version': '{http://schemas.openxmlformats.org/package/2006/metadata/core-properties}version',
+    'content_status': '{http://schemas.openxmlformats.org/package/2006/metadata/core-properties}contentStatus',
+}
+DATE_PROPERTIES = ['created', 'last_printed', 'modified']
+
+# text output for elements of the main document part, as in docx2txt
+PARAGRAPH_TAG = '{%s}p' % W_NAMESPACE
+TEXT_TAG = '{%s}t' % W_NAMESPACE
+START_TAG_TEXT = {
+    PARAGRAPH_TAG: '\n\n',
+    '{%s}tab' % W_NAMESPACE: '\t',
+    '{%s}br' % W_NAMESPACE: '\n',
+    '{%s}cr' % W_NAMESPACE: '\n',
+}
+
+
+def parse_datetime(value):
+    """
+    Parses a W3CDTF date, as python-docx does
+    :return: naive datetime in UTC, or None if value could not be parsed
+    """
+    value = value.strip()
+    try:
+        dt = datetime.datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    except ValueError:
+        for date_format in ('%Y-%m', '%Y'):
+            try:
+                return datetime.datetime.strptime(value, date_format)
+            except ValueError:
+                continue
+        logger.debug("Could not parse date {}".format(value))
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def package_parts(package):
+    """
+    Finds the main document and core properties parts from the package relationships
+    :param package: zipfile.ZipFile instance
+    :return: tuple (name of main document part, name of core properties part)
+    """
+    document_part = DEFAULT_DOCUMENT_PART
+    core_part = DEFAULT_CORE_PROPERTIES_PART
+    try:
+        with package.open('_rels/.rels') as f:
+            relationships = ET.parse(f).getroot()
+    except (KeyError, ET.ParseError):
+        return document_part, core_part
+    for r in relationships.iter('{%s}Relationship' % RELATIONSHIPS_NAMESPACE):
+        target = posixpath.normpath(r.get('Target', '')).lstrip('/')
+        if r.get('Type') == OFFICE_DOCUMENT_RELATIONSHIP:
+            document_part = target
+        elif r.get('Type') == CORE_PROPERTIES_RELATIONSHIP:
+            core_part = target
+    return document_part, core_part
+
+
+def read_core_properties(package, part_name=DEFAULT_CORE_PROPERTIES_PART):
+    """
+    :return: dictionary of core properties with the same keys and value types as python-docx's CoreProperties: strings
+        ('' if missing), datetimes (None if missing) and revision, an integer (0 if missing)
+    """
+    properties = {k: None if k in DATE_PROPERTIES else '' for k in CORE_PROPERTIES}
+    properties['revision'] = 0
+    try:
+        with package.open(part_name) as f:
+            root = ET.parse(f).getroot()
+    except (KeyError, ET.ParseError) as e:
+        logger.debug("Could not read core properties: {}".format(e))
+        return properties
+    for key, tag in CORE_PROPERTIES.items():
+        element = root.find(tag)
+        if (element is None) or not element.text:
+            continue
+        if key in DATE_PROPERTIES:
+            properties[key] = parse_datetime(element.text)
+        elif key == 'revision':
+            try:
+                properties[key] = max(int(element.text), 0)
+            except ValueError:
+                pass
+        else:
+            properties[key] = element.text
+    return properties
+
+
+def read_document_text(package, part_name=DEFAULT_DOCUMENT_PART, max_chars=None):
+    """
+    Extracts the text of the main document part with iterparse, discarding each paragraph once read, so memory use
+    does not grow with the size of the document; headers, footers and images are not read
+    :param max_chars: Stop after the paragraph in which the text reaches this number of characters; if None, read all
+    :return: tuple (text, True if reading stopped before the end of the document)
+    """
+    pieces = []
+    length = 0
+    with package.open(part_name) as f:
+        for event, element in ET.iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                text = START_TAG_TEXT.get(element.tag)
+            elif element.tag == TEXT_TAG:
+                text = element.text
+            else:
+                if element.tag == PARAGRAPH_TAG:
+                    element.clear()
+                    if max_chars and (length >= max_chars):
+                        return ''.join(pieces).strip(), True
+                continue
+            if text:
+                pieces.append(text)
+                length += len(text)
+    return ''.join(pieces).strip(), False
+
+
+def read_docx(docx_path, max_chars=None, text=True):
+    """
+    Reads the core properties and text of a DOCX file, opening the package once
+    :param docx_path: Path to DOCX file
+    :param max_chars: Maximum number of characters of text needed (see read_document_text)
+    :param text: If False, only read core properties (e.g. because the text is already known)
+    :return: dictionary with keys 'core_properties', 'text' and 'truncated' (None if text was not read)
+    """
+    with zipfile.ZipFile(docx_path) as package:
+        document_part, core_part = package_parts(package)
+        core_properties = read_core_properties(package, core_part)
+        if text:
+            document_text, truncated = read_document_text(package, document_part, max_chars=max_chars)
+        else:
+            document_text, truncated = None, None
+    return {'core_properties': core_properties, 'text': document_text, 'truncated': truncated}
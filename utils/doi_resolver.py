@@ -0,0 +1,143 @@
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+DOI_BASE_URL = "https://doi.org/"
+DEFAULT_TIMEOUT = (3.05, 10)  # seconds to connect, seconds to wait for response
+DEFAULT_POSITIVE_TTL = 30 * 24 * 3600  # seconds
+DEFAULT_NEGATIVE_TTL = 24 * 3600  # seconds
+DEFAULT_MAX_WORKERS = 8
+
+
+class DOIResolver:
+    """
+    Tests if DOIs are registered by sending HEAD requests to the DOI proxy without following redirects, so that slow
+    publisher landing pages are never fetched. Requests share a pooled session with strict timeouts; outcomes are
+    optionally cached in SQLite, with separate expiry times for DOIs that resolve (positive) and DOIs that do not
+    (negative).
+    """
+    def __init__(self, base_url=DOI_BASE_URL, cache_path=None, positive_ttl=DEFAULT_POSITIVE_TTL,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL, timeout=DEFAULT_TIMEOUT, max_workers=DEFAULT_MAX_WORKERS):
+        '''
+
+        :param base_url: URL of DOI proxy, to which DOIs are appended (e.g. the URL of a local stub server in tests)
+        :param cache_path: Path to SQLite database where outcomes are cached; if None, nothing is cached
+        :param positive_ttl: Number of seconds for which a DOI that resolved is not checked again
+        :param negative_ttl: Number of seconds for which a DOI that did not resolve is not checked again
+        :param timeout: Request timeout in seconds, or (connect, read) tuple
+        :param max_workers: Maximum number of concurrent requests made by resolve_many
+        '''
+        self.base_url = base_url
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = 'Mozilla/5.0'
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers,
+                              max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504],
+                                                allowed_methods=['HEAD']))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.lock = threading.Lock()
+        self.connection = None
+        if cache_path:
+            self.connection = sqlite3.connect(cache_path, timeout=60, check_same_thread=False)
+            with self.connection:
+                self.connection.execute("CREATE TABLE IF NOT EXISTS dois (doi TEXT PRIMARY KEY, resolves INTEGER NOT "
+                                        "NULL, checked REAL NOT NULL)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def normalise(doi):
+        # DOIs are case insensitive
+        return doi.strip().lower()
+
+    def cached(self, doi):
+        """
+        :return: True or False if the outcome of a previous check of doi has not expired; None otherwise
+        """
+        if not self.connection:
+            return None
+        with self.lock:
+            row = self.connection.execute("SELECT resolves, checked FROM dois WHERE doi = ?",
+                                          (self.normalise(doi),)).fetchone()
+        if not row:
+            return None
+        resolves, checked = bool(row[0]), row[1]
+        ttl = self.positive_ttl if resolves else self.negative_ttl
+        if time.time() - checked > ttl:
+            return None
+        return resolves
+
+    def store(self, doi, resolves):
+        if not self.connection:
+            return
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO dois (doi, resolves, checked) VALUES (?, ?, ?)",
+                                    (self.normalise(doi), int(resolves), time.time()))
+
+    def request(self, doi):
+        """
+        Asks the DOI proxy about doi
+        :return: True if the proxy redirects to the DOI's target; False if it does not know the DOI; None if the
+            outcome is unknown (timeout, network or server error)
+        """
+        url = self.base_url + quote(doi.strip(), safe="/:;()")
+        try:
+            r = self.session.head(url, allow_redirects=False, timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.warning("Could not check DOI {}: {}".format(doi, e))
+            return None
+        logger.debug("DOI {}: status code {}; location {}".format(doi, r.status_code, r.headers.get('Location')))
+        if r.status_code < 400:
+            return True
+        if r.status_code in (404, 410):
+            return False
+        logger.warning("Could not check DOI {}: status code {}".format(doi, r.status_code))
+        return None
+
+    def resolve(self, doi):
+        """
+        Tests if doi resolves, using the cache when possible
+        :return: True if doi resolves; False if it does not; None if this could not be determined
+        """
+        resolves = self.cached(doi)
+        if resolves is not None:
+            logger.debug("Cached outcome for DOI {}: {}".format(doi, resolves))
+            return resolves
+        resolves = self.request(doi)
+        if resolves is not None:
+            self.store(doi, resolves)
+        return resolves
+
+    def resolve_many(self, dois):
+        """
+        Tests if many DOIs resolve, sending up to self.max_workers requests at a time
+        :return: dictionary where keys are DOIs and values are the return values of resolve
+        """
+        dois = list(dict.fromkeys(dois))
+        if not dois:
+            return {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(dois, executor.map(self.resolve, dois)))
+
+    def close(self):
+        self.session.close()
+        if self.connection:
+            self.connection.close()
+            self.connection = None
@@ -1,3 +1,4 @@
+import glob
 import imghdr
 import json
 import logging
@@ -5,8 +6,10 @@ import logging.config
 import os
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import imagehash
+import numpy as np
 import pytesseract
 import shelve
 
@@ -18,6 +21,26 @@ logger = logging.getLogger(__name__)
 
 SHELVE_DB_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "logos_db.shelve")
 LOGOS_LIBRARY = os.path.join(PARENT_FOLDER, "publisher_logos")
+# compact logos database (see LogoIndex.save): <LOGOS_INDEX_PATH>.npy and <LOGOS_INDEX_PATH>.json
+LOGOS_INDEX_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "logos_index")
+
+# number of set bits in each byte value, used to count differing bits between packed hashes
+POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+# row of the compact logos database; hashes are 64-bit ImageHash values packed by hash_to_int
+INDEX_DTYPE = np.dtype([('average_hash', '<u8'), ('perception_hash', '<u8'), ('width', '<u4'), ('height', '<u4')])
+# images are decoded at reduced resolution (when the format supports it, e.g. JPEG) before hashing; hashes are computed
+# from 8x8 (average) and 32x32 (perception) thumbnails, so nothing is lost
+HASH_DRAFT_SIZE = (64, 64)
+# extracted images whose aspect ratio differs from that of every logo by more than this fraction are not hashed; their
+# size is not checked, as logos may be embedded at any resolution
+ASPECT_RATIO_TOLERANCE = 0.25
+# sliding windows over rendered header strips: heights (as fractions of the strip height), horizontal step (as a
+# fraction of the window width) and aspect ratios tried when the size of logos is unknown
+STRIP_WINDOW_HEIGHTS = (1.0, 0.6, 0.35)
+STRIP_WINDOW_STEP = 0.25
+DEFAULT_ASPECT_RATIOS = (1.0, 2.0, 3.0, 4.0)
+# libraries with more logos than this are searched with a BK-tree rather than compared to every logo
+BK_TREE_MIN_SIZE = 20000
 
 class PublisherLogo:
     def __init__(self, name, width=None, height=None, text=None, publisher=None,
@@ -38,7 +61,11 @@ class PublisherLogo:
     def __repr__(self):
         return "PublisherLogo object: <name={}>".format(self.name)
 
-    def store_in_db(self):
+    def store_in_db(self, db=None):
+        """
+        Stores this logo in the shelve logos database
+        :param db: open shelve; if None, the database is opened (and closed) by this method
+        """
         if not self.width:
             self.calculate_image_size()
         if not self.text:
@@ -47,6 +74,9 @@ class PublisherLogo:
             self.calculate_average_hash()
         if not self.perception_hash:
             self.calculate_perception_hash()
+        if db is not None:
+            db[self.name] = self
+            return
         with shelve.open(SHELVE_DB_PATH) as db:
             db[self.name] = self
 
@@ -60,13 +90,15 @@ class PublisherLogo:
     def calculate_average_hash(self):
         if not self.path:
             sys.exit("ERROR: {} does not contain the path to an example of this logo.".format(self.path))
-        self.average_hash = imagehash.average_hash(Image.open(self.path))
+        with Image.open(self.path) as im:
+            self.average_hash = imagehash.average_hash(im)
         return self.average_hash
 
     def calculate_perception_hash(self):
         if not self.path:
             sys.exit("ERROR: {} does not contain the path to an example of this logo.".format(self.path))
-        self.perception_hash = imagehash.phash(Image.open(self.path))
+        with Image.open(self.path) as im:
+            self.perception_hash = imagehash.phash(im)
         return self.perception_hash
 
     def test_hash_match(self, pl_instance, method="average", max_hash_difference=5):
@@ -119,17 +151,356 @@ class PublisherLogo:
         return False
 
 
+def hash_image(path, size_filter=None):
+    """
+    Computes the average and perception hashes of an image from a single, reduced resolution decode
+    :param path: Path to image file
+    :param size_filter: Function taking the width and height of the image and returning False if the image cannot be
+        a logo; only the image header is read for images it rejects
+    :return: dictionary with keys width, height, average_hash and perception_hash (ImageHash instances), or None if
+        image was rejected by size_filter or could not be read
+    """
+    try:
+        with Image.open(path) as im:
+            width, height = im.size
+            if size_filter and not size_filter(width, height):
+                logger.debug("Skipped image {} ({}x{}), which cannot be a logo".format(path, width, height))
+                return None
+            im.draft('L', HASH_DRAFT_SIZE)
+            grey = im.convert('L')
+    except OSError as e:
+        logger.warning("Could not read image {}: {}".format(path, e))
+        return None
+    return {'width': width, 'height': height, 'average_hash': imagehash.average_hash(grey),
+            'perception_hash': imagehash.phash(grey)}
+
+
+def hash_images(paths, size_filter=None, max_workers=None):
+    """
+    Hashes images in a thread pool (PIL releases the GIL while decoding)
+    :param paths: Paths to image files
+    :param size_filter: See hash_image
+    :param max_workers: Maximum number of threads; by default, the ThreadPoolExecutor default
+    :return: dictionary where keys are paths and values are the return values of hash_image
+    """
+    if not paths:
+        return {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(paths, executor.map(lambda p: hash_image(p, size_filter=size_filter), paths)))
+
+
+def strip_windows(width, height, aspect_ratios, heights=STRIP_WINDOW_HEIGHTS, step=STRIP_WINDOW_STEP):
+    """
+    Lists the windows slid over a rendered header strip
+    :param width: Width of strip in pixels
+    :param height: Height of strip in pixels
+    :param aspect_ratios: Width/height ratios of windows
+    :return: list of (left, top, right, bottom) boxes
+    """
+    boxes = []
+    for h_fraction in heights:
+        window_height = int(height * h_fraction)
+        if window_height < 8:
+            continue
+        for ratio in aspect_ratios:
+            window_width = min(int(window_height * ratio), width)
+            if window_width < 8:
+                continue
+            x_step = max(int(window_width * step), 1)
+            y_step = max(int(window_height * step), 1)
+            for top in range(0, height - window_height + 1, y_step):
+                for left in range(0, width - window_width + 1, x_step):
+                    boxes.append((left, top, left + window_width, top + window_height))
+    return boxes
+
+
+def hash_to_int(image_hash):
+    """
+    Packs an ImageHash (64 bits for the default hash size) into an integer
+    """
+    return int.from_bytes(np.packbits(image_hash.hash.flatten()).tobytes(), 'big')
+
+
+def hamming_distances(hashes, references):
+    """
+    Counts differing bits between every pair of packed hashes
+    :param hashes: numpy uint64 array of shape (n,)
+    :param references: numpy uint64 array of shape (m,)
+    :return: numpy array of shape (n, m)
+    """
+    xor = np.bitwise_xor(hashes[:, np.newaxis], references[np.newaxis, :])
+    return POPCOUNT_TABLE[xor.view(np.uint8)].reshape(xor.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree of integer hashes under Hamming distance, which finds all hashes within a given distance of a
+    query without comparing it to every hash in the tree
+    """
+    def __init__(self):
+        self.root = None  # node: [hash, list of item indices, dictionary of children by distance]
+
+    @staticmethod
+    def distance(a, b):
+        return bin(a ^ b).count('1')
+
+    def add(self, h, index):
+        if self.root is None:
+            self.root = [h, [index], {}]
+            return
+        node = self.root
+        while True:
+            d = self.distance(h, node[0])
+            if d == 0:
+                node[1].append(index)
+                return
+            if d not in node[2]:
+                node[2][d] = [h, [index], {}]
+                return
+            node = node[2][d]
+
+    def search(self, h, max_distance):
+        """
+        :return: list of (distance, index) tuples for all hashes within max_distance of h
+        """
+        results = []
+        nodes = [self.root] if self.root else []
+        while nodes:
+            node = nodes.pop()
+            d = self.distance(h, node[0])
+            if d <= max_distance:
+                results.extend((d, i) for i in node[1])
+            for child_distance, child in node[2].items():
+                if d - max_distance <= child_distance <= d + max_distance:
+                    nodes.append(child)
+        return results
+
+
+class LogoIndex:
+    """
+    Average and perception hashes of all logos in the logos database, packed into uint64 numpy arrays so that the
+    hashes of all images extracted from a file are compared to all logos in one vectorised operation.
+
+    The index can be saved in a compact format (see save) made of a fixed-width table of hashes and image sizes
+    (<path>.npy), which is memory-mapped so that all worker processes share a single read-only copy, and a JSON side
+    table with the remaining attributes of each logo (<path>.json). PublisherLogo instances are only built for logos
+    that match.
+    """
+    def __init__(self, table, records):
+        """
+
+        :param table: numpy structured array of dtype INDEX_DTYPE (possibly memory-mapped), one row per logo
+        :param records: list of dictionaries of PublisherLogo arguments other than hashes and size, one per row of table
+        """
+        self.table = table
+        self.records = records
+        self.average_hashes = table['average_hash']
+        self.perception_hashes = table['perception_hash']
+        self.built_logos = {}
+        self.bk_tree = None
+        if len(self) > BK_TREE_MIN_SIZE:
+            self.bk_tree = BKTree()
+            for i, h in enumerate(self.average_hashes.tolist()):
+                self.bk_tree.add(h, i)
+
+    def __len__(self):
+        return len(self.records)
+
+    @classmethod
+    def from_logos(cls, logos):
+        """
+        :param logos: list of PublisherLogo instances with average_hash and perception_hash set
+        """
+        hashed = [l for l in logos if l.average_hash and l.perception_hash]
+        if len(hashed) < len(logos):
+            logger.warning("Ignored {} logos without hashes".format(len(logos) - len(hashed)))
+        table = np.zeros(len(hashed), dtype=INDEX_DTYPE)
+        records = []
+        for i, l in enumerate(hashed):
+            table[i] = (hash_to_int(l.average_hash), hash_to_int(l.perception_hash), l.width or 0, l.height or 0)
+            records.append({'name': l.name, 'text': l.text, 'publisher': l.publisher, 'path': l.path, **l.metadata})
+        return cls(table, records)
+
+    @classmethod
+    def from_shelve(cls, db_path=SHELVE_DB_PATH):
+        with shelve.open(db_path, flag='r') as db:
+            logos = [db[key] for key in db]
+        return cls.from_logos(logos)
+
+    @classmethod
+    def load(cls, index_path=LOGOS_INDEX_PATH):
+        """
+        Loads an index saved by save, memory-mapping its table of hashes
+        """
+        table = np.load(index_path + ".npy", mmap_mode='r')
+        with open(index_path + ".json", encoding='utf-8') as f:
+            records = json.load(f)
+        if len(records) != len(table):
+            raise ValueError("{}.npy and {}.json describe a different number of logos".format(index_path, index_path))
+        return cls(table, records)
+
+    def save(self, index_path=LOGOS_INDEX_PATH):
+        """
+        Saves index in compact format; files are written under temporary names and then renamed, so that processes
+        loading the index never see a partially written file
+        """
+        np.save(index_path + ".tmp.npy", np.asarray(self.table))
+        with open(index_path + ".tmp.json", 'w', encoding='utf-8') as f:
+            json.dump(self.records, f, indent=1, default=str)
+        os.replace(index_path + ".tmp.npy", index_path + ".npy")
+        os.replace(index_path + ".tmp.json", index_path + ".json")
+
+    def plausible_size(self, width, height):
+        """
+        Tests if an image of the given size could be one of the logos in this index
+        :return: False if the aspect ratio of image matches no logo; True otherwise (including when the size of some
+            logo is unknown)
+        """
+        widths = self.table['width'].astype(np.float64)
+        heights = self.table['height'].astype(np.float64)
+        if not len(self) or not (widths > 0).all() or not (heights > 0).all() or not (width and height):
+            return True
+        ratios = widths / heights
+        return bool((np.abs(ratios - width / height) <= ASPECT_RATIO_TOLERANCE * ratios).any())
+
+    def aspect_ratios(self, resolution=0.25):
+        """
+        :param resolution: Ratios are rounded to multiples of this value
+        :return: sorted list of distinct aspect ratios (width/height) of logos, or DEFAULT_ASPECT_RATIOS if none is known
+        """
+        widths = self.table['width'].astype(np.float64)
+        heights = self.table['height'].astype(np.float64)
+        sized = (widths > 0) & (heights > 0)
+        if not sized.any():
+            return list(DEFAULT_ASPECT_RATIOS)
+        ratios = np.maximum(np.round(widths[sized] / heights[sized] / resolution), 1) * resolution
+        return sorted(set(ratios.tolist()))
+
+    def match_strip(self, strip_path, max_hash_difference=5):
+        """
+        Slides windows shaped like the logos in this index over a rendered header strip (see
+        utils.pdf_images.render_header_strip) and matches the average hash of every window against all logos at once
+        :param strip_path: Path to image of strip
+        :param max_hash_difference: the maximum difference in hash values we are prepared to consider as a match
+        :return: list of matching PublisherLogo instances (without duplicates)
+        """
+        with Image.open(strip_path) as im:
+            strip = im.convert('L')
+        boxes = strip_windows(strip.width, strip.height, self.aspect_ratios())
+        hashes = [imagehash.average_hash(strip.crop(box)) for box in boxes]
+        logger.debug("Hashed {} windows of {}".format(len(hashes), strip_path))
+        detected = []
+        for box, logos in zip(boxes, self.match(hashes, max_hash_difference=max_hash_difference)):
+            for logo in logos:
+                if logo not in detected:
+                    logger.debug("Window {} of {} matched logo {}".format(box, strip_path, logo.name))
+                    detected.append(logo)
+        return detected
+
+    def logo(self, i):
+        """
+        :return: PublisherLogo instance for row i of the index
+        """
+        if i not in self.built_logos:
+            row = self.table[i]
+            self.built_logos[i] = PublisherLogo(
+                width=int(row['width']) or None, height=int(row['height']) or None,
+                average_hash=imagehash.hex_to_hash(format(int(row['average_hash']), '016x')),
+                perception_hash=imagehash.hex_to_hash(format(int(row['perception_hash']), '016x')),
+                **self.records[i])
+        return self.built_logos[i]
+
+    def distances(self, image_hashes, method="average"):
+        """
+        :param image_hashes: list of ImageHash instances
+        :param method: the hashing method to compare; supported values: average, perception
+        :return: numpy array where element (i, j) is the distance between image_hashes[i] and logo j
+        """
+        references = self.average_hashes if method == "average" else self.perception_hashes
+        hashes = np.array([hash_to_int(h) for h in image_hashes], dtype=np.uint64)
+        return hamming_distances(hashes, references)
+
+    def match(self, average_hashes, perception_hashes=None, max_hash_difference=5):
+        """
+        Finds logos matching each image, as PublisherLogo.test_hash_match with the average method would
+        :param average_hashes: list of average hashes (ImageHash instances) of extracted images
+        :param perception_hashes: list of perception hashes of the same images; only used for logging
+        :param max_hash_difference: the maximum difference in hash values we are prepared to consider as a match
+        :return: list with one list of matching PublisherLogo instances (in database order) per image
+        """
+        if not len(self) or not average_hashes:
+            return [[] for _ in average_hashes]
+        matches = []
+        if self.bk_tree:
+            for h in average_hashes:
+                found = sorted(i for d, i in self.bk_tree.search(hash_to_int(h), max_hash_difference))
+                matches.append([self.logo(i) for i in found])
+        else:
+            distances = self.distances(average_hashes)
+            for row in distances:
+                matches.append([self.logo(int(i)) for i in np.flatnonzero(row <= max_hash_difference)])
+        if perception_hashes and logger.isEnabledFor(logging.DEBUG):
+            for i, row in enumerate(self.distances(perception_hashes, method="perception")):
+                logger.debug("Closest logo by perception hash to image {}: {} (difference {})".format(
+                    i, self.records[int(row.argmin())]['name'], int(row.min())))
+        return matches
+
+
+# LogoIndex instances already loaded by this process, keyed by path
+loaded_logo_indexes = {}
+
+
+def load_logo_index(index_path=LOGOS_INDEX_PATH, db_path=SHELVE_DB_PATH):
+    """
+    Loads the logos database into a LogoIndex once per process, from the compact index if it exists or from the
+    shelve otherwise; the index is reloaded if its files are modified
+    """
+    if os.path.exists(index_path + ".npy"):
+        path, loader = index_path, LogoIndex.load
+    else:
+        logger.info("{}.npy not found; loading logos from {} (run 'python utils/logos.py convert' to build a compact "
+                    "index)".format(index_path, db_path))
+        path, loader = db_path, LogoIndex.from_shelve
+    mtime = max((os.path.getmtime(f) for f in glob.glob(path + "*")), default=None)
+    cached = loaded_logo_indexes.get(path)
+    if cached and (cached[0] == mtime):
+        return cached[1]
+    index = loader(path)
+    logger.debug("Loaded {} logos from {}".format(len(index), path))
+    loaded_logo_indexes[path] = (mtime, index)
+    return index
+
+
+def convert_shelve(db_path=SHELVE_DB_PATH, index_path=LOGOS_INDEX_PATH):
+    """
+    Converts the shelve logos database into the compact index format
+    :return: LogoIndex instance
+    """
+    index = LogoIndex.from_shelve(db_path)
+    index.save(index_path)
+    logger.info("Converted {} logos from {} to {}".format(len(index), db_path, index_path))
+    return index
+
+
 def update_logos_db():
-    for filename in os.listdir(LOGOS_LIBRARY):
-        file_path = os.path.join(LOGOS_LIBRARY, filename)
-        if imghdr.what(file_path):
-            json_filename = filename.split('.')[0] + '.json'
-            with open(os.path.join(LOGOS_LIBRARY,json_filename)) as f:
-                metadata = json.load(f)
-            pl = PublisherLogo(filename, path=file_path, **metadata)
-            pl.store_in_db()
-            logger.info("Added logo {} to shelve database".format(pl.name))
+    """
+    Adds all logos in LOGOS_LIBRARY to the shelve logos database, then rebuilds the compact index from it
+    """
+    with shelve.open(SHELVE_DB_PATH) as db:
+        for filename in os.listdir(LOGOS_LIBRARY):
+            file_path = os.path.join(LOGOS_LIBRARY, filename)
+            if imghdr.what(file_path):
+                json_filename = filename.split('.')[0] + '.json'
+                with open(os.path.join(LOGOS_LIBRARY,json_filename)) as f:
+                    metadata = json.load(f)
+                pl = PublisherLogo(filename, path=file_path, **metadata)
+                pl.store_in_db(db)
+                logger.info("Added logo {} to shelve database".format(pl.name))
+    convert_shelve()
 
 
 if __name__ == "__main__":
-    update_logos_db()
+    if sys.argv[1:] == ["convert"]:
+        convert_shelve()
+    else:
+        update_logos_db()
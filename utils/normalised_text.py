@@ -0,0 +1,144 @@
+import bisect
+import logging
+import regex
+
+logger = logging.getLogger(__name__)
+
+LIGATURES = {
+    'ﬀ': 'ff',
+    'ﬁ': 'fi',
+    'ﬂ': 'fl',
+    'ﬃ': 'ffi',
+    'ﬄ': 'ffl',
+    'ﬅ': 'st',
+    'ﬆ': 'st',
+}
+
+# edits that change the length of the text; isolated line breaks, tabs and form feeds are replaced by spaces afterwards
+# without affecting offsets
+EDIT_PATTERN = regex.compile(
+    r'(?P<hyphenation>(?<=\p{Ll})-[ \t]*\r?\n[ \t]*(?=\p{Ll}))'  # word broken across lines
+    r'|(?P<whitespace>\s{2,})'
+    r'|(?P<ligature>[ﬀ-ﬆ])'
+)
+SINGLE_WHITESPACE_TABLE = str.maketrans({'\n': ' ', '\r': ' ', '\t': ' ', '\f': ' ', '\v': ' '})
+PAGE_BREAK = '\f'
+
+
+def split_pages(chunks, first_page=1):
+    """
+    Splits a stream of text into pages delimited by form feeds, holding no more than one page (plus one chunk) in
+    memory at a time
+    :param chunks: iterable of strings (e.g. a text file or a list containing a single string)
+    :param first_page: Number of first page in stream
+    :return: generator of (page number, page text) tuples
+    """
+    number = first_page
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        start = 0
+        end = buffer.find(PAGE_BREAK)
+        while end != -1:
+            yield number, buffer[start:end]
+            number += 1
+            start = end + 1
+            end = buffer.find(PAGE_BREAK, start)
+        buffer = buffer[start:]
+    if buffer.strip():
+        yield number, buffer
+
+
+class NormalisedText:
+    """
+    Normalised view of a text, built once and shared by all searches: whitespace runs are collapsed into a single space,
+    words hyphenated across lines are rejoined and typographic ligatures are expanded. Offsets in the normalised text
+    can be mapped back to the raw text and to page numbers (pages are delimited by form feeds, as output by pdftotext
+    and textract).
+    """
+    def __init__(self, raw):
+        '''
+
+        :param raw: Text as extracted from file
+        '''
+        self.raw = raw
+        self.folded_text = None
+        self.page_starts = None
+        # offset map: the normalised text is made of segments; segment i starts at norm_breaks[i] in the normalised
+        # text and at raw_breaks[i] in the raw text. Characters inside unchanged segments map one to one.
+        self.norm_breaks = [0]
+        self.raw_breaks = [0]
+        pieces = []
+        raw_position = 0
+        norm_position = 0
+        for m in EDIT_PATTERN.finditer(raw):
+            pieces.append(raw[raw_position:m.start()])
+            norm_position += m.start() - raw_position
+            if m.lastgroup == 'hyphenation':
+                replacement = ''
+            elif m.lastgroup == 'whitespace':
+                replacement = ' '
+            else:
+                replacement = LIGATURES[m.group()]
+            # replacement characters all map to start of the edited span; text after it maps from its end
+            self.norm_breaks.append(norm_position)
+            self.raw_breaks.append(m.start())
+            pieces.append(replacement)
+            norm_position += len(replacement)
+            self.norm_breaks.append(norm_position)
+            self.raw_breaks.append(m.end())
+            raw_position = m.end()
+        pieces.append(raw[raw_position:])
+        self.text = ''.join(pieces).translate(SINGLE_WHITESPACE_TABLE)
+
+    def __len__(self):
+        return len(self.text)
+
+    @property
+    def folded(self):
+        """
+        Case folded copy of self.text, with the same offsets (str.lower keeps length for virtually all characters;
+        PatternSet checks that it did)
+        """
+        if self.folded_text is None:
+            self.folded_text = self.text.lower()
+        return self.folded_text
+
+    def raw_offset(self, position):
+        """
+        Maps an offset in the normalised text to the corresponding offset in the raw text
+        """
+        i = bisect.bisect_right(self.norm_breaks, position) - 1
+        if i % 2:
+            # inside a replacement; map to start of edited span in raw text
+            return self.raw_breaks[i]
+        return self.raw_breaks[i] + position - self.norm_breaks[i]
+
+    def raw_span(self, start, end):
+        """
+        :return: Slice of raw text corresponding to normalised text[start:end]
+        """
+        return self.raw[self.raw_offset(start):self.raw_offset(end)]
+
+    def page_of(self, position):
+        """
+        :param position: Offset in the normalised text
+        :return: Number of page (starting at 1) containing position
+        """
+        if self.page_starts is None:
+            self.page_starts = [0] + [m.end() for m in regex.finditer(PAGE_BREAK, self.raw)]
+        return bisect.bisect_right(self.page_starts, self.raw_offset(position))
+
+    @property
+    def number_of_pages(self):
+        return self.raw.count(PAGE_BREAK) + 1
+
+    def search(self, pattern, flags=regex.IGNORECASE, pos=None, endpos=None, **kwargs):
+        """
+        Searches normalised text with a regex
+        :return: regex match object or None
+        """
+        if isinstance(pattern, str):
+            pattern = regex.compile(pattern, flags=flags)
+        return pattern.search(self.text, pos if pos is not None else 0,
+                              endpos if endpos is not None else len(self.text), **kwargs)
@@ -0,0 +1,312 @@
+import logging
+import re
+import regex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ERROR_RATIO = 0.1
+
+
+class PatternHit:
+    """
+    A match of one pattern of a PatternSet
+    """
+    def __init__(self, name, match, start, end, errors, priority=0, payload=None):
+        self.name = name
+        self.match = match
+        self.start = start
+        self.end = end
+        self.errors = errors
+        self.priority = priority
+        self.payload = payload
+
+    def __repr__(self):
+        return "PatternHit object: <name={}; span=({}, {}); errors={}>".format(self.name, self.start, self.end,
+                                                                             self.errors)
+
+
+def approximate_match_ends(pattern, text, max_errors, pos=0, endpos=None):
+    """
+    Finds where approximate occurrences of pattern in text[pos:endpos] end, using Myers' bit-parallel algorithm
+    (https://doi.org/10.1145/316542.316550), which costs one pass over the text regardless of max_errors; fuzzy regexes
+    with many allowed errors backtrack exponentially instead.
+    :param pattern: Search string (already case folded if case should be ignored)
+    :param text: Text to search (already case folded if case should be ignored)
+    :param max_errors: Maximum edit distance (insertions, deletions and substitutions) of a match
+    :param pos: Start of searched slice of text
+    :param endpos: End of searched slice of text
+    :return: list of (end, errors) tuples, one for the best end position of each run of overlapping matches
+    """
+    m = len(pattern)
+    if endpos is None:
+        endpos = len(text)
+    if not m:
+        return []
+    all_ones = (1 << m) - 1
+    last_bit = 1 << (m - 1)
+    peq = {}
+    for i, c in enumerate(pattern):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    pv = all_ones
+    mv = 0
+    score = m
+    ends = []
+    best = None
+    for j in range(pos, endpos):
+        eq = peq.get(text[j], 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & all_ones)
+        mh = pv & xh
+        if ph & last_bit:
+            score += 1
+        elif mh & last_bit:
+            score -= 1
+        ph = (ph << 1) & all_ones
+        mh = (mh << 1) & all_ones
+        pv = mh | (~(xv | ph) & all_ones)
+        mv = ph & xv
+        if score <= max_errors:
+            if (best is None) or (score < best[1]):
+                best = (j + 1, score)
+        elif best is not None:
+            ends.append(best)
+            best = None
+    if best is not None:
+        ends.append(best)
+    return ends
+
+
+def approximate_matches(pattern, text, max_errors, pos=0, endpos=None):
+    """
+    Finds approximate occurrences of pattern in text[pos:endpos]
+    :return: list of (start, end, errors) tuples; the start of each match is found by matching the reversed pattern
+        leftwards from the end of the match
+    """
+    matches = []
+    previous_end = pos
+    for end, errors in approximate_match_ends(pattern, text, max_errors, pos, endpos):
+        window_start = max(previous_end, end - len(pattern) - errors)
+        reversed_ends = approximate_match_ends(pattern[::-1], text[window_start:end][::-1], errors)
+        start = end - reversed_ends[0][0] if reversed_ends else max(end - len(pattern), window_start)
+        matches.append((start, end, errors))
+        previous_end = end
+    return matches
+
+
+def trie_expression(words):
+    """
+    Builds a regex matching any of words, with alternatives shared as in a trie (e.g. 'cc by' and 'cc by-nc' become
+    'cc by(?:-nc)?', escaped), so that at each position of the text the regex engine follows a single branch instead of
+    trying every word in turn. The longest word matching at a position is preferred.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for c in word:
+            node = node.setdefault(c, {})
+        node[''] = None
+
+    def build(node):
+        branches = [re.escape(c) + build(child) for c, child in sorted(node.items()) if c]
+        if not branches:
+            return ''
+        expression = branches[0] if len(branches) == 1 else '(?:{})'.format('|'.join(branches))
+        return '(?:{})?'.format(expression) if '' in node else expression
+
+    return build(trie)
+
+
+class PatternEntry:
+    def __init__(self, index, name, pattern, error_ratio=0, literal=True, seeds=None, payload=None):
+        '''
+
+        :param index: Position of entry in PatternSet (lower values have higher priority)
+        :param name: Name reported in PatternHit instances
+        :param pattern: Search string (or regex, if literal is False)
+        :param error_ratio: Fuzzy matching tolerance; as in BaseParser.find_match_in_extracted_text, the pattern
+            matches with fewer than int(error_ratio * len(pattern)) errors
+        :param literal: If True, pattern is a plain string; otherwise, it is a regex
+        :param seeds: Exact substrings, at least one of which must occur in any match of a regex pattern; if None,
+            regex patterns are searched in the whole text
+        :param payload: Any object to be attached to hits of this pattern
+        '''
+        self.index = index
+        self.name = name
+        self.pattern = pattern
+        self.payload = payload
+        self.literal = literal
+        self.folded_pattern = pattern.lower()
+        self.max_errors = max(int(error_ratio * len(pattern)) - 1, 0) if error_ratio else 0
+        expression = regex.escape(pattern) if literal else pattern
+        if self.max_errors:
+            expression = "(?:{}){{e<={}}}".format(expression, self.max_errors)
+        self.compiled = regex.compile(expression, flags=regex.IGNORECASE)
+        if literal:
+            self.seeds = self.split_into_seeds(self.folded_pattern, self.max_errors + 1)
+        elif seeds:
+            # offsets of seeds inside regex matches are unknown, so they are treated as 0 and windows widened
+            self.seeds = [(s.lower(), 0) for s in seeds]
+        else:
+            self.seeds = []
+
+    @staticmethod
+    def split_into_seeds(pattern, n):
+        """
+        Splits pattern into n contiguous pieces. A match with fewer than n edits must contain at least one piece
+        unaltered, so finding the pieces is enough to find every candidate position.
+        :return: list of (piece, offset of piece in pattern) tuples
+        """
+        size = max(len(pattern) // n, 1)
+        seeds = []
+        for i in range(n):
+            start = i * size
+            end = len(pattern) if i == n - 1 else start + size
+            if start < len(pattern):
+                seeds.append((pattern[start:end], start))
+        return seeds
+
+
+class PatternSet:
+    """
+    Compiled set of patterns searched in a single scan of a text. Each pattern is split into exact substrings (seeds);
+    all seeds are found in one pass over the text by a single trie-shaped regex, and fuzzy matching is then only
+    attempted in small windows around seed occurrences.
+    """
+    def __init__(self):
+        self.entries = []
+        self.seed_index = {}
+        self.seed_prefixes = {}
+        self.seed_regex = None
+
+    def add(self, name, pattern, error_ratio=0, literal=True, seeds=None, payload=None):
+        entry = PatternEntry(len(self.entries), name, pattern, error_ratio=error_ratio, literal=literal, seeds=seeds,
+                             payload=payload)
+        self.entries.append(entry)
+        for seed, offset in entry.seeds:
+            self.seed_index.setdefault(seed, []).append((entry, offset))
+        self.seed_regex = None
+        return entry
+
+    def compile_seeds(self):
+        """
+        Compiles the regex finding seeds. It is a lookahead, so that overlapping occurrences are found, and captures
+        the longest seed starting at each position; shorter seeds starting there are prefixes of it, listed in
+        seed_prefixes.
+        """
+        self.seed_regex = re.compile('(?=({}))'.format(trie_expression(self.seed_index)))
+        self.seed_prefixes = {seed: [s for s in self.seed_index if seed.startswith(s)] for seed in self.seed_index}
+
+    def candidate_windows(self, folded_text):
+        """
+        Finds all occurrences of seeds in folded_text
+        :return: dictionary where keys are PatternEntry instances and values are sorted, non-overlapping lists of
+            (start, end) windows where a match may occur
+        """
+        windows = {}
+        if not self.seed_index:
+            return windows
+        if self.seed_regex is None:
+            self.compile_seeds()
+        for m in self.seed_regex.finditer(folded_text):
+            position = m.start()
+            for seed in self.seed_prefixes[m.group(1)]:
+                for entry, offset in self.seed_index[seed]:
+                    margin = 2 * entry.max_errors
+                    if entry.literal:
+                        start = position - offset - margin
+                        end = position - offset + len(entry.pattern) + margin
+                    else:
+                        # position of seed inside a regex match is unknown
+                        start = position - len(entry.pattern) - margin
+                        end = position + len(entry.pattern) + margin
+                    windows.setdefault(entry, []).append((max(start, 0), end))
+        for entry, spans in windows.items():
+            spans.sort()
+            merged = [spans[0]]
+            for start, end in spans[1:]:
+                if start <= merged[-1][1]:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+                else:
+                    merged.append((start, end))
+            windows[entry] = merged
+        return windows
+
+    def max_match_length(self):
+        """
+        :return: length of the longest possible match of a literal pattern (regex patterns are assumed to be no longer
+            than their expression)
+        """
+        return max((len(e.pattern) + e.max_errors for e in self.entries), default=0)
+
+    def scan_pages(self, pages, normalise=None):
+        """
+        Searches a stream of pages for all patterns in this set, one page at a time, so that the whole text never
+        needs to be held in memory and callers can stop consuming hits as soon as they have found what they need.
+        Each page is scanned together with the end of the previous one, so that matches across page breaks are found.
+        Offsets are those of the stream even when pages are empty:
+
+        >>> ps = PatternSet()
+        >>> _ = ps.add('cc', 'creative commons')
+        >>> [(n, h.start) for n, h in ps.scan_pages([(1, ''), (2, 'Creative Commons')])]
+        [(2, 1)]
+
+        :param pages: iterable of (page number, page text) tuples
+        :param normalise: Function applied to the text of each page before it is searched
+        :return: generator of (page number, PatternHit) tuples; offsets of hits are relative to the start of the
+            (normalised) stream, with pages joined by a single space
+        """
+        overlap = 2 * self.max_match_length()
+        tail = ''
+        position = 0  # offset of tail in stream
+        previous = set()
+        for i, (number, page) in enumerate(pages):
+            text = normalise(page) if normalise else page
+            buffer = tail + ' ' + text if i else text
+            reported = set()
+            for hit in self.scan(buffer):
+                hit.start += position
+                hit.end += position
+                if (hit.end <= position + len(tail)) or ((hit.name, hit.start) in previous):
+                    # found when previous page was scanned
+                    continue
+                reported.add((hit.name, hit.start))
+                yield number, hit
+            previous = reported
+            kept = min(len(buffer), overlap)
+            position += len(buffer) - kept
+            tail = buffer[len(buffer) - kept:]
+
+    def scan(self, text, folded_text=None):
+        """
+        Searches text for all patterns in this set
+        :param text: Text to search
+        :param folded_text: text.lower(), if already available
+        :return: list of PatternHit instances, sorted by start position
+        """
+        if folded_text is None:
+            folded_text = text.lower()
+        if len(folded_text) != len(text):
+            # lower() changed the length of a few characters (e.g. 'İ'), so offsets in folded_text are unreliable
+            logger.debug("Case folding changed text length; verifying patterns over whole text")
+            windows = {e: [(0, len(text))] for e in self.entries if e.seeds}
+        else:
+            windows = self.candidate_windows(folded_text)
+        for entry in self.entries:
+            if not entry.seeds:
+                windows[entry] = [(0, len(text))]
+        hits = []
+        for entry, spans in windows.items():
+            for start, end in spans:
+                end = min(end, len(text))
+                if entry.literal and (len(folded_text) == len(text)):
+                    for m_start, m_end, errors in approximate_matches(entry.folded_pattern, folded_text,
+                                                                      entry.max_errors, start, end):
+                        hits.append(PatternHit(entry.name, text[m_start:m_end], m_start, m_end, errors,
+                                               priority=entry.index, payload=entry.payload))
+                else:
+                    for m in entry.compiled.finditer(text, pos=start, endpos=end):
+                        hits.append(PatternHit(entry.name, m.group(), m.start(), m.end(), sum(m.fuzzy_counts),
+                                               priority=entry.index, payload=entry.payload))
+        hits.sort(key=lambda h: (h.start, h.priority))
+        return hits
@@ -11,7 +11,7 @@ class VersionPattern:
         :param never_found_on: list of manuscript versions we would not normally expect to find pattern on
         :param error_ratio: the tolerance for fuzzy matching of pattern
         """
-        self.pattern = pattern,
+        self.pattern = pattern
         self.indicative_of = indicative_of
         self.not_found_on = not_found_on
         self.error_ratio = error_ratio
@@ -0,0 +1,206 @@
+import logging
+import math
+import os
+import regex
+import shutil
+import subprocess
+from PIL import Image
+from PyPDF2 import PdfFileReader, utils
+
+logger = logging.getLogger(__name__)
+
+# pdfimages -p names outputs <root>-<page>-<image number>.<extension>
+PDFIMAGES_NAME_PATTERN = regex.compile(r"^img-(?P<page>\d+)-(?P<number>\d+)\.(?P<ext>\w+)$")
+
+# resolution and height (as a fraction of the page height) of the header strips rendered by render_header_strip
+HEADER_STRIP_DPI = 50
+HEADER_STRIP_FRACTION = 0.2
+
+# PIL modes of uncompressed (or Flate compressed) images, by colour space and number of colour components
+COLOUR_SPACE_MODES = {
+    '/DeviceGray': 'L',
+    '/DeviceRGB': 'RGB',
+    '/DeviceCMYK': 'CMYK',
+}
+COMPONENT_MODES = {1: 'L', 3: 'RGB', 4: 'CMYK'}
+# image filters whose encoded data can be written to file as is
+ENCODED_IMAGE_EXTENSIONS = {
+    '/DCTDecode': '.jpg',
+    '/JPXDecode': '.jp2',
+}
+
+
+def image_name(page, number, ext):
+    """
+    Names extracted images as CERMINE does in its .images folders
+    :param page: Page number (starting at 1)
+    :param number: Position of image among the images extracted from page (starting at 0)
+    :param ext: File extension, including leading dot
+    """
+    return "img_{}_{}{}".format(page, number, ext)
+
+
+def extract_images(pdf_path, output_folder, first_page=1, last_page=1):
+    """
+    Extracts the images drawn on a range of pages of a PDF file, without running CERMINE. Uses pdfimages (poppler-utils)
+    if it is installed; otherwise, reads image XObjects from the pages' resources with PyPDF2
+    :param pdf_path: Path to PDF file
+    :param output_folder: Existing folder where images are saved
+    :param first_page: First page to extract images from (starting at 1)
+    :param last_page: Last page to extract images from
+    :return: list of paths to extracted images
+    """
+    if shutil.which("pdfimages"):
+        try:
+            return extract_images_with_pdfimages(pdf_path, output_folder, first_page, last_page)
+        except subprocess.CalledProcessError as e:
+            logger.warning("pdfimages failed on {} (return code {}); using PyPDF2 instead".format(pdf_path,
+                                                                                                e.returncode))
+    return extract_images_with_pypdf2(pdf_path, output_folder, first_page, last_page)
+
+
+def extract_images_with_pdfimages(pdf_path, output_folder, first_page=1, last_page=1):
+    subprocess.run(["pdfimages", "-all", "-p", "-f", str(first_page), "-l", str(last_page), pdf_path,
+                    os.path.join(output_folder, "img")], check=True, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+    paths = []
+    counters = {}
+    for filename in sorted(os.listdir(output_folder)):
+        m = PDFIMAGES_NAME_PATTERN.match(filename)
+        if not m:
+            continue
+        page = int(m.group('page'))
+        number = counters.get(page, 0)
+        counters[page] = number + 1
+        path = os.path.join(output_folder, image_name(page, number, "." + m.group('ext')))
+        os.replace(os.path.join(output_folder, filename), path)
+        paths.append(path)
+    return paths
+
+
+def image_xobjects(resources, visited=None):
+    """
+    Finds image XObjects in a resources dictionary, including those drawn by form XObjects
+    :return: generator of image XObjects
+    """
+    if visited is None:
+        visited = set()
+    xobjects = resources.getObject().get('/XObject') if resources else None
+    if not xobjects:
+        return
+    for name, reference in xobjects.getObject().items():
+        key = (reference.idnum, reference.generation) if hasattr(reference, 'idnum') else None
+        if key:
+            if key in visited:
+                continue
+            visited.add(key)
+        xobject = reference.getObject()
+        subtype = xobject.get('/Subtype')
+        if subtype == '/Image':
+            yield xobject
+        elif subtype == '/Form':
+            yield from image_xobjects(xobject.get('/Resources'), visited)
+
+
+def save_image_xobject(xobject, path_stem):
+    """
+    Writes an image XObject to file
+    :param xobject: PyPDF2 stream object
+    :param path_stem: Path to output file, without extension
+    :return: path to output file, or None if the image encoding is not supported
+    """
+    filters = xobject.get('/Filter')
+    if isinstance(filters, list):
+        filters = filters[0] if len(filters) == 1 else filters
+    if filters in ENCODED_IMAGE_EXTENSIONS:
+        path = path_stem + ENCODED_IMAGE_EXTENSIONS[filters]
+        with open(path, 'wb') as f:
+            f.write(xobject._data)
+        return path
+    if filters not in (None, '/FlateDecode'):
+        logger.debug("Unsupported image filter {}".format(filters))
+        return None
+    colour_space = xobject.get('/ColorSpace')
+    if hasattr(colour_space, 'getObject'):
+        colour_space = colour_space.getObject()
+    if isinstance(colour_space, list) and colour_space and (colour_space[0] == '/ICCBased'):
+        mode = COMPONENT_MODES.get(colour_space[1].getObject().get('/N'))
+    else:
+        mode = COLOUR_SPACE_MODES.get(colour_space)
+    if xobject.get('/BitsPerComponent') == 1:
+        mode = '1'
+    elif xobject.get('/BitsPerComponent') != 8:
+        mode = None
+    if not mode:
+        logger.debug("Unsupported image colour space {}".format(colour_space))
+        return None
+    image = Image.frombytes(mode, (xobject['/Width'], xobject['/Height']), xobject.getData())
+    if mode == 'CMYK':
+        image = image.convert('RGB')
+    path = path_stem + ".png"
+    image.save(path)
+    return path
+
+
+def extract_images_with_pypdf2(pdf_path, output_folder, first_page=1, last_page=1):
+    paths = []
+    with open(pdf_path, 'rb') as f:
+        try:
+            pdf = PdfFileReader(f, strict=False)
+            last_page = min(last_page, pdf.getNumPages())
+        except utils.PdfReadError as e:
+            logger.error("Could not read {}: {}".format(pdf_path, e))
+            return paths
+        for page in range(first_page, last_page + 1):
+            try:
+                xobjects = list(image_xobjects(pdf.getPage(page - 1).get('/Resources')))
+            except (utils.PdfReadError, KeyError, ValueError) as e:
+                logger.warning("Could not read resources of page {} of {}: {}".format(page, pdf_path, e))
+                continue
+            number = 0
+            for xobject in xobjects:
+                try:
+                    path = save_image_xobject(xobject, os.path.join(output_folder, image_name(page, number, "")))
+                except (utils.PdfReadError, NotImplementedError, KeyError, ValueError, OSError) as e:
+                    logger.warning("Could not extract image from page {} of {}: {}".format(page, pdf_path, e))
+                    continue
+                if path:
+                    paths.append(path)
+                    number += 1
+    return paths
+
+
+def render_header_strip(pdf_path, output_stem, page=1, dpi=HEADER_STRIP_DPI, strip_fraction=HEADER_STRIP_FRACTION):
+    """
+    Renders the top strip of a page at low resolution with pdftoppm (poppler-utils), so that logos drawn as vector art,
+    which are not extracted as images, can be matched against logo hashes. Only the strip is rasterised.
+    :param pdf_path: Path to PDF file
+    :param output_stem: Path to output file, without extension
+    :param page: Page number (starting at 1); negative numbers count from the last page (-1 is the last page)
+    :param dpi: Rendering resolution
+    :param strip_fraction: Height of strip as a fraction of the page height
+    :return: Path to greyscale PNG image of strip, or None if it could not be rendered
+    """
+    if not shutil.which("pdftoppm"):
+        logger.debug("pdftoppm not found; cannot render header strips")
+        return None
+    with open(pdf_path, 'rb') as f:
+        try:
+            pdf = PdfFileReader(f, strict=False)
+            if page < 0:
+                page = pdf.getNumPages() + 1 + page
+            box = pdf.getPage(page - 1).cropBox
+            width, height = float(box.getWidth()), float(box.getHeight())
+        except (utils.PdfReadError, IndexError, KeyError, ValueError) as e:
+            logger.warning("Could not read size of page {} of {}: {}".format(page, pdf_path, e))
+            return None
+    strip_width = math.ceil(width * dpi / 72)
+    strip_height = math.ceil(height * strip_fraction * dpi / 72)
+    try:
+        subprocess.run(["pdftoppm", "-f", str(page), "-l", str(page), "-r", str(dpi), "-x", "0", "-y", "0",
+                        "-W", str(strip_width), "-H", str(strip_height), "-gray", "-png", "-singlefile", pdf_path,
+                        output_stem], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError as e:
+        logger.warning("pdftoppm failed on page {} of {} (return code {})".format(page, pdf_path, e.returncode))
+        return None
+    return output_stem + ".png"
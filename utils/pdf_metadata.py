@@ -0,0 +1,587 @@
+import logging
+import mmap
+import regex
+import xml.etree.ElementTree as ET
+import zlib
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# number of bytes at the end of a file searched for startxref
+TAIL_SIZE = 2048
+# number of bytes of an XMP packet fed to the XML parser at a time
+XMP_CHUNK_SIZE = 64 * 1024
+# maximum depth of /Prev chains followed when reading incremental updates
+MAX_XREF_SECTIONS = 100
+
+WHITESPACE = b'\x00\t\n\x0c\r '
+DELIMITERS = b'()<>[]{}/%'
+SKIP_PATTERN = regex.compile(rb'(?:[\x00\t\n\x0c\r ]+|%[^\r\n]*)*')
+NUMBER_PATTERN = regex.compile(rb'[+-]?(?:\d+\.?\d*|\.\d+)')
+REFERENCE_PATTERN = regex.compile(rb'[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+R(?![^\x00\t\n\x0c\r ()<>\[\]{}/%])')
+OBJECT_HEADER_PATTERN = regex.compile(rb'[\x00\t\n\x0c\r ]*(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+obj')
+OBJECT_SCAN_PATTERN = regex.compile(rb'(?<![0-9])(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+obj\b')
+XREF_SUBSECTION_PATTERN = regex.compile(rb'[\x00\t\n\x0c\r ]*(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]*[\r\n]')
+XREF_ENTRY_PATTERN = regex.compile(rb'[\x00\t\n\x0c\r ]*(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+([nf])')
+STARTXREF_PATTERN = regex.compile(rb'startxref[\x00\t\n\x0c\r ]+(\d+)')
+STRING_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f', b'(': b'(', b')': b')',
+                  b'\\': b'\\'}
+
+RDF_NAMESPACE = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+# conventional prefixes of XMP namespaces, used in the keys of XMP fields whatever prefix a file declares
+XMP_NAMESPACE_PREFIXES = {
+    'http://purl.org/dc/elements/1.1/': 'dc',
+    'http://ns.adobe.com/xap/1.0/': 'xmp',
+    'http://ns.adobe.com/xap/1.0/mm/': 'xmpMM',
+    'http://ns.adobe.com/xap/1.0/rights/': 'xmpRights',
+    'http://ns.adobe.com/pdf/1.3/': 'pdf',
+    'http://ns.adobe.com/pdfx/1.3/': 'pdfx',
+    'http://prismstandard.org/namespaces/basic/2.0/': 'prism',
+    'http://prismstandard.org/namespaces/basic/3.0/': 'prism',
+    'http://crossref.org/crossmark/1.0/': 'crossmark',
+    'http://www.aiim.org/pdfa/ns/id/': 'pdfaid',
+    'http://ns.editeur.org/jav/': 'jav',
+}
+
+Reference = namedtuple('Reference', ['number', 'generation'])
+
+
+class PdfMetadataError(Exception):
+    """
+    Raised when the structure of a PDF file cannot be read by PdfMetadataScanner
+    """
+
+
+class Stream:
+    def __init__(self, dictionary, start):
+        '''
+
+        :param dictionary: Stream dictionary
+        :param start: Offset of first byte of stream data
+        '''
+        self.dictionary = dictionary
+        self.start = start
+
+
+class PdfMetadataScanner:
+    """
+    Reads the document information dictionary, page count and XMP metadata of a PDF file without building a full
+    document model: the file is memory-mapped and only the cross-reference sections, the trailer and the few objects
+    they point to (catalog, page tree root, Info dictionary and metadata stream) are parsed. Files whose
+    cross-reference offsets are broken are read by scanning for object headers instead.
+
+    Names are returned as written in the file (e.g. '/CrossMarkDomains#5B1#5D'), as PyPDF2 does; PDF strings are
+    returned as bytes by the object parser and decoded to text in the metadata it returns.
+    """
+    def __init__(self, pdf_path):
+        self.pdf_path = pdf_path
+        self.file = None
+        self.data = None
+        self.xref = {}  # object number: offset in file, or (number of object stream, index in object stream)
+        self.trailer = {}
+        self.object_streams = {}  # number of object stream: (decoded data, offset of first object, header)
+        self.unindexed_object_streams = False  # True if xref was rebuilt and compressed objects are not indexed yet
+
+    def __enter__(self):
+        self.file = open(self.pdf_path, 'rb')
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:  # empty file
+            self.file.close()
+            raise PdfMetadataError("Could not map {}: {}".format(self.pdf_path, e))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.data.close()
+        self.file.close()
+
+    # --- object parser ---
+
+    def skip(self, data, position):
+        return SKIP_PATTERN.match(data, position).end()
+
+    def parse_object(self, data, position):
+        """
+        Parses a direct object
+        :return: tuple (object, offset of first byte after object)
+        """
+        position = self.skip(data, position)
+        c = data[position:position + 1]
+        if c == b'/':
+            end = position + 1
+            while end < len(data) and data[end] not in WHITESPACE and data[end] not in DELIMITERS:
+                end += 1
+            return data[position:end].decode('latin-1'), end
+        if c == b'<':
+            if data[position + 1:position + 2] == b'<':
+                return self.parse_dictionary(data, position + 2)
+            end = data.find(b'>', position)
+            if end == -1:
+                raise PdfMetadataError("Unterminated hex string at {}".format(position))
+            digits = regex.sub(rb'[^0-9A-Fa-f]', b'', data[position + 1:end])
+            if len(digits) % 2:
+                digits += b'0'
+            return bytes.fromhex(digits.decode('ascii')), end + 1
+        if c == b'(':
+            return self.parse_literal_string(data, position + 1)
+        if c == b'[':
+            array = []
+            position += 1
+            while True:
+                position = self.skip(data, position)
+                if data[position:position + 1] == b']':
+                    return array, position + 1
+                if position >= len(data):
+                    raise PdfMetadataError("Unterminated array")
+                item, position = self.parse_object(data, position)
+                array.append(item)
+        m = NUMBER_PATTERN.match(data, position)
+        if m:
+            if b'.' in m.group():
+                return float(m.group()), m.end()
+            r = REFERENCE_PATTERN.match(data, m.end())
+            if r:
+                return Reference(int(m.group()), int(r.group(1))), r.end()
+            return int(m.group()), m.end()
+        for keyword, value in ((b'true', True), (b'false', False), (b'null', None)):
+            if data[position:position + len(keyword)] == keyword:
+                return value, position + len(keyword)
+        raise PdfMetadataError("Unexpected token {!r} at {}".format(bytes(data[position:position + 10]), position))
+
+    def parse_dictionary(self, data, position):
+        dictionary = {}
+        while True:
+            position = self.skip(data, position)
+            if data[position:position + 2] == b'>>':
+                return dictionary, position + 2
+            if position >= len(data):
+                raise PdfMetadataError("Unterminated dictionary")
+            key, position = self.parse_object(data, position)
+            if not isinstance(key, str):
+                raise PdfMetadataError("Dictionary key {!r} is not a name".format(key))
+            dictionary[key], position = self.parse_object(data, position)
+
+    def parse_literal_string(self, data, position):
+        pieces = []
+        depth = 1
+        start = position
+        while position < len(data):
+            c = data[position:position + 1]
+            if c == b'\\':
+                pieces.append(data[start:position])
+                nxt = data[position + 1:position + 2]
+                if nxt in STRING_ESCAPES:
+                    pieces.append(STRING_ESCAPES[nxt])
+                    position += 2
+                elif nxt.isdigit():
+                    octal = regex.match(rb'[0-7]{1,3}', data[position + 1:position + 4]).group()
+                    pieces.append(bytes([int(octal, 8) & 0xFF]))
+                    position += 1 + len(octal)
+                elif nxt == b'\r':
+                    position += 3 if data[position + 2:position + 3] == b'\n' else 2
+                else:
+                    # line continuation (\ followed by end of line) or unknown escape, which is ignored
+                    position += 2 if nxt == b'\n' else 1
+                start = position
+                continue
+            if c == b'(':
+                depth += 1
+            elif c == b')':
+                depth -= 1
+                if not depth:
+                    pieces.append(data[start:position])
+                    return b''.join(bytes(p) for p in pieces), position + 1
+            position += 1
+        raise PdfMetadataError("Unterminated string")
+
+    # --- indirect objects and streams ---
+
+    def parse_indirect_object(self, data, position, number=None):
+        """
+        Parses the indirect object ('n g obj ... endobj') starting at position
+        :return: object, or Stream instance for stream objects
+        """
+        m = OBJECT_HEADER_PATTERN.match(data, position)
+        if not m or ((number is not None) and int(m.group(1)) != number):
+            raise PdfMetadataError("No object {} at offset {}".format(number, position))
+        value, position = self.parse_object(data, m.end())
+        if isinstance(value, dict):
+            position = self.skip(data, position)
+            if data[position:position + 6] == b'stream':
+                position += 6
+                if data[position:position + 2] == b'\r\n':
+                    position += 2
+                elif data[position:position + 1] in (b'\n', b'\r'):
+                    position += 1
+                return Stream(value, position)
+        return value
+
+    def resolve(self, value):
+        """
+        Follows indirect references
+        """
+        seen = set()
+        while isinstance(value, Reference):
+            if value.number in seen:
+                raise PdfMetadataError("Reference loop at object {}".format(value.number))
+            seen.add(value.number)
+            value = self.get_object(value.number)
+        return value
+
+    def get_object(self, number):
+        location = self.xref.get(number)
+        if (location is None) and self.unindexed_object_streams:
+            self.index_object_streams()
+            location = self.xref.get(number)
+        if location is None:
+            return None
+        if isinstance(location, tuple):
+            stream_number, index = location
+            decoded, first, header = self.load_object_stream(stream_number)
+            if 2 * index + 1 >= len(header):
+                raise PdfMetadataError("Object {} not in object stream {}".format(number, stream_number))
+            return self.parse_object(decoded, first + header[2 * index + 1])[0]
+        return self.parse_indirect_object(self.data, location, number)
+
+    def load_object_stream(self, number):
+        """
+        :return: tuple (decoded data, offset of first object, header), where header alternates object numbers and
+            offsets of objects relative to the first
+        """
+        if number not in self.object_streams:
+            stream = self.resolve(Reference(number, 0))
+            if not (isinstance(stream, Stream) and stream.dictionary.get('/Type') == '/ObjStm'):
+                raise PdfMetadataError("Object {} is not an object stream".format(number))
+            decoded = self.stream_data(stream)
+            first = self.resolve(stream.dictionary.get('/First'))
+            try:
+                header = [int(n) for n in decoded[:first].split()]
+            except (TypeError, ValueError) as e:
+                raise PdfMetadataError("Bad header in object stream {}: {}".format(number, e))
+            self.object_streams[number] = (decoded, first, header)
+        return self.object_streams[number]
+
+    def stream_data(self, stream):
+        """
+        :return: decoded data of stream
+        """
+        length = self.resolve(stream.dictionary.get('/Length'))
+        end = stream.start + length if isinstance(length, int) else -1
+        if (end < stream.start) or (self.data[end:end + 20].lstrip(WHITESPACE)[:9] != b'endstream'):
+            # missing or wrong /Length (common in broken files)
+            end = self.data.find(b'endstream', stream.start)
+            if end == -1:
+                raise PdfMetadataError("Unterminated stream at {}".format(stream.start))
+            while self.data[end - 1:end] in (b'\r', b'\n') and end > stream.start:
+                end -= 1
+        data = self.data[stream.start:end]
+        filters = self.resolve(stream.dictionary.get('/Filter'))
+        parameters = self.resolve(stream.dictionary.get('/DecodeParms'))
+        if not isinstance(filters, list):
+            filters = [filters] if filters else []
+        if not isinstance(parameters, list):
+            parameters = [parameters] * len(filters)
+        for f, p in zip(filters, parameters):
+            if f not in ('/FlateDecode', '/Fl'):
+                raise PdfMetadataError("Unsupported stream filter {}".format(f))
+            try:
+                data = zlib.decompressobj().decompress(data)
+            except zlib.error as e:
+                raise PdfMetadataError("Could not decompress stream at {}: {}".format(stream.start, e))
+            p = self.resolve(p) or {}
+            if p.get('/Predictor', 1) >= 10:
+                data = self.undo_png_predictor(data, p.get('/Columns', 1) * p.get('/Colors', 1) *
+                                               p.get('/BitsPerComponent', 8) // 8,
+                                               max(p.get('/Colors', 1) * p.get('/BitsPerComponent', 8) // 8, 1))
+        return data
+
+    @staticmethod
+    def undo_png_predictor(data, row_length, pixel_size=1):
+        rows = []
+        previous = bytearray(row_length)
+        for i in range(0, len(data) - row_length, row_length + 1):
+            kind = data[i]
+            row = bytearray(data[i + 1:i + 1 + row_length])
+            for j in range(len(row)):
+                left = row[j - pixel_size] if j >= pixel_size else 0
+                up = previous[j]
+                if kind == 1:
+                    row[j] = (row[j] + left) & 0xFF
+                elif kind == 2:
+                    row[j] = (row[j] + up) & 0xFF
+                elif kind == 3:
+                    row[j] = (row[j] + (left + up) // 2) & 0xFF
+                elif kind == 4:
+                    up_left = previous[j - pixel_size] if j >= pixel_size else 0
+                    estimate = left + up - up_left
+                    distances = (abs(estimate - left), abs(estimate - up), abs(estimate - up_left))
+                    row[j] = (row[j] + (left, up, up_left)[distances.index(min(distances))]) & 0xFF
+            rows.append(bytes(row))
+            previous = row
+        return b''.join(rows)
+
+    # --- cross-reference sections ---
+
+    def read_xref(self):
+        """
+        Reads all cross-reference sections, newest first, so that objects redefined by incremental updates point to
+        their newest definition; falls back to scanning the whole file for object headers if offsets are broken
+        """
+        try:
+            m = None
+            for m in STARTXREF_PATTERN.finditer(self.data, max(len(self.data) - TAIL_SIZE, 0)):
+                pass
+            if not m:
+                raise PdfMetadataError("startxref not found")
+            offset = int(m.group(1))
+            sections = 0
+            while offset is not None:
+                sections += 1
+                if sections > MAX_XREF_SECTIONS:
+                    raise PdfMetadataError("Too many cross-reference sections")
+                trailer = self.read_xref_section(offset)
+                for key, value in trailer.items():
+                    self.trailer.setdefault(key, value)
+                if isinstance(trailer.get('/XRefStm'), int):
+                    self.read_xref_section(trailer['/XRefStm'])
+                offset = trailer.get('/Prev')
+                if not isinstance(offset, (int, type(None))):
+                    raise PdfMetadataError("Bad /Prev offset {!r}".format(offset))
+        except (PdfMetadataError, ValueError, IndexError, KeyError, TypeError) as e:
+            logger.debug("Could not read cross-reference sections of {} ({}); scanning for objects".format(
+                self.pdf_path, e))
+            self.rebuild_xref()
+
+    def read_xref_section(self, offset):
+        """
+        Reads a cross-reference table or stream
+        :return: trailer dictionary
+        """
+        position = self.skip(self.data, offset)
+        if self.data[position:position + 4] != b'xref':
+            stream = self.parse_indirect_object(self.data, position)
+            if not isinstance(stream, Stream) or stream.dictionary.get('/Type') != '/XRef':
+                raise PdfMetadataError("No cross-reference section at offset {}".format(offset))
+            self.read_xref_stream(stream)
+            return stream.dictionary
+        position += 4
+        while True:
+            m = XREF_SUBSECTION_PATTERN.match(self.data, position)
+            if not m:
+                break
+            first, count = int(m.group(1)), int(m.group(2))
+            position = m.end()
+            for number in range(first, first + count):
+                entry = XREF_ENTRY_PATTERN.match(self.data, position)
+                if not entry:
+                    raise PdfMetadataError("Bad cross-reference entry at {}".format(position))
+                position = entry.end()
+                if entry.group(3) == b'n':
+                    self.xref.setdefault(number, int(entry.group(1)))
+        position = self.skip(self.data, position)
+        if self.data[position:position + 7] != b'trailer':
+            raise PdfMetadataError("No trailer after cross-reference table at offset {}".format(offset))
+        trailer = self.parse_object(self.data, position + 7)[0]
+        if not isinstance(trailer, dict):
+            raise PdfMetadataError("Trailer at offset {} is not a dictionary".format(offset))
+        return trailer
+
+    def read_xref_stream(self, stream):
+        widths = stream.dictionary['/W']
+        row_length = sum(widths)
+        index = stream.dictionary.get('/Index', [0, stream.dictionary['/Size']])
+        data = self.stream_data(stream)
+        if len(data) < row_length * sum(index[1::2]):
+            raise PdfMetadataError("Cross-reference stream is shorter than its /Index")
+        position = 0
+        for first, count in zip(index[::2], index[1::2]):
+            for number in range(first, first + count):
+                fields = []
+                for width in widths:
+                    fields.append(int.from_bytes(data[position:position + width], 'big'))
+                    position += width
+                kind = fields[0] if widths[0] else 1
+                if kind == 1:
+                    self.xref.setdefault(number, fields[1])
+                elif kind == 2:
+                    self.xref.setdefault(number, (fields[1], fields[2]))
+
+    def rebuild_xref(self):
+        self.xref = {}
+        self.trailer = {}
+        for m in OBJECT_SCAN_PATTERN.finditer(self.data):
+            self.xref[int(m.group(1))] = m.start()
+        self.unindexed_object_streams = True
+        position = self.data.rfind(b'trailer')
+        if position != -1:
+            try:
+                trailer = self.parse_object(self.data, position + 7)[0]
+            except PdfMetadataError:
+                trailer = None
+            self.trailer = trailer if isinstance(trailer, dict) else {}
+        if '/Root' not in self.trailer:
+            # files with cross-reference streams have no trailer keyword; find the catalog instead
+            for number, offset in sorted(self.xref.items(), key=lambda i: i[1], reverse=True):
+                try:
+                    value = self.parse_indirect_object(self.data, offset, number)
+                except PdfMetadataError:
+                    continue
+                if isinstance(value, Stream) and value.dictionary.get('/Type') == '/XRef':
+                    for key in ('/Root', '/Info', '/Encrypt'):
+                        if key in value.dictionary:
+                            self.trailer.setdefault(key, value.dictionary[key])
+                elif isinstance(value, dict) and (value.get('/Type') == '/Catalog'):
+                    self.trailer.setdefault('/Root', Reference(number, 0))
+                if '/Root' in self.trailer and '/Info' in self.trailer:
+                    break
+        if '/Root' not in self.trailer:
+            raise PdfMetadataError("Could not find document catalog")
+
+    def index_object_streams(self):
+        """
+        Adds the objects stored in object streams to a rebuilt cross-reference index
+        """
+        self.unindexed_object_streams = False
+        for number, offset in list(self.xref.items()):
+            if not isinstance(offset, int):
+                continue
+            if self.data.find(b'/ObjStm', offset, offset + TAIL_SIZE) == -1:
+                continue
+            try:
+                header = self.load_object_stream(number)[2]
+            except PdfMetadataError:
+                continue
+            for index, compressed_number in enumerate(header[::2]):
+                self.xref.setdefault(compressed_number, (number, index))
+
+    # --- metadata ---
+
+    @staticmethod
+    def decode_text(value):
+        """
+        Decodes a PDF text string (UTF-16BE with byte order mark, UTF-8 with byte order mark or PDFDocEncoding, which
+        is read as Latin-1)
+        """
+        if not isinstance(value, bytes):
+            return str(value)
+        if value.startswith(b'\xfe\xff'):
+            return value[2:].decode('utf-16-be', errors='replace')
+        if value.startswith(b'\xef\xbb\xbf'):
+            return value[3:].decode('utf-8', errors='replace')
+        return value.decode('latin-1')
+
+    def info(self):
+        info = self.resolve(self.trailer.get('/Info'))
+        if not isinstance(info, dict):
+            return {}
+        return {key: self.decode_text(self.resolve(value)) for key, value in info.items()}
+
+    def number_of_pages(self):
+        root = self.resolve(self.trailer.get('/Root'))
+        pages = self.resolve(root.get('/Pages')) if isinstance(root, dict) else None
+        count = self.resolve(pages.get('/Count')) if isinstance(pages, dict) else None
+        return count if isinstance(count, int) else None
+
+    def xmp_packet(self):
+        """
+        :return: data of the document's metadata stream, or None if there is none
+        """
+        root = self.resolve(self.trailer.get('/Root'))
+        stream = self.resolve(root.get('/Metadata')) if isinstance(root, dict) else None
+        if not isinstance(stream, Stream):
+            return None
+        return self.stream_data(stream)
+
+    def read(self):
+        """
+        :return: dictionary with keys 'number_of_pages', 'info' (document information dictionary) and 'xmp' (see
+            parse_xmp)
+        """
+        self.read_xref()
+        if '/Encrypt' in self.trailer:
+            raise PdfMetadataError("File is encrypted")
+        xmp = {}
+        try:
+            packet = self.xmp_packet()
+            if packet:
+                xmp = parse_xmp(packet)
+        except (PdfMetadataError, ET.ParseError) as e:
+            logger.warning("Could not read XMP metadata of {}: {}".format(self.pdf_path, e))
+        return {'number_of_pages': self.number_of_pages(), 'info': self.info(), 'xmp': xmp}
+
+
+def xmp_key(tag, prefixes):
+    """
+    :param tag: ElementTree tag or attribute name ('{namespace}local name')
+    :param prefixes: dictionary of prefixes declared in the packet, where keys are namespaces
+    :return: key of XMP field (e.g. 'crossmark:DOI')
+    """
+    namespace, local_name = tag[1:].split('}', 1)
+    prefix = XMP_NAMESPACE_PREFIXES.get(namespace) or prefixes.get(namespace) or namespace
+    return "{}:{}".format(prefix, local_name)
+
+
+def xmp_value(element):
+    """
+    :return: text of a simple XMP property; the first item of a language alternative (rdf:Alt); or the items of an
+        ordered or unordered array (rdf:Seq, rdf:Bag) joined by '; '
+    """
+    items = [(li.text or '').strip() for li in element.iter('{%s}li' % RDF_NAMESPACE)]
+    items = [i for i in items if i]
+    if items:
+        if element.find('{%s}Alt' % RDF_NAMESPACE) is not None:
+            return items[0]
+        return '; '.join(items)
+    return (element.text or element.get('{%s}resource' % RDF_NAMESPACE) or '').strip()
+
+
+def parse_xmp(packet):
+    """
+    Parses an XMP packet incrementally, discarding each rdf:Description element once its properties are read
+    :param packet: XMP data (bytes)
+    :return: dictionary where keys are qualified property names (e.g. 'dc:title', 'crossmark:DOI'; see
+        XMP_NAMESPACE_PREFIXES) and values are strings
+    """
+    description_tag = '{%s}Description' % RDF_NAMESPACE
+    parser = ET.XMLPullParser(events=('start-ns', 'end'))
+    prefixes = {}
+    fields = {}
+    view = memoryview(packet)
+    for i in range(0, len(view), XMP_CHUNK_SIZE):
+        parser.feed(bytes(view[i:i + XMP_CHUNK_SIZE]))
+        for event, value in parser.read_events():
+            if event == 'start-ns':
+                prefix, namespace = value
+                prefixes.setdefault(namespace, prefix)
+            elif value.tag == description_tag:
+                for name, text in value.attrib.items():
+                    if name.startswith('{') and not name.startswith('{%s}' % RDF_NAMESPACE) and text.strip():
+                        fields.setdefault(xmp_key(name, prefixes), text.strip())
+                for child in value:
+                    text = xmp_value(child)
+                    if text and child.tag.startswith('{'):
+                        fields.setdefault(xmp_key(child.tag, prefixes), text)
+                value.clear()
+    try:
+        parser.close()
+    except ET.ParseError as e:
+        # trailing padding or a truncated packet; properties read so far are kept
+        logger.debug("XMP packet ends prematurely: {}".format(e))
+    return fields
+
+
+def read_pdf_metadata(pdf_path):
+    """
+    Reads the page count, document information dictionary and XMP metadata of a PDF file (see PdfMetadataScanner)
+    :param pdf_path: Path to PDF file
+    :return: dictionary with keys 'number_of_pages', 'info' and 'xmp'
+    :raises PdfMetadataError: if the structure of the file could not be read
+    """
+    with PdfMetadataScanner(pdf_path) as scanner:
+        try:
+            return scanner.read()
+        except PdfMetadataError:
+            raise
+        except Exception as e:
+            # malformed files may hold values of unexpected types anywhere; callers fall back to another reader
+            raise PdfMetadataError("Could not read {}: {!r}".format(pdf_path, e)) from e
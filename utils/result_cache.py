@@ -0,0 +1,103 @@
+import hashlib
+import json
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    SQLite cache of VersionDetector results, keyed on the digest of the input file, the declared metadata and the
+    version of the ruleset (patterns, metadata tags, logos) used to reach the verdict
+    """
+    def __init__(self, db_path, ruleset, ttl=None):
+        '''
+
+        :param db_path: Path to SQLite database; created if it does not exist
+        :param ruleset: String identifying the current ruleset; results stored under any other ruleset are deleted
+        :param ttl: Number of seconds after which stored results expire; if None, results never expire
+        '''
+        self.db_path = db_path
+        self.ruleset = ruleset
+        self.ttl = ttl
+        # the connection is shared by the threads of a batch worker (see detect_job_group); self.lock serialises its use
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, ruleset TEXT NOT NULL, "
+                                    "created REAL NOT NULL, result BLOB NOT NULL)")
+        self.invalidate_other_rulesets()
+
+    @staticmethod
+    def key(digest, ruleset, dec_ms_title=None, dec_version=None, dec_authors=None, metadata=None):
+        """
+        Builds the cache key of a detection
+        :param digest: SHA-256 digest of the input file
+        :param ruleset: String identifying the ruleset
+        :return: hexadecimal key
+        """
+        payload = json.dumps([digest, ruleset, dec_ms_title, dec_version, dec_authors, metadata or {}],
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        :return: Stored result or None if key is not in cache or has expired
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT created, result FROM results WHERE key = ? AND ruleset = ?",
+                                          (key, self.ruleset)).fetchone()
+        if not row:
+            return None
+        created, result = row
+        if self.ttl and (time.time() - created > self.ttl):
+            logger.debug("Cached result {} has expired".format(key))
+            return None
+        return pickle.loads(result)
+
+    def put(self, key, result):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO results (key, ruleset, created, result) "
+                                    "VALUES (?, ?, ?, ?)", (key, self.ruleset, time.time(), pickle.dumps(result)))
+
+    def invalidate(self, key=None):
+        """
+        Deletes one result, or all results if key is None
+        :return: Number of results deleted
+        """
+        with self.lock, self.connection:
+            if key:
+                cursor = self.connection.execute("DELETE FROM results WHERE key = ?", (key,))
+            else:
+                cursor = self.connection.execute("DELETE FROM results")
+        return cursor.rowcount
+
+    def invalidate_other_rulesets(self):
+        """
+        Deletes results obtained with a ruleset other than self.ruleset
+        :return: Number of results deleted
+        """
+        with self.lock, self.connection:
+            cursor = self.connection.execute("DELETE FROM results WHERE ruleset != ?", (self.ruleset,))
+        if cursor.rowcount:
+            logger.info("Deleted {} cached results obtained with a previous ruleset".format(cursor.rowcount))
+        return cursor.rowcount
+
+    def purge_expired(self):
+        """
+        Deletes expired results
+        :return: Number of results deleted
+        """
+        if not self.ttl:
+            return 0
+        with self.lock, self.connection:
+            cursor = self.connection.execute("DELETE FROM results WHERE created < ?", (time.time() - self.ttl,))
+        return cursor.rowcount
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
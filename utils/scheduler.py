@@ -0,0 +1,180 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """
+    A test (or extraction step) run by Scheduler
+    """
+    def __init__(self, name, cost, run, can_change=None, requires=(), informational=False):
+        '''
+
+        :param name: Unique name of stage
+        :param cost: Estimated cost of running stage, in arbitrary units (only compared with the cost of other stages)
+        :param run: Function that performs the stage
+        :param can_change: Function returning True if the results of this stage could still change the outcome of the
+            scheduled run. If None, the stage has no effect on the outcome by itself and only runs when a stage that
+            requires it does (or, if informational, when the stages it requires have run)
+        :param requires: Names of stages that must run before this one
+        :param informational: If True, the stage only adds details to the outcome, and runs whenever the stages it
+            requires have run for other reasons; it never causes them to run
+        '''
+        self.name = name
+        self.cost = cost
+        self.run = run
+        self.can_change = can_change
+        self.requires = list(requires)
+        self.informational = informational
+
+    def __repr__(self):
+        return "Stage object: <name={}; cost={}>".format(self.name, self.cost)
+
+
+class Scheduler:
+    """
+    Runs the stages that can still change an outcome, cheapest first (counting the cost of the stages each one
+    requires), and stops as soon as none can, so that expensive stages are skipped when cheap evidence has already
+    settled the outcome. In exhaustive mode, all stages run in the order they were given.
+
+    Stages form a dependency graph (see Stage.requires). With max_workers > 1, independent stages run concurrently on
+    threads: in exhaustive mode every stage starts as soon as the stages it requires have finished; otherwise, useful
+    stages are started concurrently as long as they cost no more than max_speculative_cost (or are the cheapest useful
+    stage left), so that expensive stages still wait for cheap ones to settle the outcome first.
+
+    Informational stages (see Stage.informational) run, cheapest first, once the stages they require have run; when
+    stages run one after another, they wait until no stage can change the outcome.
+    """
+    def __init__(self, stages, exhaustive=False, max_workers=1, max_speculative_cost=50):
+        '''
+
+        :param stages: list of Stage instances
+        :param exhaustive: If True, run all stages regardless of their effect on the outcome
+        :param max_workers: Maximum number of stages running at the same time
+        :param max_speculative_cost: Stages costing more than this (including the stages they require) are only
+            started when no cheaper useful stage is left
+        '''
+        self.stages = {s.name: s for s in stages}
+        self.order = [s.name for s in stages]
+        self.exhaustive = exhaustive
+        self.max_workers = max_workers
+        self.max_speculative_cost = max_speculative_cost
+        self.done = []
+        self.skipped = []
+
+    def pending(self):
+        return [n for n in self.order if n not in self.done]
+
+    def useful(self, name):
+        """
+        Tests if running stage could change the outcome, directly or by enabling a stage that could
+        """
+        stage = self.stages[name]
+        if stage.informational:
+            return False
+        if stage.can_change is not None:
+            return stage.can_change()
+        return any(self.useful(n) for n in self.pending() if name in self.stages[n].requires)
+
+    def total_cost(self, name):
+        """
+        :return: cost of stage plus cost of the pending stages it requires
+        """
+        return self.stages[name].cost + sum(self.total_cost(r) for r in self.stages[name].requires
+                                            if r not in self.done)
+
+    def ready_informational(self, running=()):
+        """
+        :return: names of pending informational stages whose required stages have all run, cheapest first
+        """
+        return sorted([n for n in self.pending() if self.stages[n].informational and n not in running and
+                       all(r in self.done for r in self.stages[n].requires)], key=lambda n: self.stages[n].cost)
+
+    def next_stage(self):
+        """
+        :return: name of the next stage to run, or None if no pending stage can change the outcome and no
+            informational stage is ready
+        """
+        pending = self.pending()
+        if self.exhaustive:
+            target = pending[0] if pending else None
+        else:
+            candidates = [n for n in pending if self.stages[n].can_change is not None and self.useful(n)]
+            target = min(candidates, key=self.total_cost) if candidates else None
+            if target is None:
+                informational = self.ready_informational()
+                target = informational[0] if informational else None
+        while target is not None:
+            unmet = [r for r in self.stages[target].requires if r not in self.done]
+            if not unmet:
+                return target
+            target = unmet[0]
+        return None
+
+    def startable(self, running):
+        """
+        Lists the stages that can start now, alongside the stages in running
+        :param running: names of stages currently running
+        :return: list of names of stages
+        """
+        def ready(n):
+            return (n not in running) and all(r in self.done for r in self.stages[n].requires)
+
+        pending = [n for n in self.pending() if n not in running]
+        if self.exhaustive:
+            return [n for n in pending if ready(n)]
+        targets = [n for n in pending if self.stages[n].can_change is not None and self.useful(n)]
+        startable = []
+        limit = max(self.max_speculative_cost, min((self.total_cost(n) for n in targets), default=0))
+        for target in sorted(targets, key=self.total_cost):
+            if self.total_cost(target) > limit:
+                break
+            # start target, or the prerequisites of target that are ready
+            stack = [target]
+            while stack:
+                n = stack.pop()
+                if n in self.done or n in running or n in startable:
+                    continue
+                if ready(n):
+                    startable.append(n)
+                else:
+                    stack.extend(r for r in self.stages[n].requires if r not in self.done)
+        return startable + [n for n in self.ready_informational(running) if n not in startable]
+
+    def run_concurrently(self):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            while True:
+                for name in self.startable(running.values())[:self.max_workers - len(running)]:
+                    logger.debug("Starting stage {}".format(name))
+                    running[executor.submit(self.stages[name].run)] = name
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    future.result()
+                    self.done.append(name)
+
+    def run_stage(self, name):
+        logger.debug("Running stage {}".format(name))
+        self.stages[name].run()
+        self.done.append(name)
+
+    def run(self):
+        """
+        Runs stages until the outcome is settled (or, in exhaustive mode, until all stages have run)
+        :return: list of names of stages that were skipped
+        """
+        if self.max_workers > 1:
+            self.run_concurrently()
+        else:
+            name = self.next_stage()
+            while name is not None:
+                self.run_stage(name)
+                name = self.next_stage()
+        self.skipped = self.pending()
+        if self.skipped:
+            logger.debug("Outcome settled; skipped stages {}".format(self.skipped))
+        return self.skipped
@@ -0,0 +1,120 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def peak_rss():
+    """
+    :return: peak resident set size of this process so far, in bytes, or None if it cannot be measured
+    """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT
+
+
+class StageTimer:
+    """
+    Records wall time, CPU time and peak RSS of the stages of a detection. Stages may run concurrently on threads (see
+    Scheduler), so CPU time is measured per thread; time spent in child processes (pdftotext, CERMINE) only counts as
+    wall time. Peak RSS is that of the whole process when the stage finished, so it only grows from one stage to the
+    next; a stage that raises it is the one that needed the memory.
+    """
+    def __init__(self):
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.start_counter = time.perf_counter()
+        self.start_cpu = time.process_time()
+
+    @contextmanager
+    def measure(self, name):
+        """
+        Context manager timing the code it wraps as stage name
+        """
+        start = time.time()
+        start_counter = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            timing = {'start': start, 'wall': time.perf_counter() - start_counter,
+                      'cpu': time.thread_time() - start_cpu, 'peak_rss': peak_rss(), 'thread': threading.get_ident()}
+            with self.lock:
+                self.stages[name] = timing
+
+    def wrap(self, name, function):
+        """
+        :return: function that runs function, timed as stage name
+        """
+        def timed(*args, **kwargs):
+            with self.measure(name):
+                return function(*args, **kwargs)
+        return timed
+
+    def summary(self):
+        """
+        :return: dictionary with the start time (seconds since the epoch), wall time, CPU time (of the whole process,
+            in seconds) and peak RSS (in bytes) of the detection so far, the process ID and, under 'stages', the same
+            figures for each stage, plus the thread it ran on
+        """
+        with self.lock:
+            stages = {name: dict(timing) for name, timing in self.stages.items()}
+        return {'start': self.start, 'wall': time.perf_counter() - self.start_counter,
+                'cpu': time.process_time() - self.start_cpu, 'peak_rss': peak_rss(), 'pid': os.getpid(),
+                'stages': stages}
+
+
+def trace_events(timing, name, origin=0):
+    """
+    Converts the timing of a detection (see StageTimer.summary) to Chrome trace events: one complete event for the
+    whole detection and one for each stage
+    :param name: Name of the detection (e.g. the input file name)
+    :param origin: Time, in seconds since the epoch, of the start of the trace
+    :return: list of event dictionaries
+    """
+    def event(event_name, category, t, thread, args):
+        return {'name': event_name, 'cat': category, 'ph': 'X', 'ts': round((t['start'] - origin) * 1e6),
+                'dur': round(t['wall'] * 1e6), 'pid': timing['pid'], 'tid': thread,
+                'args': {'cpu': t['cpu'], 'peak_rss': t['peak_rss'], **args}}
+
+    stages = timing.get('stages', {})
+    # the detection is drawn on the thread of its first stage, so that stages nest under it
+    first = min(stages.values(), key=lambda t: t['start'], default={'thread': 0})
+    events = [event(name, 'detection', timing, first['thread'], {})]
+    for stage, t in sorted(stages.items(), key=lambda s: s[1]['start']):
+        events.append(event(stage, 'stage', t, t['thread'], {'file': name}))
+    return events
+
+
+class ChromeTrace:
+    """
+    Collects the timings of many detections and writes them as a Chrome trace-event file, which can be opened in
+    chrome://tracing or https://ui.perfetto.dev
+    """
+    def __init__(self, path):
+        self.path = path
+        self.origin = time.time()
+        self.events = []
+
+    def add(self, timing, name):
+        if timing:
+            self.events.extend(trace_events(timing, name, origin=self.origin))
+
+    def write(self):
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+        logger.info("Wrote {} trace events to {}".format(len(self.events), self.path))